@@ -0,0 +1,212 @@
+'''Computer opponent.
+
+Places its fleet at random legal spots from placement.PlacementIndex,
+and targets with a probability-density map: every
+placement of every un-sunk ship that fits the known hits and misses adds
+one to each cell it covers, and we shoot the densest cell we haven't
+tried yet.
+
+Uses NumPy when it is installed: each ship size is scored with sliding
+window sums along every row and column, built from cumulative sums of
+blocked and hit cells, so a map costs O(cells * ships) whatever the
+board size. Without NumPy the same map is built from integer cell masks.
+
+PosteriorPlayer shoots by the exact chance each cell holds a ship, from
+solver.PosteriorSolver, and falls back to the density map while the
+board is still too open to count.
+'''
+
+import collections
+import random
+import board
+import placement
+import solver
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# ===== Constants =====
+TARGET_WEIGHT = 50 # Extra weight per known hit covered, while hunting down a wounded ship.
+SALVO_REPEATS = 4 # choose_attack() calls per salvo shot before choose_salvo() fills in untried cells itself.
+
+def board_size(check_board):
+    ''':return: (height, width) of a board.'''
+    return check_board.height, check_board.width
+
+def window_sums(grid, size):
+    ''':return: NumPy array of the sums of every size cells in a row of grid, one column per start.'''
+    rows, columns = grid.shape
+    cumulative = numpy.zeros((rows, columns + 1), dtype=numpy.int64)
+    numpy.cumsum(grid, axis=1, out=cumulative[:, 1:])
+    return cumulative[:, size:] - cumulative[:, :max(columns + 1 - size, 0)]
+
+def window_coverage(weights, size, columns):
+    ''':return: NumPy array, for each cell of each row the weights of every window of size covering it.'''
+    rows, starts = weights.shape
+    padded = numpy.zeros((rows, columns + size - 1), dtype=numpy.int64)
+    padded[:, size - 1:size - 1 + starts] = weights
+    return window_sums(padded, size)
+
+def cell_index(coordinate, width):
+    return (coordinate[0] - board.MIN_Y) * width + (coordinate[1] - board.MIN_X)
+
+def density_map(enemy_board):
+    '''Score every cell of the enemy board by how many legal placements cover it.
+    Only hit_list, miss_list and the sunk flags are used, never ship positions.
+    :return: list of scores, indexed by cell index.
+    '''
+    height, width = board_size(enemy_board)
+    hits = [cell_index(coord, width) for coord in enemy_board.get_attacks()]
+    misses = [cell_index(coord, width) for coord in enemy_board.get_misses()]
+    # Ships of the same size share placements, score each size once and weight by count.
+    sizes = collections.Counter(ship.size for ship in enemy_board.fleet if not ship.is_sunk)
+    sunk_cells = sum(ship.size for ship in enemy_board.fleet if ship.is_sunk)
+    # Hits not explained by sunk ships belong to a wounded ship, go target it.
+    targeting = len(hits) > sunk_cells
+    if numpy is not None:
+        return numpy_density(height, width, sizes, hits, misses, targeting)
+    return mask_density(height, width, sizes, hits, misses, targeting)
+
+def numpy_density(height, width, sizes, hits, misses, targeting):
+    blocked = numpy.zeros(height * width, dtype=numpy.int64)
+    blocked[misses] = 1
+    hit_cells = numpy.zeros(height * width, dtype=numpy.int64)
+    hit_cells[hits] = 1
+    if not targeting:
+        # Every hit belongs to a sunk ship, nothing else can go there.
+        blocked[hits] = 1
+    blocked = blocked.reshape(height, width)
+    hit_cells = hit_cells.reshape(height, width)
+    density = numpy.zeros((height, width), dtype=numpy.int64)
+    for size, count in sizes.items():
+        # Rows give the horizontal placements, the transposed grid the vertical ones.
+        # A ship of size 1 is the same placement both ways, count it once.
+        for transpose in ((False, True) if size > 1 else (False,)):
+            grid_blocked = blocked.T if transpose else blocked
+            grid_hits = hit_cells.T if transpose else hit_cells
+            weights = (window_sums(grid_blocked, size) == 0) * count
+            if targeting:
+                weights *= 1 + TARGET_WEIGHT * window_sums(grid_hits, size)
+            coverage = window_coverage(weights, size, grid_blocked.shape[1])
+            density += coverage.T if transpose else coverage
+    density = density.ravel()
+    density[hits] = 0
+    density[misses] = 0
+    return density.tolist()
+
+def mask_density(height, width, sizes, hits, misses, targeting):
+    hit_mask = sum(1 << cell for cell in set(hits))
+    blocked = sum(1 << cell for cell in set(misses))
+    if not targeting:
+        blocked |= hit_mask
+    density = [0] * (height * width)
+    index = placement.get_placement_index(height, width)
+    for size, count in sizes.items():
+        for option in index.placements(size):
+            mask = option.mask
+            if mask & blocked:
+                continue
+            weight = count
+            if targeting:
+                weight *= 1 + TARGET_WEIGHT * bin(mask & hit_mask).count('1')
+            for cell in board.iter_bits(mask):
+                density[cell] += weight
+    for cell in hits + misses:
+        density[cell] = 0
+    return density
+
+class AIPlayer():
+    '''Computer opponent, places a fleet and picks attacks.'''
+
+    def __init__(self, rng=None):
+        ''':param rng: random.Random instance, pass a seeded one for repeatable games.'''
+        self.rng = rng or random.Random()
+
+    def place_fleet(self, my_board):
+        '''Randomly place every ship in my_board.fleet.
+        Picks from the precomputed legal placements, so every spot passes
+        Board.check_oob and Board.check_collision.'''
+        placement.random_fleet(my_board, self.rng)
+
+    def scores(self, enemy_board):
+        ''':return: list of scores indexed by cell index, we shoot the highest untried cell.'''
+        return density_map(enemy_board)
+
+    def choose_attack(self, enemy_board):
+        ''':return: The y,x coordinate to attack next.'''
+        height, width = board_size(enemy_board)
+        density = self.scores(enemy_board)
+        best = max(density)
+        if best == 0:
+            # Nothing fits (shouldn't happen), fall back to any untried cell.
+            candidates = [cell for cell in range(height * width)
+                          if not enemy_board.is_attacked(board.bit_cell(cell, width))]
+        else:
+            candidates = [cell for cell, score in enumerate(density) if score == best]
+        return board.bit_cell(self.rng.choice(candidates), width)
+
+    def choose_salvo(self, enemy_board, count):
+        '''Pick every shot of a salvo from one density map.
+        :return: list of count different y,x coordinates, densest first.
+        '''
+        height, width = board_size(enemy_board)
+        density = self.scores(enemy_board)
+        cells = [cell for cell in range(height * width)
+                 if not enemy_board.is_attacked(board.bit_cell(cell, width))]
+        # Random tie break, so equal cells aren't always taken in board order.
+        cells.sort(key=lambda cell: (-density[cell], self.rng.random()))
+        return [board.bit_cell(cell, width) for cell in cells[:count]]
+
+class PosteriorPlayer(AIPlayer):
+    '''AIPlayer that scores cells by exact posterior probability whenever the solve fits its budget.
+    Keep one per game, the solver's cache carries over from turn to turn.
+    '''
+
+    def __init__(self, rng=None):
+        AIPlayer.__init__(self, rng)
+        self.solver = None # Built on first use, once we know the board size.
+
+    def scores(self, enemy_board):
+        height, width = board_size(enemy_board)
+        if height * width > placement.MAX_INDEX_CELLS:
+            return density_map(enemy_board)
+        if self.solver is None:
+            self.solver = solver.PosteriorSolver(height, width)
+        posterior = self.solver.solve(enemy_board)
+        if posterior is None:
+            return density_map(enemy_board)
+        scores = [0] * (height * width)
+        for cell, arrangements in posterior.coverage.items():
+            scores[cell] = arrangements
+        for coordinate in enemy_board.get_attacks():
+            scores[cell_index(coordinate, width)] = 0
+        return scores
+
+def choose_salvo(shooter, enemy_board, count):
+    '''Pick count different untried cells with any targeting strategy.
+    Uses the shooter's own choose_salvo() if it has one, otherwise asks
+    choose_attack() until it has enough different cells. choose_attack()
+    doesn't know about the shots already picked, so a deterministic one keeps
+    giving the same cell; after SALVO_REPEATS calls per shot the rest are
+    filled with random untried cells.
+    :return: list of y,x coordinates.
+    '''
+    if hasattr(shooter, 'choose_salvo'):
+        return shooter.choose_salvo(enemy_board, count)
+    height, width = board_size(enemy_board)
+    count = min(count, enemy_board.untried_cells())
+    chosen = []
+    for attempt in range(count * SALVO_REPEATS):
+        if len(chosen) == count:
+            return chosen
+        coordinate = shooter.choose_attack(enemy_board)
+        if coordinate not in chosen:
+            chosen.append(coordinate)
+    rng = getattr(shooter, 'rng', random)
+    taken = {cell_index(coordinate, width) for coordinate in chosen}
+    cells = [cell for cell in range(height * width)
+             if cell not in taken and not enemy_board.is_attacked(board.bit_cell(cell, width))]
+    chosen.extend(board.bit_cell(cell, width) for cell in rng.sample(cells, count - len(chosen)))
+    return chosen
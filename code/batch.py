@@ -0,0 +1,280 @@
+'''Many boards of the same size and fleet, kept as NumPy arrays.
+
+A Board is a handful of Python objects per game (the board, five Ships,
+their coordinate tuples, the hit and miss lists), fine for one game but
+most of the cost of a simulation that plays thousands. A BoardBatch keeps
+count boards as a struct of arrays instead:
+
+    occupancy  (count, cells) fleet index on each cell, EMPTY for water
+    hits       (count, cells) cells that were hit
+    misses     (count, cells) cells that were missed
+    remaining  (count, ships) segments each ship has left to lose
+    afloat     (count,)       ships not sunk yet
+    alive      (count,)       afloat > 0
+
+attack() resolves one shot on each of many boards with a few array
+operations, with exactly the results Board.attack() gives: a hit on an
+afloat ship, a miss on water, on an already sunk ship or off the board,
+and the fleet index when the shot sinks a ship. The one difference is that
+off board misses aren't kept, Board.attack() adds them to its miss_list.
+
+All arrays live in one buffer. With shared=True it is a
+multiprocessing.shared_memory block, worker processes attach with
+BoardBatch.attach(batch.spec()) and work on the same boards, nothing is
+pickled. Give each worker its own boards, attack() isn't atomic.
+
+Needs NumPy.
+
+To use:
+    boards = batch.BoardBatch(10000)
+    boards.random_fleets(rng)
+    hit, sunk, game_over = boards.attack(coordinates)
+'''
+
+import multiprocessing.shared_memory
+import board
+import placement
+import ships
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# ===== Constants =====
+EMPTY = -1 # occupancy of a cell without a ship.
+NOT_SUNK = -1 # attack() sunk value when nothing sank.
+ALIGNMENT = 8 # Bytes each array starts on within the buffer.
+# name, dtype, and whether there is one per cell, one per ship or one per board.
+CELLS, SHIPS, BOARDS = 'cells', 'ships', 'boards'
+FIELDS = [
+    ('occupancy', 'int16', CELLS),
+    ('hits', 'bool', CELLS),
+    ('misses', 'bool', CELLS),
+    ('remaining', 'int16', SHIPS),
+    ('afloat', 'int16', BOARDS),
+    ('alive', 'bool', BOARDS),
+]
+
+def field_layout(count, cells, ship_count):
+    '''Where each array sits in the shared buffer.
+    :return: tuple of (list of (name, dtype, shape, offset), total bytes).
+    '''
+    shapes = {CELLS: (count, cells), SHIPS: (count, ship_count), BOARDS: (count,)}
+    layout = []
+    offset = 0
+    for name, dtype, per in FIELDS:
+        shape = shapes[per]
+        layout.append((name, dtype, shape, offset))
+        size = numpy.dtype(dtype).itemsize
+        for length in shape:
+            size *= length
+        offset += -(-size // ALIGNMENT) * ALIGNMENT
+    return layout, offset
+
+class BoardBatch():
+    '''count boards, one fleet each, resolved together.'''
+
+    def __init__(self, count, width=board.MAX_X, height=board.MAX_Y, composition=None, shared=False, name=None):
+        '''Set up count empty boards, every ship unplaced.
+        :param composition: the fleet as ships.build_fleet() takes it, defaults to the standard fleet.
+        :param shared: keep the arrays in a new shared_memory block.
+        :param name: attach to the existing shared_memory block of this name instead, see attach().
+        '''
+        if numpy is None:
+            raise RuntimeError('BoardBatch needs NumPy.')
+        if not (1 <= width <= board.LARGEST_BOARD and 1 <= height <= board.LARGEST_BOARD):
+            raise ValueError(f'Board size must be between 1 and {board.LARGEST_BOARD}.')
+        self.count = count
+        self.width = width
+        self.height = height
+        # Kept so to_board() builds the same ship classes, not just the same sizes.
+        self.composition = fleet_composition(ships.build_fleet(composition))
+        self.sizes = [ship.size for ship in ships.build_fleet(self.composition)]
+        self.cells = width * height
+        layout, size = field_layout(count, self.cells, len(self.sizes))
+        self.shared_memory = None
+        if name is not None:
+            self.shared_memory = attach_shared_memory(name)
+            buffer = self.shared_memory.buf
+        elif shared:
+            self.shared_memory = multiprocessing.shared_memory.SharedMemory(create=True, size=max(1, size))
+            buffer = self.shared_memory.buf
+        else:
+            buffer = bytearray(size)
+        for field, dtype, shape, offset in layout:
+            setattr(self, field, numpy.ndarray(shape, dtype, buffer=buffer, offset=offset))
+        self.placement_cells = {} # Placement mask -> array of its cell indexes.
+        if name is None:
+            self.reset()
+
+    @classmethod
+    def attach(cls, spec):
+        ''':param spec: BoardBatch.spec() of a shared batch, from another process.'''
+        name, count, width, height, composition = spec
+        return cls(count, width, height, composition, name=name)
+
+    def spec(self):
+        ''':return: What another process passes to attach(), a small picklable tuple.'''
+        if self.shared_memory is None:
+            raise ValueError('Only a shared batch can be attached to.')
+        return self.shared_memory.name, self.count, self.width, self.height, self.composition
+
+    def close(self):
+        '''Let go of the shared buffer, call unlink() too from the process that created it.'''
+        if self.shared_memory is not None:
+            # Drop our views first, the buffer can't close while they point into it.
+            for field, dtype, per in FIELDS:
+                setattr(self, field, None)
+            self.shared_memory.close()
+
+    def unlink(self):
+        '''Free the shared buffer once every process has closed it.'''
+        if self.shared_memory is not None:
+            self.shared_memory.unlink()
+
+    # ===== Setup =====
+    def reset(self, indexes=slice(None)):
+        '''Empty the given boards: no ships placed, no shots.'''
+        self.occupancy[indexes] = EMPTY
+        self.hits[indexes] = False
+        self.misses[indexes] = False
+        self.remaining[indexes] = self.sizes
+        self.afloat[indexes] = len(self.sizes)
+        self.alive[indexes] = len(self.sizes) > 0
+
+    def random_fleets(self, rng, indexes=None):
+        '''Reset the given boards (all by default) and place a random fleet on each.
+        :param rng: random.Random, fleets come from placement.PlacementIndex.random_fleet().
+        '''
+        if indexes is None:
+            indexes = range(self.count)
+        position_index = placement.get_placement_index(self.height, self.width)
+        for index in indexes:
+            self.reset(index)
+            row = self.occupancy[index]
+            for fleet_index, choice in enumerate(position_index.random_fleet(self.sizes, rng)):
+                row[self.cells_of(choice.mask)] = fleet_index
+
+    def cells_of(self, mask):
+        cells = self.placement_cells.get(mask)
+        if cells is None:
+            cells = self.placement_cells[mask] = numpy.array(list(board.iter_bits(mask)), dtype=numpy.intp)
+        return cells
+
+    def load_board(self, index, my_board):
+        '''Copy a Board, ships, damage and shots, into board index.
+        Off board misses are left out, see to_board().'''
+        if (my_board.width, my_board.height) != (self.width, self.height):
+            raise ValueError('Board size does not match the batch.')
+        if fleet_composition(my_board.fleet) != self.composition:
+            raise ValueError('Fleet does not match the batch.')
+        self.reset(index)
+        for fleet_index, ship in enumerate(my_board.fleet):
+            for y, x in ship.coords:
+                self.occupancy[index, self.cell_index(y, x)] = fleet_index
+            self.remaining[index, fleet_index] = 0 if ship.is_sunk else ship.remaining
+        for y, x in my_board.hit_cells:
+            self.hits[index, self.cell_index(y, x)] = True
+        for y, x in my_board.miss_cells:
+            if my_board.in_bounds((y, x)):
+                self.misses[index, self.cell_index(y, x)] = True
+        self.afloat[index] = my_board.ships_afloat
+        self.alive[index] = my_board.ships_afloat > 0
+
+    def to_board(self, index, board_class=board.Board):
+        ''':return: A new Board with board index's ships, damage and shots.
+        hit_list and miss_list come out in cell order, the batch doesn't keep shot order.
+        Off board shots are not in miss_list: Board.attack() keeps them there,
+        but misses only has room for cells on the board and attack() drops them.
+        '''
+        new_board = board_class(self.width, self.height)
+        fleet = new_board.fleet = ships.build_fleet(self.composition)
+        row = self.occupancy[index]
+        hits = self.hits[index]
+        for fleet_index, ship in enumerate(fleet):
+            cells = numpy.flatnonzero(row == fleet_index)
+            ship.position_list = [board.bit_cell(int(cell), self.width) + [int(hits[cell])] for cell in cells]
+            if self.remaining[index, fleet_index] == 0 and ship.coords:
+                ship.is_sunk = True
+                ship.symbol = '*'
+        new_board.placement_changed()
+        for cell in numpy.flatnonzero(hits):
+            new_board.record_hit(board.bit_cell(int(cell), self.width))
+        for cell in numpy.flatnonzero(self.misses[index]):
+            new_board.record_miss(board.bit_cell(int(cell), self.width))
+        new_board.ships_afloat = int(self.afloat[index])
+        return new_board
+
+    def cell_index(self, y, x):
+        return (y - board.MIN_Y) * self.width + (x - board.MIN_X)
+
+    # ===== Attacks =====
+    def attack(self, coordinates, indexes=None):
+        '''Fire one shot at each of several boards, like Board.attack() on each.
+        :param coordinates: (k, 2) array-like of y,x coordinates.
+        :param indexes: the k boards to shoot at, no board twice, defaults to every board in order.
+        :return: tuple of k long arrays (hit, sunk fleet index or NOT_SUNK, every ship sunk).
+        Off board shots miss without being recorded anywhere, see to_board().
+        '''
+        coordinates = numpy.asarray(coordinates)
+        rows = numpy.arange(self.count) if indexes is None else numpy.asarray(indexes, dtype=numpy.intp)
+        y = coordinates[:, 0]
+        x = coordinates[:, 1]
+        on_board = (y >= board.MIN_Y) & (y <= self.height) & (x >= board.MIN_X) & (x <= self.width)
+        # Off board shots look at cell 0 but can never hit or be recorded.
+        cells = numpy.where(on_board, (y - board.MIN_Y) * self.width + (x - board.MIN_X), 0)
+        ship = numpy.where(on_board, self.occupancy[rows, cells], EMPTY)
+        ship_index = numpy.maximum(ship, 0)
+        # Already sunk ships can't be hit again.
+        hit = (ship != EMPTY) & (self.remaining[rows, ship_index] > 0)
+        # A second hit on a damaged segment is still a hit, but costs the ship nothing.
+        damaged = hit & ~self.hits[rows, cells]
+        self.remaining[rows[damaged], ship_index[damaged]] -= 1
+        self.hits[rows[hit], cells[hit]] = True
+        missed = on_board & ~hit
+        self.misses[rows[missed], cells[missed]] = True
+        sank = damaged & (self.remaining[rows, ship_index] == 0)
+        self.afloat[rows[sank]] -= 1
+        self.alive[rows] = self.afloat[rows] > 0
+        return hit, numpy.where(sank, ship, NOT_SUNK), ~self.alive[rows]
+
+    def untried(self, indexes=slice(None)):
+        ''':return: (boards, cells) array, True where a cell hasn't been hit or missed.'''
+        return ~(self.hits[indexes] | self.misses[indexes])
+
+def fleet_composition(fleet):
+    ''':return: The ships.build_fleet() composition that rebuilds fleet, a symbol per
+    standard ship class and a size for any other ship.'''
+    classes = {ship_class: symbol for symbol, ship_class in ships.SHIP_CLASSES.items()}
+    return [classes.get(type(ship), ship.size) for ship in fleet]
+
+def attach_shared_memory(name):
+    '''Open an existing shared_memory block without adopting it.
+    Before Python 3.13 every process that opens a block also registers it
+    for cleanup, track=False keeps that to the one that created it.
+    '''
+    try:
+        return multiprocessing.shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return multiprocessing.shared_memory.SharedMemory(name=name)
+
+def random_game_lengths(boards, rng):
+    '''Play random targeting against every board of a batch, all at once.
+    Each board is shot at its untried cells in its own random order until its fleet sinks.
+    :param boards: BoardBatch with fleets placed.
+    :param rng: numpy.random.Generator.
+    :return: array of shots each board took to sink.
+    '''
+    order = rng.random((boards.count, boards.cells)).argsort(axis=1)
+    shots = numpy.zeros(boards.count, dtype=numpy.int32)
+    playing = numpy.flatnonzero(boards.alive)
+    for turn in range(boards.cells):
+        if not len(playing):
+            break
+        cells = order[playing, turn]
+        coordinates = numpy.stack([cells // boards.width + board.MIN_Y, cells % boards.width + board.MIN_X], axis=1)
+        hit, sunk, game_over = boards.attack(coordinates, playing)
+        shots[playing] = turn + 1
+        playing = playing[~game_over]
+    return shots
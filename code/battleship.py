@@ -39,166 +39,463 @@ Notify clients who won the game.
 
 # ===== Imports =====
 import helpers
-import subprocess
+import render
 import time
-import threading
 import socket
 import board
 import ships
-import pickle
+import protocol
+import session
+import ai
+import record
+import spectate
+import placement
+import metrics
+import console
+import checkpoint
+import atexit
+import secrets
 
 # ===== Constants =====
 LOCAL_ADDRESS = '0.0.0.0' # Bind to all
 PORT = 5598 # Arbitrary
-ALL_PLACED = b'ALL PLACED'
-START_GAME = b'START GAME'
-HIT = GOOD = b'1' # Good is a "good" response, use it to tell your peer their turn is over.
-MISS = BAD = b'0' # Bad is a "bad" response, use it to ask the peer for their coordinate again.
-HM_LENGTH = 2 # First byte for hit/miss, second for fleet index of hit ship.
-ATTACK_PICKLE_BUFFER_LENGTH = 64
+DIFF_RENDER = False # Only repaint the screen lines that changed each turn.
+BOARD_WIDTH = board.MAX_X # Up to board.LARGEST_BOARD, both players must agree.
+BOARD_HEIGHT = board.MAX_Y
+FLEET_COMPOSITION = None # None for the standard five ships, or symbols and sizes for ships.build_fleet(), both players must agree.
+RECORD_FILE = 'games.rec' # Every game is appended here, see record.py to replay them.
+WAITING_MESSAGE = 'Waiting for your peer, enter "q" to quit or "v C20" to move the view.'
+METRICS_FILE = None # Set to 'metrics.json' or 'metrics.prom' to collect network metrics.
+SALVO_MODE = False # Fire one shot per ship you have afloat every turn, both players must agree.
+RULES = protocol.SALVO_RULES if SALVO_MODE else protocol.CLASSIC_RULES
+ACCEPT_TIMEOUT = helpers.ACCEPT_TIMEOUT # Seconds the host waits for someone to join.
+CONNECT_TIMEOUT = helpers.CONNECT_TIMEOUT # Seconds to reach the host.
+TURN_TIMEOUT = console.TURN_TIMEOUT # Seconds we wait for our peer's move, None waits forever.
+HEARTBEAT_INTERVAL = console.HEARTBEAT_INTERVAL # Seconds between heartbeats to our peer.
+PEER_TIMEOUT = console.PEER_TIMEOUT # Seconds without a heartbeat before our peer counts as gone.
+CHECKPOINT_FOLDER = '.' # Networked matches are saved here after every move, one file per side, to resume them.
+RESUME_TIMEOUT = 300 # Seconds to wait for our peer to come back after losing them mid match.
+# Message lengths are only hints now, frames carry their own length.
+HM_LENGTH = protocol.MESSAGES[protocol.RESULT].size
+ATTACK_BUFFER_LENGTH = protocol.MESSAGES[protocol.ATTACK].size
 
 # ===== Global Varibles =====
 user_input = '' # A string to hold our user input.
 host_flag = None
 network_data = b'' # A byte object to hold network transmissions.
+compat = False # True when the peer only speaks the old pickle protocol.
+peer_fleet = None # Board with the fleet our peer placed, once we (the host) accepted it.
+single_player = False
+computer = None # ai.AIPlayer in single player mode.
+recorder = None # record.GameRecorder for this game.
+spectators = None # spectate.SpectatorHub when hosting.
+record_writer = None # record.RecordWriter recorder writes to.
+host_address = None # (address, port) we joined, to reconnect to.
+version = None # Protocol version both sides speak.
+token = None # The match's SESSION token, when both sides can resume.
+match_checkpoint = None # checkpoint.Checkpoint this match is saved to.
 
 # ===== Code =====
+if METRICS_FILE:
+    metrics.enable(METRICS_FILE)
 # Figure out how to clear their screen, clear the terminal and present first prompt.
-clear_command = helpers.get_terminal_clear_command()
-subprocess.call(clear_command, shell=True)
+render.enable_ansi()
+render.renderer.repaint_changes = DIFF_RENDER
+helpers.clear_screen()
 print('----- Python BattleShip! -----')
 
 while True:
-    user_input = input('Enter "h" to host a match or "j" to join one: ')
+    user_input = input('Enter "h" to host a match, "j" to join one or "s" to play the computer: ')
     user_input = user_input.lower()
-    if user_input not in ('h','j'):
-        print('Invalid input, please enter "h" or "j" without quotation marks.')
+    if user_input not in ('h','j','s'):
+        print('Invalid input, please enter "h", "j" or "s" without quotation marks.')
     else:
         break
 
+# A match we played on this side and that was cut short can pick up where it left off.
+if user_input in ('h', 'j'):
+    for path in checkpoint.saved_paths(CHECKPOINT_FOLDER, user_input == 'h'):
+        try:
+            match_checkpoint = checkpoint.Checkpoint.load(path, host=user_input == 'h')
+        except (checkpoint.CheckpointError, OSError) as error:
+            print(f'Could not read a saved match: {error}')
+            continue
+        if match_checkpoint is not None:
+            break
+if match_checkpoint is not None:
+    if input('A match was cut short, enter "r" to resume it or anything else to drop it: ').lower() == 'r':
+        # Play on with the settings the match started with.
+        BOARD_WIDTH, BOARD_HEIGHT = match_checkpoint.width, match_checkpoint.height
+        RULES = match_checkpoint.rules
+        SALVO_MODE = RULES == protocol.SALVO_RULES
+    else:
+        match_checkpoint.discard()
+        match_checkpoint = None
+
 # Process host or join response.
-if user_input == 'h':
+if user_input == 's':
+    # Single player against the computer, no connection needed.
+    single_player = True
+    peer_connection = None
+    computer = ai.AIPlayer()
+elif user_input == 'h':
     # Hosting!
     host_flag = True
     helpers.notify_host(PORT)
-    peer_connection = helpers.get_client_connection(LOCAL_ADDRESS, PORT)
+    peer_connection = helpers.get_client_connection(LOCAL_ADDRESS, PORT, ACCEPT_TIMEOUT)
 #    print(peer_connection)
 else:
     # Joining!
     host_flag = False
     host_address = helpers.notify_client()
-    peer_connection = helpers.get_host_connection(host_address)
+    peer_connection = helpers.get_host_connection(host_address, CONNECT_TIMEOUT)
 #    print(peer_connection)
 
+if not single_player:
+    # From here on one selector watches the keyboard and the peer, so we see
+    # their frames (or them leaving) while we type, and can type while we wait.
+    peer_connection = console.Console(helpers.get_transport(peer_connection), protocol.encode_heartbeat(), TURN_TIMEOUT)
+    helpers.console = peer_connection
+
 # Create the boards.
-enemy_board = board.Board()
-my_board = board.Board()
-
-helpers.place_ships(enemy_board, my_board, clear_command)
-subprocess.call(clear_command, shell=True)
-helpers.render_map(enemy_board, my_board, "Waiting for peer to place ships...")
-
-# Send ready, await start message.
-# Prep your_turn variable.
-if not host_flag:
-#    peer_connection.sendall(ALL_PLACED)
-    helpers.clean_send(peer_connection, ALL_PLACED)
-    data = helpers.clean_receive(peer_connection, len(START_GAME))
-    # Client goes first.
-    your_turn = True
+# Sparse boards, memory grows with ships and shots instead of cells.
+enemy_board = board.Board(BOARD_WIDTH, BOARD_HEIGHT, ships.build_fleet(FLEET_COMPOSITION))
+my_board = board.Board(BOARD_WIDTH, BOARD_HEIGHT, ships.build_fleet(FLEET_COMPOSITION))
+# We are always player 0 in our own session, our peer is player 1.
+ME, PEER = 0, 1
+game = session.GameSession([my_board, enemy_board], salvo=SALVO_MODE)
+
+def on_waiting_input(line):
+    '''Handle a line typed while we wait for our peer.
+    :return: True if it was a command, anything else is kept for the next prompt.
+    '''
+    command = line.strip().lower()
+    if command in ('q', 'quit'):
+        print('Leaving the game.')
+        exit()
+    if not command.startswith('v '):
+        return False
+    try:
+        enemy_board.view_center = helpers.parse_coordinate(command[2:], enemy_board.width, enemy_board.height)
+    except ValueError as error:
+        print(error)
+        return True
+    helpers.render_map(enemy_board, my_board, WAITING_MESSAGE, clear=True)
+    return True
+
+if not single_player:
+    peer_connection.idle_handler = on_waiting_input
+
+def close_record():
+    recorder.finish()
+    record_writer.close()
+
+def start_recording():
+    '''Record the game, even if we quit or lose the connection part way.'''
+    global record_writer, recorder
+    if recorder is not None:
+        return
+    record_writer = record.RecordWriter(RECORD_FILE)
+    # We only know where the computer's ships are, never a peer's.
+    recorder = record.GameRecorder(record_writer, game, known=(True, single_player))
+    atexit.register(close_record)
+
+def start_checkpoint():
+    '''Save the match after every move from now on, so it can be resumed.'''
+    global match_checkpoint
+    # The host knows its peer's fleet once it has checked PLACE.
+    boards = [my_board, enemy_board if peer_fleet is None else peer_fleet]
+    try:
+        path = checkpoint.checkpoint_path(CHECKPOINT_FOLDER, host_flag, token)
+        match_checkpoint = checkpoint.Checkpoint.create(path, token, host_flag, game.first_player, RULES,
+                                                        boards, (True, peer_fleet is not None))
+    except OSError as error:
+        print(f'This match will not be saved: {error}')
+        return
+    helpers.resumable = True
+
+def save_move(events):
+    '''Checkpoint a move we just played. Once the game is over there is nothing to resume.'''
+    if match_checkpoint is None:
+        return
+    match_checkpoint.add_move(game, events)
+    if game.is_over():
+        helpers.resumable = False
+
+def check_resume(data):
+    ''':return: How many moves our peer has the results of, from its RESUME.'''
+    peer_token, peer_moves = protocol.expect(data, protocol.RESUME)
+    if peer_token != match_checkpoint.token:
+        raise protocol.ProtocolError('The other player is in a different match.')
+    return peer_moves
+
+def apply_replay(data):
+    '''Take the results of our own shots that our peer resolved while we were cut off.'''
+    moves = {}
+    for move, coordinate, hit, fleet_index in protocol.decode_replay(data):
+        moves.setdefault(move, []).append((coordinate, hit, fleet_index))
+    for move, shots in sorted(moves.items()):
+        if move != match_checkpoint.moves + 1:
+            raise protocol.ProtocolError(f'Replayed move {move} does not follow our move {match_checkpoint.moves}.')
+        if peer_fleet is not None:
+            session.check_results(peer_fleet, [coordinate for coordinate, hit, fleet_index in shots],
+                                  [(hit, fleet_index) for coordinate, hit, fleet_index in shots])
+        save_move(checkpoint.replay_move(game, ME, shots))
+
+def resume_handshake():
+    '''Swap RESUME with our peer, then each side replays the moves the other missed.
+    The joining side speaks first, like with READY.'''
+    helpers.render_map(enemy_board, my_board, 'Resuming the match...', clear=True)
+    moves = match_checkpoint.moves
+    try:
+        if host_flag:
+            peer_moves = check_resume(helpers.clean_receive(peer_connection, 0))
+            helpers.clean_send(peer_connection, protocol.encode_resume(match_checkpoint.token, moves))
+            helpers.clean_send(peer_connection, protocol.encode_replay(match_checkpoint.moves_since(peer_moves, PEER)))
+            apply_replay(helpers.clean_receive(peer_connection, 0))
+        else:
+            helpers.clean_send(peer_connection, protocol.encode_resume(match_checkpoint.token, moves))
+            peer_moves = check_resume(helpers.clean_receive(peer_connection, 0))
+            apply_replay(helpers.clean_receive(peer_connection, 0))
+            helpers.clean_send(peer_connection, protocol.encode_replay(match_checkpoint.moves_since(peer_moves, PEER)))
+    except (protocol.ProtocolError, session.SessionError) as error:
+        print(f'Could not resume the match: {error}')
+        exit()
+    peer_connection.start_heartbeats(HEARTBEAT_INTERVAL, PEER_TIMEOUT)
+    helpers.resumable = not game.is_over()
+
+def reconnect(error):
+    '''Get our peer back after losing them mid match, and catch up.'''
+    global peer_connection
+    print(f'Lost the other player ({error}), the match is saved.')
+    helpers.resumable = False # Losing them again before we are back ends the game.
+    peer_connection.close()
+    if host_flag:
+        print(f'Waiting up to {RESUME_TIMEOUT} seconds for them to come back...')
+        connection = helpers.get_client_connection(LOCAL_ADDRESS, PORT, RESUME_TIMEOUT)
+    else:
+        print(f'Trying to reach the host again for up to {RESUME_TIMEOUT} seconds...')
+        connection = helpers.reconnect_to_host(host_address, RESUME_TIMEOUT)
+    peer_connection = console.Console(helpers.get_transport(connection), protocol.encode_heartbeat(), TURN_TIMEOUT)
+    peer_connection.idle_handler = on_waiting_input
+    helpers.console = peer_connection
+    resume_handshake()
+
+if host_flag:
+    # Let people watch, spectators see us as spectate.HOST and our peer as spectate.PEER.
+    try:
+        spectators = spectate.SpectatorHub(LOCAL_ADDRESS, spectate.SPECTATOR_PORT)
+    except OSError as error:
+        print(f'No spectators this game: {error}')
+    else:
+        spectators.start()
+        spectators.broadcast(protocol.encode_watch(BOARD_WIDTH, BOARD_HEIGHT))
+        game.listeners.append(spectators.on_events)
+        atexit.register(spectators.close)
+
+if match_checkpoint is None:
+    helpers.place_ships(enemy_board, my_board)
+    game.ready(ME)
+
+if single_player:
+    computer.place_fleet(enemy_board)
+    game.ready(PEER)
+    # The human goes first.
+    game.start(ME)
+elif match_checkpoint is not None:
+    # Back where we left off, the ships stay where they were.
+    start_recording()
+    try:
+        peer_fleet = match_checkpoint.restore(game)
+    except checkpoint.CheckpointError as error:
+        print(f'Could not resume the match: {error}')
+        exit()
+    resume_handshake()
 else:
-    data = helpers.clean_receive(peer_connection, len(ALL_PLACED))
-#    print(data)
-#    peer_connection.sendall(START_GAME)
-    helpers.clean_send(peer_connection, START_GAME)
-    # Host goes second.
-    your_turn = False
-
-# Enter the game loop.
-while True:
-    subprocess.call(clear_command, shell=True)
-    if your_turn:
-        helpers.render_map(enemy_board, my_board, "Your turn, attack!")
-        print("Enter the coordinate you'd like to attack.")
-        attack_coord = []
-        while True:
-            user_input = input("Coordinate, for example, 'A1' or 'g10': ")
-            # Check for a good coordinate.
-            if user_input[0].lower() not in  ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i', 'j']:
-                print("First value in coordinate must be A-J. Example: 'C5' or 'F9'")
-                continue
+    helpers.render_map(enemy_board, my_board, "Waiting for peer to place ships...", clear=True)
+    # Send ready, await start message.
+    # Prep your_turn variable.
+    # An old peer sends/answers the raw ALL_PLACED/START_GAME strings, switch to compat mode if we see them.
+    try:
+        if not host_flag:
+            helpers.clean_send(peer_connection, protocol.encode_ready(BOARD_WIDTH, BOARD_HEIGHT, RULES, my_board.fleet))
+            data = helpers.clean_receive(peer_connection, len(protocol.START_GAME))
+            if data == protocol.START_GAME:
+                compat = True
+                protocol.check_board_size((board.MAX_X, board.MAX_Y), (BOARD_WIDTH, BOARD_HEIGHT))
+                protocol.check_rules(protocol.CLASSIC_RULES, RULES)
+                protocol.check_fleet(protocol.STANDARD_FLEET_HASH, my_board.fleet)
+                # Client goes first.
+                your_turn = True
+            else:
+                version, you_first, width, height, rules, peer_fleet_hash = protocol.expect(data, protocol.START)
+                version = protocol.negotiate(version)
+                protocol.check_board_size((width, height), (BOARD_WIDTH, BOARD_HEIGHT))
+                protocol.check_rules(rules, RULES)
+                protocol.check_fleet(peer_fleet_hash, my_board.fleet)
+                your_turn = bool(you_first)
+                if protocol.checks_placement(version):
+                    # The host checks our whole fleet before we start.
+                    helpers.render_map(enemy_board, my_board, "Sending ship placements to the host...", clear=True)
+                    helpers.submit_fleet(peer_connection, enemy_board, my_board)
+                if protocol.resumes(version):
+                    token, = protocol.expect(helpers.clean_receive(peer_connection, 0), protocol.SESSION)
+        else:
+            data = helpers.clean_receive(peer_connection, len(protocol.ALL_PLACED))
+            if data == protocol.ALL_PLACED:
+                compat = True
+                protocol.check_board_size((board.MAX_X, board.MAX_Y), (BOARD_WIDTH, BOARD_HEIGHT))
+                protocol.check_rules(protocol.CLASSIC_RULES, RULES)
+                protocol.check_fleet(protocol.STANDARD_FLEET_HASH, my_board.fleet)
+                helpers.clean_send(peer_connection, protocol.START_GAME)
+            else:
+                version, width, height, rules, peer_fleet_hash = protocol.expect(data, protocol.READY)
+                version = protocol.negotiate(version)
+                protocol.check_board_size((width, height), (BOARD_WIDTH, BOARD_HEIGHT))
+                protocol.check_rules(rules, RULES)
+                protocol.check_fleet(peer_fleet_hash, my_board.fleet)
+                # Client goes first.
+                helpers.clean_send(peer_connection, protocol.encode_start(True, BOARD_WIDTH, BOARD_HEIGHT, RULES,
+                                                                          version, my_board.fleet))
+                if protocol.checks_placement(version):
+                    peer_fleet = helpers.check_peer_fleet(peer_connection, BOARD_WIDTH, BOARD_HEIGHT, enemy_board.fleet)
+                if protocol.resumes(version):
+                    token = secrets.token_bytes(protocol.TOKEN_BYTES)
+                    helpers.clean_send(peer_connection, protocol.encode_session(token))
+            # Host goes second.
+            your_turn = False
+    except protocol.ProtocolError as error:
+        print(f'Could not start the game: {error}')
+        exit()
+    if not compat and protocol.sends_heartbeats(version):
+        peer_connection.start_heartbeats(HEARTBEAT_INTERVAL, PEER_TIMEOUT)
+    game.ready(PEER)
+    game.start(ME if your_turn else PEER)
+    if token is not None:
+        start_checkpoint()
+
+start_recording()
+
+def bad_frame(error):
+    '''Our peer sent a frame we can't make sense of mid game, there is no carrying on after that.'''
+    print(f'Bad frame from peer: {error}')
+    exit()
+
+def play_turn():
+    '''Play one move, ours or our peer's.'''
+    if game.turn == ME:
+        helpers.render_map(enemy_board, my_board, "Your turn, attack!", clear=True)
+        redraw = lambda: helpers.render_map(enemy_board, my_board, "Your turn, attack!", clear=True)
+        if SALVO_MODE:
+            salvo = helpers.prompt_salvo(enemy_board, game.shots_allowed(ME), redraw)
+        else:
+            attack_coord = helpers.prompt_attack(enemy_board, redraw=redraw)
+        if single_player:
+            if SALVO_MODE:
+                game.attack_salvo(salvo)
+            else:
+                game.attack(attack_coord)
+            return
+        if SALVO_MODE:
+            # Every shot goes in one frame and every result comes back in one.
+            helpers.clean_send(peer_connection, protocol.encode_salvo(salvo))
+            helpers.render_map(enemy_board, my_board, "Salvo fired, awaiting results...", clear=True)
             try:
-                temp = int(user_input[1:])
-            except:
-                print("Second value in coordinate must be 1-10. Example 'A10' or 'h3'")
-                continue
-            if temp < 1 or temp > 10:
-                print("Second value in coordinate must be 1-10. Example 'A10' or 'h3'")
-                continue
-            # 96 is the ascii value one lower than character 'a'.
-            # We subtract it to map the letter to our coordinate system.
-            # Also notice I swapped the coordinates.
-            # We need them in y,x pairs so I had to change the order.
-            attack_coord = [temp, ord(user_input[0].lower()) - 96]
-            # Prevent repeat attacks.
-            if attack_coord in enemy_board.hit_list or attack_coord in enemy_board.miss_list:
-                print("You already attacked there! Try another location.")
-                continue
-            break
-        serialized_coord = pickle.dumps(attack_coord)
-#        peer_connection.sendall(serialized_coord)
-        helpers.clean_send(peer_connection, serialized_coord)
-        data = helpers.clean_receive(peer_connection, HM_LENGTH)
-        # Check hit or miss
-        if data[0:1] == HIT: # Slice instead of index. Return bytestring instead of int.
-            enemy_board.hit_list.append(attack_coord)
-            # Check if a ship sank.
-            if len(data) == 2:
-                fleet_index = int.from_bytes(data[1:2], byteorder='big') # Slice instead of index. Return bytestring instead of int.
+                results = protocol.decode_salvo_result(helpers.clean_receive(peer_connection, 0))
+            except protocol.ProtocolError as error:
+                bad_frame(error)
+            # Ignore bad sunk indexes from the peer.
+            results = [(hit, fleet_index if fleet_index is not None and fleet_index < len(enemy_board.fleet) else None)
+                       for hit, fleet_index in results]
+            try:
+                if peer_fleet is not None:
+                    session.check_results(peer_fleet, salvo, results)
+                events = game.apply_salvo_result(salvo, results)
+            except session.SessionError as error:
+                print(f'Bad salvo results from peer: {error}')
+                exit()
+        else:
+            helpers.clean_send(peer_connection, protocol.encode_attack(attack_coord, compat))
+            data = helpers.clean_receive(peer_connection, HM_LENGTH)
+            # Check hit or miss
+            try:
+                hit, fleet_index = protocol.decode_result(data, compat)
+            except protocol.ProtocolError as error:
+                bad_frame(error)
+            if fleet_index is not None and fleet_index >= len(enemy_board.fleet):
+                fleet_index = None # Ignore a bad sunk index from the peer.
+            if peer_fleet is not None:
                 try:
-                    enemy_board.fleet[fleet_index].is_sunk = True
-                    enemy_board.fleet[fleet_index].symbol = '*'
-                except:
-                    pass
+                    session.check_results(peer_fleet, [attack_coord], [(hit, fleet_index)])
+                except session.SessionError as error:
+                    print(f'Bad result from peer: {error}')
+                    exit()
+            events = game.apply_result(attack_coord, hit, fleet_index)
+        save_move(events)
+        # The loser confirms the game is over.
+        if not compat and game.is_over():
+            try:
+                protocol.expect(helpers.clean_receive(peer_connection, HM_LENGTH), protocol.GAME_OVER)
+            except protocol.ProtocolError as error:
+                bad_frame(error)
+    elif single_player:
+        if SALVO_MODE:
+            game.attack_salvo(ai.choose_salvo(computer, my_board, game.shots_allowed(PEER)))
         else:
-            enemy_board.miss_list.append(attack_coord)
-        your_turn = False
+            game.attack(computer.choose_attack(my_board))
     else:
-        # Wait for the attack, deserialize, and check for damage.
-        helpers.render_map(enemy_board, my_board, "Not your turn, awaiting peer attack...")
+        # Wait for the attack, decode, and check for damage.
+        helpers.render_map(enemy_board, my_board, "Not your turn, awaiting peer attack...", clear=True)
         print("Peer's turn, waiting for their attack...")
-        serialized_coord = helpers.clean_receive(peer_connection, ATTACK_PICKLE_BUFFER_LENGTH)
-        coord = pickle.loads(serialized_coord)
-        is_hit = my_board.attack(coord)
-        if is_hit:
-            if type(is_hit) == tuple:
-                fleet_index = is_hit[1].to_bytes(1, byteorder='big')
-#                peer_connection.sendall(HIT+fleet_index)
-                helpers.clean_send(peer_connection, HIT+fleet_index)
+        data = helpers.clean_receive(peer_connection, ATTACK_BUFFER_LENGTH)
+        try:
+            if SALVO_MODE:
+                events = game.attack_salvo(protocol.decode_salvo(data))
+                reply = protocol.encode_salvo_result(session.events_results(events))
             else:
-#                peer_connection.sendall(HIT)
-                helpers.clean_send(peer_connection, HIT)
-        else:
-#            peer_connection.sendall(MISS)
-            helpers.clean_send(peer_connection, MISS)
-        your_turn = True
-
-    # Win Condition - Loser until proven unlost. A single unsunk ship will do it.
-    i_lost = True
-    for ship in my_board.fleet:
-        if not ship.is_sunk:
-            i_lost = False
-    if i_lost:
-        helpers.render_map(enemy_board, my_board, "You have been defeated! Your peer won!")
-        break
+                events = game.attack(protocol.decode_attack(data, compat))
+                reply = protocol.encode_result(session.events_result(events), compat)
+        except session.SessionError as error:
+            print(f'Bad attack from peer: {error}')
+            exit()
+        except protocol.ProtocolError as error:
+            bad_frame(error)
+        # Saved before we answer, so a peer that missed the answer can get it again.
+        save_move(events)
+        helpers.clean_send(peer_connection, reply)
+        if not compat and game.is_over():
+            helpers.clean_send(peer_connection, protocol.encode_game_over(you_won=True))
 
-    peer_lost = True
-    for ship in enemy_board.fleet:
-        if not ship.is_sunk:
-            peer_lost = False
-    if peer_lost:
-        helpers.render_map(enemy_board, my_board, "You won! You have defeated your peer!")
-        break
+# Enter the game loop, picking the match back up if we lose our peer part way.
+while not game.is_over():
+    try:
+        play_turn()
+    except helpers.PeerGone as error:
+        reconnect(error)
+
+# Nothing left to resume.
+if match_checkpoint is not None:
+    match_checkpoint.discard()
+
+# Show each other our fleets, then pass both on to spectators.
+if not single_player and not compat:
+    helpers.clean_send(peer_connection, protocol.encode_fleet(my_board.fleet))
+    try:
+        player, layout = protocol.decode_fleet(helpers.clean_receive(peer_connection, 0))
+        placement.apply_layout(enemy_board, layout)
+    except protocol.ProtocolError:
+        pass # Keep the game result, we just can't show their ships.
+if spectators is not None:
+    spectators.broadcast(protocol.encode_fleet(my_board.fleet, spectate.HOST))
+    if all(ship.coords for ship in enemy_board.fleet):
+        spectators.broadcast(protocol.encode_fleet(enemy_board.fleet, spectate.PEER))
+
+# Win Condition - The session knows who sank the other fleet first.
+opponent_name = 'the computer' if single_player else 'your peer'
+if game.winner == PEER:
+    helpers.render_map(enemy_board, my_board, f"You have been defeated! {opponent_name.capitalize()} won!")
+else:
+    helpers.render_map(enemy_board, my_board, f"You won! You have defeated {opponent_name}!")
 
 # Improvements
 #  Sinks reported on attacking side but symbol doesn't change to '*'.
@@ -0,0 +1,259 @@
+'''Benchmarks for the hot paths.
+
+Times Board.attack, Ship.damage_ship, Board.check_collision, AI moves,
+helpers.render_map, clean_send/clean_receive over a socketpair, whole
+games and, with NumPy, whole batch.BoardBatch batches of games, on fixed
+seeds and at several board sizes. Reports ops/sec, p50 and p99 per
+operation, saves the results as JSON and can fail when a
+benchmark got slower than a saved baseline.
+
+To run:
+    python3 bench.py --out bench.json
+    python3 bench.py --baseline bench.json --threshold 0.2
+'''
+
+import argparse
+import fnmatch
+import io
+import json
+import platform
+import random
+import socket
+import sys
+import time
+import ai
+import batch
+import board
+import helpers
+import metrics
+import netgame
+import placement
+import protocol
+import render
+import simulate
+
+# ===== Constants =====
+SAMPLES = 20000 # Timed operations per benchmark.
+GAME_SAMPLES = 200 # Whole games are slower, take fewer.
+THRESHOLD = 0.2 # Fail when ops/sec drops more than this fraction below the baseline.
+BOARD_SIZES = [10, 20, 50]
+BATCH_BOARDS = 100 # Boards per batch.random_games sample.
+
+class Samples():
+    '''Collects per-operation timings until we have enough.'''
+
+    def __init__(self, count):
+        self.count = count
+        self.times = []
+
+    def full(self):
+        return len(self.times) >= self.count
+
+    def time(self, function, *args):
+        '''Call function(*args), recording how long it took. Return its result.'''
+        start = time.perf_counter_ns()
+        result = function(*args)
+        self.times.append(time.perf_counter_ns() - start)
+        return result
+
+    def result(self):
+        times = sorted(self.times)
+        total = sum(times)
+        return {
+            'ops': len(times),
+            'ops_per_sec': len(times) / (total / 1e9) if total else 0,
+            'p50_us': times[len(times) // 2] / 1000,
+            'p99_us': times[min(len(times) - 1, len(times) * 99 // 100)] / 1000,
+        }
+
+# ===== Benchmarks =====
+def new_board(size, rng):
+    ''':return: A size x size BitBoard with a random fleet.'''
+    my_board = board.BitBoard(size, size)
+    placement.random_fleet(my_board, rng)
+    return my_board
+
+def all_cells(size, rng):
+    cells = [[y, x] for y in range(1, size + 1) for x in range(1, size + 1)]
+    rng.shuffle(cells)
+    return cells
+
+def bench_board_attack(size, rng, samples):
+    '''Board.attack on every cell of fresh boards.'''
+    while not samples.full():
+        my_board = new_board(size, rng)
+        for coordinate in all_cells(size, rng):
+            samples.time(my_board.attack, coordinate)
+
+def bench_damage_ship(size, rng, samples):
+    '''Ship.damage_ship with a mix of hits and misses.'''
+    while not samples.full():
+        my_board = new_board(size, rng)
+        ship = my_board.fleet[-1]
+        coordinates = ship.get_positions() + all_cells(size, rng)[:ship.size * 4]
+        rng.shuffle(coordinates)
+        for coordinate in coordinates:
+            samples.time(ship.damage_ship, coordinate)
+
+def bench_check_collision(size, rng, samples):
+    '''Board.check_collision for every ship of a placed fleet.'''
+    while not samples.full():
+        my_board = new_board(size, rng)
+        for ship in my_board.fleet:
+            samples.time(my_board.check_collision, ship)
+
+def bench_render_map(size, rng, samples):
+    '''A full helpers.render_map frame, written to memory.'''
+    stream = io.StringIO()
+    renderer_stream = render.renderer.stream
+    render.renderer.stream = stream
+    try:
+        while not samples.full():
+            enemy_board = new_board(size, rng)
+            my_board = new_board(size, rng)
+            for coordinate in all_cells(size, rng)[:size * size // 2]:
+                enemy_board.attack(coordinate)
+                my_board.attack(coordinate)
+            for attempt in range(50):
+                samples.time(helpers.render_map, enemy_board, my_board, 'Benchmark', True)
+                stream.seek(0)
+                stream.truncate()
+    finally:
+        render.renderer.stream = renderer_stream
+
+def bench_send_receive(size, rng, samples):
+    '''One attack frame and its result frame through clean_send/clean_receive on a socketpair.'''
+    left, right = socket.socketpair()
+    attack = protocol.encode_attack([size, size])
+    result = protocol.encode_result((True, 4))
+
+    def round_trip():
+        helpers.clean_send(left, attack)
+        helpers.clean_receive(right, len(attack))
+        helpers.clean_send(right, result)
+        helpers.clean_receive(left, len(result))
+    try:
+        while not samples.full():
+            samples.time(round_trip)
+    finally:
+        left.close()
+        right.close()
+
+def bench_send_receive_metrics(size, rng, samples):
+    '''bench_send_receive with metrics.enable(), to see what collecting costs.'''
+    collector = metrics.collector
+    metrics.enable()
+    try:
+        bench_send_receive(size, rng, samples)
+    finally:
+        metrics.collector = collector
+
+def bench_full_game(size, rng, samples, players=(('random', 'random'), ('random', 'random'))):
+    '''A whole game between two simulate.py players.'''
+    while not samples.full():
+        samples.time(simulate.play_game, players, rng, len(samples.times) % 2)
+
+def bench_density_game(size, rng, samples):
+    bench_full_game(size, rng, samples, (('random', 'density'), ('random', 'density')))
+
+def bench_posterior_move(size, rng, samples):
+    '''ai.PosteriorPlayer.choose_attack every turn of whole games, one player per game like simulate.py.'''
+    while not samples.full():
+        enemy_board = new_board(size, rng)
+        shooter = ai.PosteriorPlayer(rng)
+        while not enemy_board.all_sunk() and not samples.full():
+            enemy_board.attack(samples.time(shooter.choose_attack, enemy_board))
+
+def bench_batch_games(size, rng, samples):
+    '''Random targeting against BATCH_BOARDS boards to the end, in one batch.BoardBatch.'''
+    boards = batch.BoardBatch(BATCH_BOARDS, size, size)
+    numpy_rng = batch.numpy.random.default_rng(rng.randrange(2 ** 32))
+    while not samples.full():
+        boards.random_fleets(rng)
+        samples.time(batch.random_game_lengths, boards, numpy_rng)
+
+def bench_protocol_game(size, rng, samples, backend='queue'):
+    '''A whole random game over the network protocol, the host on a thread.'''
+    players = (('random', 'random'), ('random', 'random'))
+    while not samples.full():
+        samples.time(netgame.play_local_match, players, rng, backend, size, size)
+
+def bench_protocol_game_socketpair(size, rng, samples):
+    bench_protocol_game(size, rng, samples, 'socketpair')
+
+# name -> (function, board sizes, samples)
+BENCHMARKS = {
+    'board.attack': (bench_board_attack, BOARD_SIZES, SAMPLES),
+    'ship.damage_ship': (bench_damage_ship, BOARD_SIZES, SAMPLES),
+    'board.check_collision': (bench_check_collision, BOARD_SIZES, SAMPLES),
+    'helpers.render_map': (bench_render_map, [10], SAMPLES // 10),
+    'helpers.clean_send_receive': (bench_send_receive, [10], SAMPLES),
+    'helpers.clean_send_receive_metrics': (bench_send_receive_metrics, [10], SAMPLES),
+    'game.random': (bench_full_game, [10], GAME_SAMPLES),
+    'game.density': (bench_density_game, [10], GAME_SAMPLES // 4),
+    'ai.posterior_move': (bench_posterior_move, [10], GAME_SAMPLES * 5),
+    'game.protocol_queue': (bench_protocol_game, [10], GAME_SAMPLES),
+    'game.protocol_socketpair': (bench_protocol_game_socketpair, [10], GAME_SAMPLES),
+}
+if batch.numpy is not None:
+    BENCHMARKS['batch.random_games'] = (bench_batch_games, [10], GAME_SAMPLES)
+
+def run(pattern='*', scale=1.0):
+    '''Run every benchmark whose name matches pattern.
+    :param scale: multiply sample counts, use less than 1 for a quick run.
+    :return: dict of "name[size]" -> result dict.
+    '''
+    results = {}
+    for name, (function, sizes, count) in BENCHMARKS.items():
+        for size in sizes:
+            key = f'{name}[{size}]'
+            if not fnmatch.fnmatch(key, pattern):
+                continue
+            samples = Samples(max(1, int(count * scale)))
+            function(size, random.Random(key), samples)
+            results[key] = samples.result()
+            print(f"{key:36} {results[key]['ops_per_sec']:>12.0f} ops/s "
+                  f"p50 {results[key]['p50_us']:>9.2f}us p99 {results[key]['p99_us']:>9.2f}us", flush=True)
+    return results
+
+def compare(results, baseline, threshold=THRESHOLD):
+    '''Check results against a baseline.
+    :return: list of regression messages, empty if nothing got slower than threshold allows.
+    '''
+    regressions = []
+    for key, result in results.items():
+        before = baseline.get(key)
+        if not before or not before['ops_per_sec']:
+            continue
+        change = result['ops_per_sec'] / before['ops_per_sec'] - 1
+        if change < -threshold:
+            regressions.append(f'{key}: {before["ops_per_sec"]:.0f} -> {result["ops_per_sec"]:.0f} ops/s ({change:+.1%})')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the battleship hot paths.')
+    parser.add_argument('--only', default='*', help='glob of benchmark names, e.g. "board.*"')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply sample counts')
+    parser.add_argument('--out', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file from an earlier --out to compare against')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='allowed ops/sec drop as a fraction, default %(default)s')
+    args = parser.parse_args()
+
+    results = run(args.only, args.scale)
+    if args.out:
+        with open(args.out, 'w') as output:
+            json.dump({'python': platform.python_version(), 'platform': sys.platform,
+                       'results': results}, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('Regressions:')
+            print('\n'.join(regressions))
+            sys.exit(1)
+        print(f'No regressions beyond {args.threshold:.0%}.')
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,49 @@
-MIN_X, MIN_Y, MAX_X, MAX_Y = 1,1,10,10 # 10 by 10.
+MIN_X, MIN_Y, MAX_X, MAX_Y = 1,1,10,10 # 10 by 10, the default board size.
+LARGEST_BOARD = 1000 # Biggest width or height we support.
 
 import ships
 
 class Board():
     '''Variables and functions associated with player boards.'''
 
-    def __init__(self):
+    def __init__(self, width=MAX_X, height=MAX_Y, fleet=None):
         '''Initialize the board with the player's fleet.
-        fleet should be a list of ship objects.
+        width and height are the board size, up to LARGEST_BOARD.
+        fleet should be a list of ship objects, defaults to the standard five.
         hit_list should be a list of y,x coordinate lists of hit attacks.
         miss_list should be a list of y,x coordinate lists of missed attacks.
+        Storage grows with ships and shots, never with the number of cells.
         '''
-        self.fleet = [ships.Destroyer(), ships.Submarine(), ships.Cruiser(), ships.BattleShip(), ships.AircraftCarrier()]
+        if not (1 <= width <= LARGEST_BOARD and 1 <= height <= LARGEST_BOARD):
+            raise ValueError(f'Board size must be between 1 and {LARGEST_BOARD}.')
+        self.width = width
+        self.height = height
+        if fleet is None:
+            fleet = ships.build_fleet()
+        self.fleet = fleet
         self.hit_list = []
         self.miss_list = []
+        # Sets of (y, x) tuples for constant time lookups, same contents as the lists.
+        self.hit_cells = set()
+        self.miss_cells = set()
+        self.last_shot = None # Most recent attacked coordinate, hit or miss.
+        self.view_center = None # Cell the rendered view centers on, None follows last_shot.
+        # (y, x) -> (fleet index, segment), built on first attack since ships move during placement.
+        self.cell_map = None
+        self.ships_afloat = len(self.fleet)
+
+    def placement_changed(self):
+        '''Called when ships are moved, drop lookups built from the old positions.'''
+        self.cell_map = None
+
+    def get_cell_map(self):
+        ''':return: dict of (y, x) to (fleet index, segment) for every ship cell.'''
+        if self.cell_map is None:
+            self.cell_map = {}
+            for fleet_index, ship in enumerate(self.fleet):
+                for segment, position in enumerate(ship.coords):
+                    self.cell_map[position] = (fleet_index, segment)
+        return self.cell_map
 
     def check_oob(self, ship):
         '''make sure the ship is within our map boundaries.
@@ -21,11 +51,13 @@ class Board():
         :param ship: a specific ship to check.
         :return: True if ship is in good position. False if out-of-bounds.
         '''
+        # A ship is being (re)placed, rebuild lookups on next use.
+        self.placement_changed()
         for pos in ship.get_positions():
             if (pos[0] < MIN_Y
-                    or pos[0] > MAX_Y
+                    or pos[0] > self.height
                     or pos[1] < MIN_X
-                    or pos[1] > MAX_X):
+                    or pos[1] > self.width):
                 return False
         return True
 
@@ -34,35 +66,52 @@ class Board():
         :param check_ship: a specific ship to check.
         :return: True if ship is not overlapping another ship. False otherwise.
         '''
-        check_positions = check_ship.get_positions()
+        self.placement_changed()
+        occupied = set()
         for ship in self.fleet:
             # Skip myself.
             if ship == check_ship:
                 continue
-            positions = ship.get_positions()
-            for position in check_positions:
-                if position in positions:
-                    return False
-        return True
+            occupied.update(ship.coords)
+        return occupied.isdisjoint(check_ship.coords)
 
     def attack(self, coordinate):
-        '''Add the coordinate to our hit_list.
+        '''Add the coordinate to our hit_list or miss_list.
+        One dict lookup finds the ship and segment that was hit.
         :param coordinate: y,x coordinate pair.
         Returns true if we hit a ship, false if we missed.
             If we hit and sank a ship, return a tuple of (True, index of ship)
         '''
-        for ship in self.fleet:
-            # Don't worry about already sunk ships.
-            if ship.is_sunk:
-                continue
-            if ship.damage_ship(coordinate):
-                self.hit_list.append(coordinate)
-                if ship.is_sunk:
-                    fleet_index = self.fleet.index(ship)
-                    return (True, fleet_index)
-                return True
-        self.miss_list.append(coordinate)
-        return False
+        target = self.get_cell_map().get((coordinate[0], coordinate[1]))
+        # Already sunk ships can't be hit again.
+        if target is None or self.fleet[target[0]].is_sunk:
+            self.record_miss(coordinate)
+            return False
+        fleet_index, segment = target
+        ship = self.fleet[fleet_index]
+        ship.damage_segment(segment)
+        self.record_hit(coordinate)
+        if ship.is_sunk:
+            self.ships_afloat -= 1
+            return (True, fleet_index)
+        return True
+
+    def attack_salvo(self, coordinates):
+        '''Resolve every shot of a salvo in one go.
+        Shots after the last ship sinks are not fired.
+        :param coordinates: list of y,x coordinate pairs.
+        :return: List of attack() results, one per shot fired.
+        '''
+        results = []
+        for coordinate in coordinates:
+            results.append(self.attack(coordinate))
+            if self.ships_afloat == 0:
+                break
+        return results
+
+    def untried_cells(self):
+        ''':return: How many cells haven't been attacked yet.'''
+        return self.width * self.height - len(self.hit_cells) - len(self.miss_cells)
 
     def get_attacks(self):
         ''':return: The list of attacked coordinates.'''
@@ -74,3 +123,142 @@ class Board():
 
     def get_misses(self):
         return self.miss_list
+
+    def is_hit(self, coordinate):
+        ''':return: True if coordinate is in our hit_list.'''
+        return (coordinate[0], coordinate[1]) in self.hit_cells
+
+    def is_miss(self, coordinate):
+        ''':return: True if coordinate is in our miss_list.'''
+        return (coordinate[0], coordinate[1]) in self.miss_cells
+
+    def in_bounds(self, coordinate):
+        ''':return: True if coordinate is on this board.'''
+        return MIN_Y <= coordinate[0] <= self.height and MIN_X <= coordinate[1] <= self.width
+
+    def is_attacked(self, coordinate):
+        ''':return: True if coordinate was already hit or missed.'''
+        return self.is_hit(coordinate) or self.is_miss(coordinate)
+
+    def record_hit(self, coordinate):
+        '''Record a hit reported by our peer (used on the enemy board,
+            where we don't know the ship positions).'''
+        self.hit_list.append(coordinate)
+        self.hit_cells.add((coordinate[0], coordinate[1]))
+        self.last_shot = coordinate
+
+    def record_miss(self, coordinate):
+        '''Record a miss reported by our peer.'''
+        self.miss_list.append(coordinate)
+        self.miss_cells.add((coordinate[0], coordinate[1]))
+        self.last_shot = coordinate
+
+    def mark_sunk(self, fleet_index):
+        '''Flag a ship as sunk without knowing its positions.
+        :param fleet_index: index of the ship in our fleet.
+        '''
+        ship = self.fleet[fleet_index]
+        if not ship.is_sunk:
+            self.ships_afloat -= 1
+        ship.is_sunk = True
+        ship.symbol = '*'
+
+    def all_sunk(self):
+        ''':return: True if every ship in the fleet has been sunk.'''
+        return self.ships_afloat == 0
+
+
+def cell_bit(coordinate, width=MAX_X):
+    '''Map a y,x coordinate onto a single bit.
+    :param coordinate: y,x coordinate pair (1 based).
+    :param width: number of columns on the board.
+    :return: An integer with exactly one bit set.
+    '''
+    return 1 << ((coordinate[0] - MIN_Y) * width + (coordinate[1] - MIN_X))
+
+def bit_cell(bit_index, width=MAX_X):
+    ''':return: The [y, x] coordinate of a bit index, inverse of cell_bit().'''
+    return [bit_index // width + MIN_Y, bit_index % width + MIN_X]
+
+def iter_bits(mask):
+    '''Yield the index of every set bit in mask, lowest first.'''
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class BitBoard(Board):
+    '''A Board that keeps hits, misses and ship occupancy as integer bitmasks.
+    One bit per cell, so hit tests and overlap checks are single bitwise
+    operations. hit_list and miss_list are still kept so
+    get_attacks()/get_misses() work as before.
+    Masks cost one bit per cell, for very large boards the plain Board
+    uses less memory.
+    '''
+
+    def __init__(self, width=MAX_X, height=MAX_Y, fleet=None):
+        '''Initialize the board.
+        :param width: number of columns.
+        :param height: number of rows.
+        :param fleet: list of ship objects, defaults to the standard five.
+        '''
+        Board.__init__(self, width, height, fleet)
+        self.hit_mask = 0
+        self.miss_mask = 0
+        self.ship_masks = None # Built lazily, ships may be re-placed until the first attack.
+
+    def placement_changed(self):
+        Board.placement_changed(self)
+        self.ship_masks = None
+
+    def ship_mask(self, ship):
+        ''':return: The occupancy mask of a single ship.'''
+        mask = 0
+        width = self.width
+        for y, x in ship.coords:
+            mask |= 1 << ((y - MIN_Y) * width + (x - MIN_X))
+        return mask
+
+    def get_ship_masks(self):
+        ''':return: List of occupancy masks, one per fleet index.'''
+        if self.ship_masks is None:
+            self.ship_masks = [self.ship_mask(ship) for ship in self.fleet]
+        return self.ship_masks
+
+    def fleet_mask(self):
+        ''':return: Mask of every cell covered by a ship.'''
+        mask = 0
+        for ship_mask in self.get_ship_masks():
+            mask |= ship_mask
+        return mask
+
+    def check_collision(self, check_ship):
+        '''make sure the ship coordinates don't overlap another ship.
+        :param check_ship: a specific ship to check.
+        :return: True if ship is not overlapping another ship. False otherwise.
+        '''
+        self.placement_changed()
+        others = 0
+        for ship in self.fleet:
+            if ship != check_ship:
+                others |= self.ship_mask(ship)
+        return not (others & self.ship_mask(check_ship))
+
+    def is_hit(self, coordinate):
+        return bool(self.hit_mask & cell_bit(coordinate, self.width))
+
+    def is_miss(self, coordinate):
+        return bool(self.miss_mask & cell_bit(coordinate, self.width))
+
+    def is_attacked(self, coordinate):
+        return bool((self.hit_mask | self.miss_mask) & cell_bit(coordinate, self.width))
+
+    def record_hit(self, coordinate):
+        Board.record_hit(self, coordinate)
+        self.hit_mask |= cell_bit(coordinate, self.width)
+
+    def record_miss(self, coordinate):
+        Board.record_miss(self, coordinate)
+        self.miss_mask |= cell_bit(coordinate, self.width)
+
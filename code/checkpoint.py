@@ -0,0 +1,315 @@
+'''Crash-safe checkpoints of a networked match, to resume it after a drop.
+
+A checkpoint file is written once when the match starts and then only
+updated in place through mmap, one move at a time. Its size is fixed by
+the board size and fleet, so nothing is ever rewritten or grows:
+
+    HEADER      magic, version, width, height, ships, rules, host, first player, token, crc32
+    SHIP * 2n   our fleet then our peer's, as record.SHIP (NOT_PLACED if we never saw it)
+    SLOT * 2    move number, turn, state, shots, crc32
+    SHOT * max  move number, player, y, x, hit, sunk fleet index or NO_SUNK
+
+The SHOT entries are both boards' hit_list and miss_list, in the order
+the shots were fired. There is room for every cell of both boards.
+
+After each move its shots go into the next free SHOT entries and are
+flushed, and only then is the move counted in a SLOT. The two SLOTs take
+turns (odd moves, even moves) and carry their own crc32. A crash half
+way through a move leaves either its shots uncounted or a torn slot with
+a bad crc, and load() falls back to the other slot and the move before.
+
+Player numbers are from our own GameSession, 0 is us and 1 our peer.
+
+Each side of each match has its own file, match-host-<token>.ckpt or
+match-join-<token>.ckpt, so two players running from one folder never
+overwrite each other's, and load() refuses a file saved by the other side.
+'''
+
+import glob
+import mmap
+import os
+import struct
+import zlib
+import board
+import placement
+import protocol
+import record
+import session
+import ships
+
+# ===== Constants =====
+MAGIC = b'BSCK'
+VERSION = 1
+HEADER = struct.Struct(f'!4sBHHHBBB{protocol.TOKEN_BYTES}sI') # ..., crc32 of the header and fleets
+SLOT = struct.Struct('!IBBII') # move number, turn, state, shots, crc32 of the rest of the slot
+SHOT = struct.Struct('!IBHHBB') # move number, player, y, x, hit, sunk fleet index
+SLOTS = 2
+NO_SUNK = 0xFF
+PLAYING, FINISHED = 1, 2 # Slot states.
+ROLES = {True: 'host', False: 'join'}
+FILE_NAME = 'match-{role}-{token}.ckpt'
+
+class CheckpointError(Exception):
+    '''Raised for files that aren't checkpoints or are damaged beyond use.'''
+
+
+def checkpoint_path(folder, host, token):
+    ''':return: Where our side of the match with this SESSION token is saved.'''
+    return os.path.join(folder, FILE_NAME.format(role=ROLES[host], token=token.hex()))
+
+def saved_paths(folder, host):
+    ''':return: list of checkpoint paths for our side (host or joining) in folder, newest first.'''
+    paths = glob.glob(os.path.join(glob.escape(folder), FILE_NAME.format(role=ROLES[host], token='*')))
+    return sorted(paths, key=os.path.getmtime, reverse=True)
+
+def file_size(width, height, ship_count):
+    ''':return: Bytes in a checkpoint for this board size and fleet.'''
+    return (HEADER.size + 2 * ship_count * record.SHIP.size + SLOTS * SLOT.size
+            + 2 * width * height * SHOT.size)
+
+def pack_slot(moves, turn, state, shot_count):
+    fields = SLOT.pack(moves, turn, state, shot_count, 0)[:-4]
+    return fields + zlib.crc32(fields).to_bytes(4, byteorder='big')
+
+def decode_layout(data, offset, count):
+    ''':return: list of (size, [y, x], direction) from record.SHIP entries, direction record.NOT_PLACED if unknown.'''
+    layout = []
+    for index in range(count):
+        size, label, y, x, direction = record.SHIP.unpack_from(data, offset + index * record.SHIP.size)
+        layout.append((size, [y, x], direction))
+    return layout
+
+def move_shots(events):
+    ''':return: list of (player, [y, x], hit, sunk fleet index or None), one per shot in events.'''
+    shots = []
+    for event in events:
+        if event.kind in (session.HIT, session.MISS):
+            shots.append([event.player, event.coordinate, event.kind == session.HIT, None])
+        elif event.kind == session.SUNK:
+            shots[-1][3] = event.fleet_index
+    return [tuple(shot) for shot in shots]
+
+def replay_move(game, player, shots):
+    '''Play one recorded move into game.
+    Shots at a board whose fleet is placed are resolved on it, shots at our
+    peer's board (fleet unknown) take the recorded results.
+    :param shots: list of ([y, x], hit, sunk fleet index or None), the whole move.
+    :return: The move's events. Raise session.SessionError if the move breaks the rules.
+    '''
+    target = game.boards[1 - player]
+    coordinates = [coordinate for coordinate, hit, fleet_index in shots]
+    if all(ship.coords for ship in target.fleet):
+        if game.salvo:
+            return game.attack_salvo(coordinates, player)
+        return game.attack(coordinates[0], player)
+    for coordinate, hit, fleet_index in shots:
+        if fleet_index is not None and fleet_index >= len(target.fleet):
+            raise session.SessionError(f'No ship {fleet_index} to sink.')
+    if game.salvo:
+        return game.apply_salvo_result(coordinates, [(hit, fleet_index) for coordinate, hit, fleet_index in shots],
+                                       player)
+    coordinate, hit, fleet_index = shots[0]
+    return game.apply_result(coordinate, hit, fleet_index, player)
+
+class Checkpoint():
+    '''One match's checkpoint file, mapped and kept up to date move by move.'''
+
+    def __init__(self, path, file, mapped):
+        self.path = path
+        self.file = file
+        self.map = mapped
+        (magic, version, self.width, self.height, self.ship_count, self.rules, host, self.first_player,
+         self.token, crc) = HEADER.unpack_from(mapped)
+        self.host = bool(host)
+        fleets_offset = HEADER.size
+        self.slots_offset = fleets_offset + 2 * self.ship_count * record.SHIP.size
+        self.shots_offset = self.slots_offset + SLOTS * SLOT.size
+        self.max_shots = 2 * self.width * self.height
+        self.layouts = [decode_layout(mapped, fleets_offset + player * self.ship_count * record.SHIP.size,
+                                      self.ship_count) for player in range(2)]
+        self.moves = 0 # Moves finished, the sequence number peers compare when resuming.
+        self.turn = self.first_player
+        self.state = PLAYING
+        self.shot_count = 0
+
+    @classmethod
+    def create(cls, path, token, host, first_player, rules, boards, known=(True, False)):
+        '''Start a new checkpoint for a match that is about to begin, replacing any old one.
+        :param token: the match's SESSION token.
+        :param host: True if we host, and wait for our peer to come back rather than reconnect.
+        :param boards: our board then one with our peer's fleet, placed if we know it.
+        :param known: for each board, whether we know where its ships are.
+        '''
+        width, height = boards[0].width, boards[0].height
+        ship_count = len(boards[0].fleet)
+        fleets = b''.join(record.encode_fleet(fleet_board.fleet, is_known)
+                          for fleet_board, is_known in zip(boards, known))
+        header = HEADER.pack(MAGIC, VERSION, width, height, ship_count, rules, int(host), first_player, token, 0)
+        crc = zlib.crc32(header[:-4] + fleets)
+        data = bytearray(file_size(width, height, ship_count))
+        data[:HEADER.size] = header[:-4] + crc.to_bytes(4, byteorder='big')
+        data[HEADER.size:HEADER.size + len(fleets)] = fleets
+        slots_offset = HEADER.size + len(fleets)
+        data[slots_offset:slots_offset + SLOT.size] = pack_slot(0, first_player, PLAYING, 0)
+        # Written whole to the side first, a crash now leaves the old checkpoint alone.
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as new_file:
+            new_file.write(data)
+            new_file.flush()
+            os.fsync(new_file.fileno())
+        os.replace(temporary_path, path)
+        return cls.open(path)
+
+    @classmethod
+    def open(cls, path):
+        ''':return: The Checkpoint in path. Raise CheckpointError if it isn't one.'''
+        checkpoint_file = open(path, 'r+b')
+        try:
+            if os.fstat(checkpoint_file.fileno()).st_size < HEADER.size:
+                raise CheckpointError('File is too short.')
+            mapped = mmap.mmap(checkpoint_file.fileno(), 0)
+        except (CheckpointError, OSError, ValueError):
+            checkpoint_file.close()
+            raise
+        try:
+            magic, version, width, height, ship_count = HEADER.unpack_from(mapped)[:5]
+            if magic != MAGIC or version > VERSION:
+                raise CheckpointError(f'{path} is not a checkpoint file.')
+            if len(mapped) != file_size(width, height, ship_count):
+                raise CheckpointError(f'{path} is {len(mapped)} bytes, expected {file_size(width, height, ship_count)}.')
+            fleets_end = HEADER.size + 2 * ship_count * record.SHIP.size
+            crc = HEADER.unpack_from(mapped)[-1]
+            if zlib.crc32(mapped[:HEADER.size - 4] + mapped[HEADER.size:fleets_end]) != crc:
+                raise CheckpointError(f'{path} has a damaged header.')
+            checkpoint = cls(path, checkpoint_file, mapped)
+            checkpoint.read_slots()
+        except (CheckpointError, struct.error):
+            mapped.close()
+            checkpoint_file.close()
+            raise
+        return checkpoint
+
+    @classmethod
+    def load(cls, path, host=None):
+        ''':return: The Checkpoint in path if it holds a match still in progress, otherwise None.
+        :param host: our role, raise CheckpointError unless the file is ours, see checkpoint_path().
+        Raise CheckpointError if the file is damaged.
+        '''
+        try:
+            checkpoint = cls.open(path)
+        except FileNotFoundError:
+            return None
+        if host is not None and (checkpoint.host != host or os.path.basename(path)
+                                 != os.path.basename(checkpoint_path('', checkpoint.host, checkpoint.token))):
+            checkpoint.close()
+            raise CheckpointError(f'{path} was saved by the {ROLES[checkpoint.host]} side of a match, not ours.')
+        if checkpoint.state != PLAYING:
+            checkpoint.close()
+            return None
+        return checkpoint
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def discard(self):
+        '''Close and delete the file, the match is over or won't be resumed.'''
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    # ===== Slots =====
+    def slot_offset(self, moves):
+        return self.slots_offset + (moves % SLOTS) * SLOT.size
+
+    def write_slot(self):
+        '''Count everything up to self.moves as saved.'''
+        offset = self.slot_offset(self.moves)
+        self.map[offset:offset + SLOT.size] = pack_slot(self.moves, self.turn, self.state, self.shot_count)
+        self.map.flush()
+
+    def read_slots(self):
+        '''Take the newest slot with a good crc.'''
+        best = None
+        for index in range(SLOTS):
+            offset = self.slots_offset + index * SLOT.size
+            moves, turn, state, shot_count, crc = SLOT.unpack_from(self.map, offset)
+            if zlib.crc32(self.map[offset:offset + SLOT.size - 4]) != crc or shot_count > self.max_shots:
+                continue
+            if best is None or moves > best[0]:
+                best = (moves, turn, state, shot_count)
+        if best is None:
+            raise CheckpointError(f'{self.path} has no good slot.')
+        self.moves, self.turn, self.state, self.shot_count = best
+
+    # ===== Moves =====
+    def add_move(self, game, events):
+        '''Save one whole move (a shot, or a salvo) just applied to game.
+        :param events: every event the move returned.
+        '''
+        shots = move_shots(events)
+        if self.shot_count + len(shots) > self.max_shots:
+            raise CheckpointError('Checkpoint is full.')
+        self.moves += 1
+        for player, coordinate, hit, fleet_index in shots:
+            SHOT.pack_into(self.map, self.shots_offset + self.shot_count * SHOT.size, self.moves, player,
+                           coordinate[0], coordinate[1], hit, NO_SUNK if fleet_index is None else fleet_index)
+            self.shot_count += 1
+        # The shots must be on disk before the slot that counts them.
+        self.map.flush()
+        self.turn = game.turn
+        if game.is_over():
+            self.state = FINISHED
+        self.write_slot()
+
+    def shots(self):
+        ''':return: list of (move number, player, [y, x], hit, sunk fleet index or None), every shot saved.'''
+        shots = []
+        for index in range(self.shot_count):
+            moves, player, y, x, hit, sunk_index = SHOT.unpack_from(self.map, self.shots_offset + index * SHOT.size)
+            shots.append((moves, player, [y, x], bool(hit), None if sunk_index == NO_SUNK else sunk_index))
+        return shots
+
+    def moves_since(self, moves, player):
+        '''The shots player fired after move number moves, to replay for a peer that missed them.
+        :return: list of (move number, [y, x], hit, sunk fleet index or None), see protocol.encode_replay().
+        '''
+        return [(move, coordinate, hit, fleet_index) for move, shooter, coordinate, hit, fleet_index in self.shots()
+                if move > moves and shooter == player]
+
+    def restore(self, game):
+        '''Set game back to where the checkpoint left off: our fleet placed, both players
+        ready, and every saved move played again. game must be new, with our board first.
+        :return: A Board with our peer's fleet if we knew it, otherwise None.
+        '''
+        my_board, enemy_board = game.boards
+        if (my_board.width, my_board.height) != (self.width, self.height) or len(my_board.fleet) != self.ship_count:
+            raise CheckpointError('Board size or fleet does not match the checkpoint.')
+        if not placement.apply_layout(my_board, self.layouts[0]):
+            raise CheckpointError('Our saved fleet does not fit the board.')
+        peer_fleet = None
+        if all(direction != record.NOT_PLACED for size, coordinate, direction in self.layouts[1]):
+            peer_fleet = board.Board(self.width, self.height, ships.build_fleet([size for size, coordinate, direction
+                                                                                in self.layouts[1]]))
+            if not placement.apply_layout(peer_fleet, self.layouts[1]):
+                raise CheckpointError("Our peer's saved fleet does not fit the board.")
+        game.ready(0)
+        game.ready(1)
+        game.start(self.first_player)
+        moves = {} # move number -> (player, shots)
+        for move, player, coordinate, hit, fleet_index in self.shots():
+            moves.setdefault(move, (player, []))[1].append((coordinate, hit, fleet_index))
+        for move, (player, shots) in sorted(moves.items()):
+            try:
+                if peer_fleet is not None and player == 0:
+                    # Keeps peer_fleet in step too, later results are checked against it.
+                    session.check_results(peer_fleet, [coordinate for coordinate, hit, fleet_index in shots],
+                                          [(hit, fleet_index) for coordinate, hit, fleet_index in shots])
+                replay_move(game, player, shots)
+            except session.SessionError as error:
+                raise CheckpointError(f'Move {move} does not replay: {error}')
+        if game.turn != self.turn:
+            raise CheckpointError('Saved turn does not match the saved moves.')
+        return peer_fleet
@@ -0,0 +1,195 @@
+'''The keyboard and the peer connection, watched together on one selector.
+
+Without this the game blocks in input() while it is our turn and in
+clean_receive() while it is our peer's, so a peer that leaves during our
+turn isn't noticed until we submit, and nothing we type while waiting
+is read. A Console is a transport.Transport wrapped around the peer's
+SocketTransport, pass it to helpers.clean_send/clean_receive like a
+socket and point helpers.console at it for input.
+
+Both ends block in select() until stdin or the socket has something, no
+polling and no threads. Frames that arrive while we type are queued for
+the next receive. Lines typed while we wait for a frame go to
+idle_handler first, what it doesn't take is kept for the next prompt.
+
+Once both sides speak heartbeats, start_heartbeats() makes us send one
+every few seconds from the same loop. A peer that has sent us a heartbeat
+and then goes quiet (no frames, no heartbeats) for peer_timeout seconds
+counts as gone. Apart from that turn_timeout caps how long we wait for
+any real frame.
+
+When stdin isn't a terminal (Windows consoles can't be selected, and
+piped input may already sit in sys.stdin's buffer) we fall back to
+blocking reads of stdin. We can't send heartbeats from inside input(),
+so in that case we send none and the peer only has turn_timeout to go by.
+'''
+
+import collections
+import os
+import selectors
+import sys
+import time
+import transport
+
+# ===== Constants =====
+READ_SIZE = 4096
+PEER, KEYBOARD = 'peer', 'keyboard' # Selector keys.
+HEARTBEAT_INTERVAL = 5 # Seconds between our heartbeats.
+PEER_TIMEOUT = 20 # Seconds of silence before the peer counts as gone.
+TURN_TIMEOUT = 600 # Seconds to wait for the peer's next frame, heartbeats don't count.
+
+class Console(transport.Transport):
+    '''Peer frames and typed lines from one selectors loop.'''
+
+    def __init__(self, peer, heartbeat, turn_timeout=TURN_TIMEOUT, stdin=None):
+        '''
+        :param peer: transport.SocketTransport connected to our peer.
+        :param heartbeat: the heartbeat frame, dropped when it arrives and sent once heartbeats start.
+        :param turn_timeout: seconds receive_frame() waits, None waits forever.
+        :param stdin: file to read typed lines from, defaults to sys.stdin.
+        '''
+        self.peer = peer
+        self.heartbeat = heartbeat
+        self.turn_timeout = turn_timeout
+        self.heartbeat_interval = None # Set by start_heartbeats().
+        self.peer_timeout = None
+        self.next_heartbeat = None # time.monotonic() our next heartbeat is due.
+        self.last_heard = time.monotonic()
+        self.heard_heartbeat = False # Silence only counts once the peer has shown it sends them.
+        self.stdin = stdin or sys.stdin
+        self.frames = collections.deque() # Complete frames not asked for yet.
+        self.lines = collections.deque() # Typed lines waiting for a prompt.
+        self.new_lines = collections.deque() # Typed lines idle_handler hasn't seen.
+        self.partial_line = b''
+        self.peer_closed = False
+        self.stdin_closed = False
+        self.idle_handler = None # Callable(line) for lines typed while we wait, True if it used the line.
+        self.take_frames() # Anything the reader already holds.
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(peer.socket, selectors.EVENT_READ, PEER)
+        self.watch_keyboard = self.stdin.isatty()
+        if self.watch_keyboard:
+            try:
+                self.selector.register(self.stdin, selectors.EVENT_READ, KEYBOARD)
+            except (ValueError, OSError):
+                # Not selectable here, read it the blocking way.
+                self.watch_keyboard = False
+
+    def start_heartbeats(self, interval=HEARTBEAT_INTERVAL, peer_timeout=PEER_TIMEOUT):
+        '''Send heartbeats from now on, and expect them from the peer.'''
+        self.peer_timeout = peer_timeout
+        self.last_heard = time.monotonic()
+        if self.watch_keyboard:
+            self.heartbeat_interval = interval
+            self.send_heartbeat()
+
+    def send_heartbeat(self):
+        self.peer.send_frame(self.heartbeat)
+        self.next_heartbeat = time.monotonic() + self.heartbeat_interval
+
+    def poll(self, deadline=None):
+        '''Wait until the peer or the keyboard has something, and take it in.
+        Sends heartbeats that come due while we wait.
+        :param deadline: time.monotonic() to give up at, raising transport.TransportTimeout.
+        '''
+        now = time.monotonic()
+        wake_times = [when for when in (deadline, self.next_heartbeat) if when is not None]
+        if self.expects_heartbeats():
+            wake_times.append(self.last_heard + self.peer_timeout)
+        timeout = max(0, min(wake_times) - now) if wake_times else None
+        for key, events in self.selector.select(timeout):
+            if key.data == PEER:
+                self.read_peer()
+            else:
+                self.read_keyboard()
+        now = time.monotonic()
+        if self.next_heartbeat is not None and now >= self.next_heartbeat:
+            self.send_heartbeat()
+        if self.expects_heartbeats() and now - self.last_heard >= self.peer_timeout:
+            raise transport.TransportTimeout(f'Nothing from the other player for {self.peer_timeout} seconds.')
+        if deadline is not None and now >= deadline:
+            raise transport.TransportTimeout(f'The other player took longer than {self.turn_timeout} seconds.')
+
+    def expects_heartbeats(self):
+        return self.peer_timeout is not None and self.heard_heartbeat
+
+    def read_peer(self):
+        if not self.peer.reader.fill():
+            self.peer_closed = True
+            self.selector.unregister(self.peer.socket)
+            return
+        self.last_heard = time.monotonic()
+        self.take_frames()
+
+    def take_frames(self):
+        '''Queue every complete frame in the peer's read buffer.'''
+        frame = self.peer.reader.next_frame()
+        while frame is not None:
+            if frame == self.heartbeat:
+                self.heard_heartbeat = True
+            else:
+                # Copy out, the view is only good until the reader's next call.
+                self.frames.append(bytes(frame))
+            frame = self.peer.reader.next_frame()
+
+    def read_keyboard(self):
+        data = os.read(self.stdin.fileno(), READ_SIZE)
+        if not data:
+            self.stdin_closed = True
+            self.selector.unregister(self.stdin)
+            return
+        *lines, self.partial_line = (self.partial_line + data).split(b'\n')
+        self.new_lines.extend(line.decode(errors='replace').rstrip('\r') for line in lines)
+
+    def read_line(self, prompt=''):
+        '''Like input(), but notices the peer leaving while we wait.
+        Raise transport.TransportClosed if it does, EOFError at the end of stdin.
+        '''
+        print(prompt, end='', flush=True)
+        if not self.watch_keyboard:
+            return input()
+        # We're asking now, nothing typed so far is a command.
+        self.lines.extend(self.new_lines)
+        self.new_lines.clear()
+        while not self.lines:
+            if self.peer_closed:
+                raise transport.TransportClosed('The other end closed the connection.')
+            if self.stdin_closed:
+                raise EOFError
+            self.poll()
+            self.lines.extend(self.new_lines)
+            self.new_lines.clear()
+        return self.lines.popleft()
+
+    # ===== Transport =====
+    def receive_frame(self):
+        '''Wait for the next frame, handing anything typed meanwhile to idle_handler.
+        Raise transport.TransportTimeout if it takes longer than turn_timeout.
+        '''
+        deadline = None if self.turn_timeout is None else time.monotonic() + self.turn_timeout
+        while not self.frames:
+            if self.new_lines:
+                line = self.new_lines.popleft()
+                if self.idle_handler is None or not self.idle_handler(line):
+                    self.lines.append(line)
+                continue
+            if self.peer_closed:
+                raise transport.TransportClosed('The other end closed the connection.')
+            self.poll(deadline)
+        return self.frames.popleft()
+
+    def send_frame(self, data):
+        self.peer.send_frame(data)
+
+    def send_frames(self, frames):
+        self.peer.send_frames(frames)
+
+    def getpeername(self):
+        return self.peer.getpeername()
+
+    def fileno(self):
+        return self.peer.fileno()
+
+    def close(self):
+        self.selector.close()
+        self.peer.close()
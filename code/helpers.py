@@ -1,13 +1,13 @@
-import sys
 import time
 import socket
+import weakref
 import board
 import ships
-import subprocess
-
-LINUX_PLATFORM = 'linux'
-MACOS_PLATFORM = 'darwin'
-WINDOWS_PLATFORM = 'win32'
+import render
+import metrics
+import placement
+import protocol
+import transport
 
 SHIP_SUNK_CHAR = '*'
 
@@ -21,15 +21,19 @@ FLEET_SYMBOL_MAP = {
 
 DISCONNECTED_STRING = "The other player has disconnected. Ending game..."
 
-LENGTH_BYTES = 4
+LENGTH_BYTES = transport.LENGTH_BYTES
+CONNECT_TIMEOUT = 10 # Seconds to reach the host before giving up.
+ACCEPT_TIMEOUT = 600 # Seconds a host waits for someone to join, None waits forever.
+
+# console.Console once we are connected, so prompts notice a peer leaving.
+console = None
+# True while a checkpointed match can be resumed, peer_gone() raises PeerGone instead of exiting.
+resumable = False
+RECONNECT_DELAY = 1 # Seconds between attempts to reach the host again.
+
+class PeerGone(Exception):
+    """Raised by peer_gone() while resumable is set, the caller reconnects."""
 
-def get_terminal_clear_command():
-    '''Return the command used to clear the terminal, for use with map rendering.'''
-    platform = sys.platform
-    if platform in [LINUX_PLATFORM, MACOS_PLATFORM]:
-        return 'clear'
-    # Windows
-    return 'cls'
 
 def notify_host(port):
     '''Dump the initial hosting notice.'''
@@ -41,17 +45,25 @@ def notify_host(port):
     print('If playing on the same network, use your private IP address.')
     print('Private IP address can be found with "ipconfig" in Windows CMD or "ip -br a" in Linux terminal.')
 
-def get_client_connection(local_address, local_port):
-    '''Start a server, await peer connection, return socket connection object'''
+def get_client_connection(local_address, local_port, timeout=ACCEPT_TIMEOUT):
+    '''Start a server, await peer connection, return socket connection object.
+    Close the app if nobody joins within timeout seconds.'''
     server = socket.create_server((local_address,local_port))
-    conn, addr = server.accept()
-    server.close()
+    server.settimeout(timeout)
+    try:
+        conn, addr = server.accept()
+    except socket.timeout:
+        print(f'Nobody joined within {timeout} seconds. Ending game...')
+        exit()
+    finally:
+        server.close()
+    conn.settimeout(None)
     return conn
 
 def notify_client():
     '''Find out where the client wants to connect. return (address, port)'''
     while True:
-        user_input = input('Enter IP address and port i.e. 99.123.45.60:5598 or "q" to quit: ')
+        user_input = get_input('Enter IP address and port i.e. 99.123.45.60:5598 or "q" to quit: ')
         if user_input.lower() == 'q':
             exit()
         if ':' not in user_input:
@@ -61,12 +73,15 @@ def notify_client():
         port = int(port)
         return (address,port)
 
-def get_host_connection(host_address):
+def get_host_connection(host_address, timeout=CONNECT_TIMEOUT):
     '''Attempt to connect to the host and return a socket object.
-        host_address is tuple in form of (address, port).'''
+        host_address is tuple in form of (address, port).
+        Gives up after timeout seconds.'''
     try:
         my_socket = socket.socket()
+        my_socket.settimeout(timeout)
         my_socket.connect(host_address)
+        my_socket.settimeout(None)
         return my_socket
     except:
         print('Error connecting to host...')
@@ -74,144 +89,136 @@ def get_host_connection(host_address):
         print('')
         raise
 
-def get_sunk_char(board, fleet_index):
-    """Helper to retrieve the character for map render.
-    return a single character, indicating that ship's sunk state."""
-    if board.fleet[fleet_index].is_sunk:
-        return '*'
-    return ' '
-
-def render_enemy_and_message(enemy_board, message):
-    """Print the top half of the screen. The enemy board and game message."""
-    print('''=================  Enemy Board ==================
-      A   B   C   D   E   F   G   H   I   J
-    + - + - + - + - + - + - + - + - + - + - +          ===== Message ==========''')
-    for y in range(1, 11):
-        if y != 10: # Accomodate the extra digit in "10"
-            print(f' {y}  |', end="")
-        else:
-            print(f' {y} |', end="")
-        for x in range(1, 11):
-            if [y,x] in enemy_board.get_attacks():
-                print(' {} |'.format('X'), end="")
-            elif [y,x] in enemy_board.get_misses():
-                print(' {} |'.format('O'), end="")
-            else:
-                print(' {} |'.format(' '), end="")
-        if y == 1:
-            print(f'           {message}')
-        elif y == 8:
-            print('          ===== Enemy Status =====')
-        elif y == 9:
-            if enemy_board.fleet[1].is_sunk:
-                sunk_char = '*'
-            else:
-                sunk_char = ' '
-            print('           {} Submarine'.format(sunk_char))
-        elif y == 10:
-            if enemy_board.fleet[3].is_sunk:
-                sunk_char = '*'
-            else:
-                sunk_char = ' '
-            print('           {} Battleship'.format(sunk_char))
-        else:
-            print()
-        print('    + - + - + - + - + - + - + - + - + - + - +', end='')
-        if y == 8:
-            if enemy_board.fleet[0].is_sunk:
-                sunk_char = '*'
-            else:
-                sunk_char = ' '
-            print('           {} Destroyer'.format(sunk_char))
-        elif y == 9:
-            if enemy_board.fleet[2].is_sunk:
-                sunk_char = '*'
-            else:
-                sunk_char = ' '
-            print('           {} Cruiser'.format(sunk_char))
-        elif y == 10:
-            if enemy_board.fleet[4].is_sunk:
-                sunk_char = '*'
-            else:
-                sunk_char = ' '
-            print('           {} Aircraft Carrier'.format(sunk_char))
-        else:
-            print()
-
-def render_my_board_and_legend(my_board):
-    """Print out my board's ship placement, status, and symbol legend"""
-    print('''=================  Your Board ===================
-      A   B   C   D   E   F   G   H   I   J
-    + - + - + - + - + - + - + - + - + - + - +          ===== Your Status =====''')
-    for y in range(1, 11):
-        if y != 10: # Accomodate the extra digit in "10"
-            print(f' {y}  |', end="")
-        else:
-            print(f' {y} |', end="")
-        for x in range(1, 11):
-            # Obtain the correct symbol for this cell.
-            symbol = ' '
-            # Attacked coordinates supercede fleet symbols, unless the ship sank.
-            if [y,x] in my_board.get_attacks():
-                symbol = 'X'
-            elif [y,x] in my_board.get_misses():
-                symbol = 'O'
-            for ship in my_board.fleet:
-                if [y, x] in ship.get_positions():
-                    # If the symbol hasn't been set yet or if the ship has been sunk,
-                    # set the symbol for this cell.
-                    if symbol == ' ' or ship.symbol == '*':
-                        symbol = ship.symbol
-            print(f' {symbol} |', end="")
-        # Tack on the extra info.
-        if y == 1:
-            sunk_char = get_sunk_char(my_board, 0)
-            print(f'           {sunk_char} Destroyer',end="")
-        if y == 2:
-            sunk_char = get_sunk_char(my_board,2)
-            print(f'           {sunk_char} Cruiser',end="")
-        if y == 3:
-            sunk_char = get_sunk_char(my_board, 4)
-            print(f'           {sunk_char} Aircraft Carrier',end="")
-        if y == 6:
-            print('          ====== Legend ========',end="")
-        if y == 7:
-            print('           X - Hit',end="")
-        if y == 9:
-            print('           S - Submarine - 3',end="")
-        if y == 10:
-            print('           B - Battleship - 4',end="")
-        print()
-        print('    + - + - + - + - + - + - + - + - + - + - +',end="")
-        if y == 1:
-            sunk_char = get_sunk_char(my_board, 1)
-            print(f'           {sunk_char} Submarine',end="")
-        if y == 2:
-            sunk_char = get_sunk_char(my_board, 3)
-            print(f'           {sunk_char} Battleship',end="")
-        if y == 6:
-            print('           O - Miss',end="")
-        if y == 7:
-            print('           * - Sunk ship',end="")
-        if y == 8:
-            print('           D - Destroyer - 2',end="")
-        if y == 9:
-            print('           C - Cruiser - 3',end="")
-        if y == 10:
-            print('           A - Aircraft Carrier - 5',end="")
+def reconnect_to_host(host_address, timeout):
+    """Keep trying to reach the host again for up to timeout seconds, to resume a match.
+    Return a socket object, close the app if the host never answers."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            connection = socket.create_connection(host_address, CONNECT_TIMEOUT)
+        except OSError:
+            if time.monotonic() + RECONNECT_DELAY > deadline:
+                print(f'The host did not come back within {timeout} seconds. Ending game...')
+                exit()
+            time.sleep(RECONNECT_DELAY)
+            continue
+        connection.settimeout(None)
+        return connection
+
+def render_map(enemy_board, my_board, message, clear=False):
+    """Present the entire board, status, legend, map, etc. in a single write.
+    Pass clear=True to redraw over the previous frame instead of below it."""
+    render.renderer.draw(render.frame_lines(enemy_board, my_board, message), clear)
+
+def clear_screen():
+    """Clear the terminal with ANSI escapes, no shell needed."""
+    render.renderer.clear()
+
+def get_input(prompt=''):
+    """input(), read through the console when we have one.
+    Close the app if the peer disconnects while we wait for the user."""
+    if console is None:
+        return input(prompt)
+    try:
+        return console.read_line(prompt)
+    except transport.TransportClosed as error:
         print()
+        peer_gone(error)
+
+def column_number(label):
+    """Return the column number for letters like 'c' or 'AB', the inverse of render.column_label()."""
+    x = 0
+    for letter in label.upper():
+        x = x * 26 + ord(letter) - ord('A') + 1
+    return x
 
-def render_map(enemy_board, my_board, message):
-    """Present the entire board, status, legend, map, etc."""
-    render_enemy_and_message(enemy_board, message)
-    render_my_board_and_legend(my_board)
-    print() # Decided I wanted an extra line before inputs.
+def coordinate_label(coordinate):
+    """Return a y,x coordinate pair as the user types it, for example 'B7'."""
+    return f'{render.column_label(coordinate[1])}{coordinate[0]}'
 
-def place_ships(enemy_board, my_board, clear_command):
+def parse_coordinate(text, width=board.MAX_X, height=board.MAX_Y):
+    """Turn user input like 'A1', 'g10' or 'AB120' into a y,x coordinate pair.
+    Raise ValueError with a message for the user if it isn't on the board."""
+    text = text.strip()
+    letters = ''
+    for character in text:
+        if not ('a' <= character.lower() <= 'z'):
+            break
+        letters += character
+    if not letters or column_number(letters) > width:
+        raise ValueError(f"First value in coordinate must be A-{render.column_label(width)}. Example: 'C5' or 'F9'")
+    try:
+        row = int(text[len(letters):])
+    except ValueError:
+        raise ValueError(f"Second value in coordinate must be 1-{height}. Example 'A10' or 'h3'")
+    if row < 1 or row > height:
+        raise ValueError(f"Second value in coordinate must be 1-{height}. Example 'A10' or 'h3'")
+    # Notice I swapped the coordinates.
+    # We need them in y,x pairs so I had to change the order.
+    return [row, column_number(letters)]
+
+def prompt_attack(enemy_board, redraw=None, taken=()):
+    """Ask the user for a coordinate to attack until they give a new, valid one.
+    On boards bigger than the view, 'v <coordinate>' moves the enemy view
+    and calls redraw() to show it.
+    taken holds coordinates already picked for this salvo.
+    Return the y,x coordinate pair."""
+    print("Enter the coordinate you'd like to attack.")
+    attack_coord = []
+    while True:
+        user_input = get_input("Coordinate, for example, 'A1' or 'g10': ")
+        if user_input.lower().startswith('v ') and redraw is not None:
+            try:
+                enemy_board.view_center = parse_coordinate(user_input[2:], enemy_board.width, enemy_board.height)
+            except ValueError as error:
+                print(error)
+                continue
+            redraw()
+            continue
+        # Check for a good coordinate.
+        try:
+            attack_coord = parse_coordinate(user_input, enemy_board.width, enemy_board.height)
+        except ValueError as error:
+            print(error)
+            continue
+        # Prevent repeat attacks.
+        if enemy_board.is_attacked(attack_coord):
+            print("You already attacked there! Try another location.")
+            continue
+        if attack_coord in taken:
+            print("That's already in this salvo! Try another location.")
+            continue
+        break
+    # Let the view follow our shots again.
+    enemy_board.view_center = None
+    return attack_coord
+
+def prompt_salvo(enemy_board, count, redraw=None):
+    """Ask for every shot of a salvo, count different new coordinates.
+    Return the list of y,x coordinate pairs."""
+    salvo = []
+    while len(salvo) < count:
+        print(f"Salvo shot {len(salvo) + 1} of {count}.")
+        salvo.append(prompt_attack(enemy_board, redraw, taken=salvo))
+    return salvo
+
+def get_fleet_index(my_board, symbol):
+    """Find the ship a placement symbol refers to.
+    With several ships sharing a symbol, the first unplaced one wins.
+    Return the fleet index or None."""
+    matches = [index for index, ship in enumerate(my_board.fleet) if ship.label.lower() == symbol.lower()]
+    if not matches:
+        return None
+    for index in matches:
+        if not my_board.fleet[index].coords:
+            return index
+    return matches[0]
+
+def place_ships(enemy_board, my_board, extra_message=''):
     """Lock user into the 'place ship' loop.
-        Only break once the user locks in their ship positions."""
+        Only break once the user locks in their ship positions.
+        extra_message is shown at the first ship prompt."""
     # Have the user place their ships.
-    extra_message = '' # I just need this somewhere before its called.
     while True:
         # If all ships are on the board, tell the user how to lock-in / ready-up.
         all_ships_placed = True
@@ -220,56 +227,50 @@ def place_ships(enemy_board, my_board, clear_command):
                 all_ships_placed = False
                 break
         if all_ships_placed:
-            subprocess.call(clear_command, shell=True)
-            render_map(enemy_board, my_board, "All ships on board. Lock in placement or re-place ships.")
+            render_map(enemy_board, my_board, "All ships on board. Lock in placement or re-place ships.", clear=True)
             while True:
-                user_input = input("Enter 'L' to lock in your placements or 'R' to re-place a ship: ")
+                user_input = get_input("Enter 'L' to lock in your placements or 'R' to re-place a ship: ")
                 if user_input.lower() in ['l','r']:
                     break
                 print("Invalid input: Please enter 'L' to lock-in or 'R' to replace.")
             # Check for lock-in again to break out of the outer loop.
             if user_input.lower() == 'l':
+                my_board.view_center = None
                 break
 
         # Symbol of ship to place.
-        subprocess.call(clear_command, shell=True)
-        render_map(enemy_board, my_board, "Enter the symbol of the ship you'd like to place (see legend).")
+        render_map(enemy_board, my_board, "Enter the symbol of the ship you'd like to place (see legend).", clear=True)
         while True:
             if extra_message:
                 print(extra_message)
                 print()
             print("Ship symbol, example: 'D' for Destroyer.")
-            user_input = input("You can replace a ship by entering its symbol again: ")
-            if user_input.lower() not in ['d', 's', 'c', 'b', 'a']:
+            user_input = get_input("You can replace a ship by entering its symbol again: ")
+            fleet_index = get_fleet_index(my_board, user_input.strip())
+            if fleet_index is None:
                 print("Invalid input, please enter one ship symbol (see legend for symbols).")
                 continue
-            fleet_index = FLEET_SYMBOL_MAP[user_input]
             print(fleet_index)
             extra_message = ''
             break
 
         # Coordinate and direction.
-        subprocess.call(clear_command, shell=True)
-        render_map(enemy_board, my_board, "Enter your coordinate and direction.")
+        ship = my_board.fleet[fleet_index]
+        my_board.view_center = ship.get_positions()[0] if ship.coords else None
+        render_map(enemy_board, my_board, "Enter your coordinate and direction.", clear=True)
         while True:
             # Verify that coordinate.
             print("Coordinate and direction, for example, to place a Destroyer across A1 and A2")
-            user_input = input("you could enter 'A1 down', 'a1 D', 'a2 Up' or 'A2 u': ")
+            user_input = get_input("you could enter 'A1 down', 'a1 D', 'a2 Up' or 'A2 u': ")
             try:
                 coordinate, direction = user_input.split(" ")
             except:
                 print("Response must include a space. Example: 'B10 Up' or 'F9 Left'")
                 continue
-            if coordinate[0].lower() not in  ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i', 'j']:
-                print("First value in coordinate must be A-J. Example: 'C5' or 'F9'")
-                continue
             try:
-                temp = int(coordinate[1:])
-            except:
-                print("Second value in coordinate must be 1-10. Example 'A10' or 'h3'")
-                continue
-            if temp < 1 or temp > 10:
-                print("Second value in coordinate must be 1-10. Example 'A10' or 'h3'")
+                coord = parse_coordinate(coordinate, my_board.width, my_board.height)
+            except ValueError as error:
+                print(error)
                 continue
             # Verify that direction.
             direction = direction.lower()
@@ -277,11 +278,6 @@ def place_ships(enemy_board, my_board, clear_command):
                 print("Direction must be up, down, left, right, or the first letter of that direction.")
                 continue
             # Process
-            # 96 is the ascii value one lower than character 'a'.
-            # We subtract it to map the letter to our coordinate system.
-            # Also notice I swapped the coordinates.
-            # We need them in y,x pairs so I had to change the order.
-            coord = [temp, ord(coordinate[0].lower()) - 96]
             if direction in ['up','u']:
                 temp = ships.UP
             elif direction in ['down','d']:
@@ -290,41 +286,118 @@ def place_ships(enemy_board, my_board, clear_command):
                 temp = ships.LEFT
             else:
                 temp = ships.RIGHT
-            my_board.fleet[fleet_index].set_positions(coord, temp)
-            if (not my_board.check_oob(my_board.fleet[fleet_index]) or
-                not my_board.check_collision(my_board.fleet[fleet_index])):
-                my_board.fleet[fleet_index].position_list=[] # Reset the positions
+            ship.set_positions(coord, temp)
+            my_board.view_center = coord
+            if (not my_board.check_oob(ship) or
+                not my_board.check_collision(ship)):
+                ship.position_list=[] # Reset the positions
                 extra_message = "Invalid placement, check other ship positions and board boundaries!"
             break
 
-# Left off around here somewhere. Locking in ships stuck me in infinite loop.
-def receive_with_dc_check(socket, length):
-    """Receive data with connection close handling.
-    Pass in a socket and the length of expected data bytestring.
-    Return the data or close the app.
+def submit_fleet(connection, enemy_board, my_board):
+    """Send our whole fleet to the host in one PLACE frame and wait for its answer.
+    Ships the host turns down are taken off the board and placed again, until it accepts."""
+    while True:
+        clean_send(connection, protocol.encode_place(my_board.fleet))
+        rejections = protocol.decode_place_result(clean_receive(connection, 0))
+        if not rejections:
+            return
+        reasons = []
+        for fleet_index, reason in rejections:
+            if fleet_index < len(my_board.fleet):
+                ship = my_board.fleet[fleet_index]
+                ship.position_list = []
+                reasons.append(f"{ship.name} {placement.REJECTION_NAMES.get(reason, 'was refused')}")
+        my_board.placement_changed()
+        place_ships(enemy_board, my_board, 'The host refused: ' + ', '.join(reasons) + '.')
+
+def check_peer_fleet(connection, width, height, fleet):
+    """Host side of submit_fleet(), answer PLACE frames until one places every ship legally.
+    fleet is a fleet like our peer's, for the ship sizes.
+    Return a Board with our peer's fleet on it, to check the results they report against."""
+    sizes = [ship.size for ship in fleet]
+    while True:
+        layout = protocol.decode_place(clean_receive(connection, 0), len(sizes))
+        rejections = placement.check_layout(height, width, sizes, layout)
+        clean_send(connection, protocol.encode_place_result(rejections))
+        if not rejections:
+            fleet_board = board.Board(width, height)
+            placement.apply_layout(fleet_board, placement.sized_layout(sizes, layout))
+            return fleet_board
+
+# Frames are read and written by a transport, plain sockets get a SocketTransport.
+FrameReader = transport.FrameReader
+READ_BUFFER_SIZE = transport.READ_BUFFER_SIZE
+
+# One transport per plain socket, dropped along with the socket.
+socket_transports = weakref.WeakKeyDictionary()
+
+def get_transport(connection):
+    """Return the transport for a connection.
+    connection is a transport.Transport, or a socket we wrap on first use."""
+    if isinstance(connection, transport.Transport):
+        return connection
+    wrapped = socket_transports.get(connection)
+    if wrapped is None:
+        wrapped = transport.SocketTransport(connection)
+        socket_transports[connection] = wrapped
+    return wrapped
+
+def peer_gone(error):
+    """Tell the user why the game ended and close the app.
+    While resumable is set raise PeerGone instead, the match goes on after a reconnect."""
+    if isinstance(error, transport.TransportTimeout):
+        print(error)
+    if resumable:
+        raise PeerGone(str(error))
+    print(DISCONNECTED_STRING)
+    exit()
+
+def clean_receive(connection, data_length):
+    """Receive one length prefixed frame sent with clean_send().
+    connection is a socket or a transport.Transport.
+    data_length is kept for compatibility, the length prefix decides.
+    Heartbeat frames are skipped.
+    Return the frame contents as bytes. Close the app if the peer disconnects.
     """
-    data = b''
-    for i in range(length):
-        temp_data = socket.recv(1)
-        if not temp_data:
-            print(DISCONNECTED_STRING)
-            exit()
-        data = data + temp_data
+    frame_transport = get_transport(connection)
+    start = time.perf_counter() if metrics.collector is not None else 0
+    try:
+        data = bytes(frame_transport.receive_frame())
+        while protocol.is_heartbeat(data):
+            data = bytes(frame_transport.receive_frame())
+    except transport.TransportClosed as error:
+        peer_gone(error)
+    if metrics.collector is not None:
+        metrics.collector.received(connection, data, time.perf_counter() - start)
     return data
 
-def clean_receive(socket, data_length):
-    # Resolve length of data.
-    len_bytes = receive_with_dc_check(socket, LENGTH_BYTES)
-    length = int.from_bytes(len_bytes, byteorder='big')
-    # Parse network data until length received.
-    data = receive_with_dc_check(socket, length)
-    return data
+def clean_send(connection, data):
+    """Send data prepended with message length.
+    connection is a socket or a transport.Transport."""
+    frame_transport = get_transport(connection)
+    start = time.perf_counter() if metrics.collector is not None else 0
+    try:
+        frame_transport.send_frame(data)
+    except transport.TransportClosed as error:
+        peer_gone(error)
+    if metrics.collector is not None:
+        metrics.collector.sent(connection, data, time.perf_counter() - start)
 
-def clean_send(socket, data):
-    """Send data prepended with message length."""
-    length = len(data)
-    length = length.to_bytes(LENGTH_BYTES, byteorder='big')
-    socket.sendall(length+data)
+def clean_send_many(connection, frames):
+    """Send several frames in one write, like clean_send() on each in turn.
+    Use it to send a reply and our next move together."""
+    frame_transport = get_transport(connection)
+    start = time.perf_counter() if metrics.collector is not None else 0
+    try:
+        frame_transport.send_frames(frames)
+    except transport.TransportClosed as error:
+        peer_gone(error)
+    if metrics.collector is None:
+        return
+    seconds = (time.perf_counter() - start) / len(frames)
+    for data in frames:
+        metrics.collector.sent(connection, data, seconds)
 
 if __name__ == '__main__':
     pass
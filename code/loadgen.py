@@ -0,0 +1,364 @@
+'''Load generator and soak tester for server.py.
+
+Runs thousands of simulated players from one asyncio loop against a
+server.py on this machine. Each player connects, does the handshake
+(READY/START and PLACE, or the old ALL_PLACED/START_GAME with --compat),
+plays a random legal game with a random think time before every attack,
+swaps fleets, hangs up and connects again until --duration runs out.
+
+Every --interval seconds we print connections/sec, turns/sec and the
+reply latency percentiles (attack sent to result received, through the
+server and the other player) for that interval, plus running counts of
+protocol errors, dropped connections and timeouts. A summary with the
+most common errors follows at the end, and the exit status is 1 if
+anything went wrong.
+
+The server pairs players in the order they connect and two old protocol
+players can't share a match, so keep --compat at 0.5 or below and expect
+some drops in the handshake when it is above 0.
+
+Only loopback addresses are accepted, the load never leaves this machine.
+Give the server room for all the clients:
+    python3 server.py --address 127.0.0.1 --max-matches 5000 --max-waiting 10000
+    python3 loadgen.py --clients 2000 --duration 300 --think 0.5
+'''
+
+import argparse
+import asyncio
+import collections
+import ipaddress
+import random
+import socket
+import sys
+import time
+import ai
+import board
+import protocol
+import server
+import session
+import simulate
+
+try:
+    import resource
+except ImportError:
+    resource = None # Not on Windows.
+
+# ===== Constants =====
+HOST = '127.0.0.1'
+CLIENTS = 100
+RAMP = 200 # New clients started per second.
+THINK = 0.1 # Mean seconds a client thinks before each attack.
+DURATION = 60 # Seconds before clients stop starting new games.
+REPLY_TIMEOUT = 60 # Seconds to wait for any frame before giving up on the game.
+RETRY_DELAY = 1 # Seconds to wait after failing to connect.
+REPORT_INTERVAL = 5 # Seconds between report lines.
+ERRORS_SHOWN = 10 # Most common error messages in the summary.
+ME, PEER = 0, 1
+CONNECT, HANDSHAKE, PLAYING, SWAP = 'connect', 'handshake', 'playing', 'fleet swap' # Client phases.
+
+def percentile(values, fraction):
+    ''':return: The value at fraction (0 to 1) of sorted values, 0 if there are none.'''
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def check_local(host):
+    '''Make sure host only resolves to loopback addresses.'''
+    for family, kind, proto, name, address in socket.getaddrinfo(host, None):
+        if not ipaddress.ip_address(address[0]).is_loopback:
+            raise ValueError(f'{host} is not a local address.')
+
+def raise_file_limit(wanted):
+    '''Raise our open file limit towards wanted, each client holds a socket.'''
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < wanted:
+        if hard != resource.RLIM_INFINITY:
+            wanted = min(wanted, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+
+class LoadStats():
+    '''Counts for the current report interval and for the whole run.'''
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.interval_started = self.started
+        self.active = 0 # Clients connected right now.
+        self.connects = 0
+        self.turns = 0
+        self.latencies = [] # Reply latencies this interval, in seconds.
+        self.totals = collections.Counter() # 'connects', 'turns', 'games', 'errors', 'drops', 'timeouts'.
+        self.all_latencies = []
+        self.problems = collections.Counter() # 'kind in phase: message' -> times seen.
+
+    def add_connect(self):
+        self.connects += 1
+        self.totals['connects'] += 1
+
+    def add_turn(self, seconds):
+        self.turns += 1
+        self.totals['turns'] += 1
+        self.latencies.append(seconds)
+        self.all_latencies.append(seconds)
+
+    def add_game(self):
+        self.totals['games'] += 1
+
+    def add_problem(self, kind, phase, error):
+        '''Count an error, a drop or a timeout.
+        :param kind: 'errors', 'drops' or 'timeouts'.
+        '''
+        self.totals[kind] += 1
+        self.problems[f'{kind} in {phase}: {str(error) or type(error).__name__}'] += 1
+
+    def interval_line(self):
+        ''':return: One report line for the interval since the last call, and start a new interval.'''
+        now = time.monotonic()
+        seconds = max(now - self.interval_started, 1e-9)
+        latencies = sorted(self.latencies)
+        line = (f'{now - self.started:6.0f}s  {self.active} connected  '
+                f'{self.connects / seconds:.1f} conn/s  {self.turns / seconds:.1f} turns/s  '
+                f'reply ms p50 {percentile(latencies, 0.5) * 1000:.1f} '
+                f'p90 {percentile(latencies, 0.9) * 1000:.1f} '
+                f'p99 {percentile(latencies, 0.99) * 1000:.1f} '
+                f'max {percentile(latencies, 1) * 1000:.1f}  '
+                f"games {self.totals['games']}  errors {self.totals['errors']}  "
+                f"drops {self.totals['drops']}  timeouts {self.totals['timeouts']}")
+        self.interval_started = now
+        self.connects = 0
+        self.turns = 0
+        self.latencies = []
+        return line
+
+    def summary(self):
+        ''':return: Lines summing up the whole run.'''
+        seconds = max(time.monotonic() - self.started, 1e-9)
+        latencies = sorted(self.all_latencies)
+        lines = [
+            f"{self.totals['connects']} connections ({self.totals['connects'] / seconds:.1f}/s), "
+            f"{self.totals['turns']} turns ({self.totals['turns'] / seconds:.1f}/s), "
+            f"{self.totals['games']} games in {seconds:.0f}s",
+            f'reply ms p50 {percentile(latencies, 0.5) * 1000:.1f} p90 {percentile(latencies, 0.9) * 1000:.1f} '
+            f'p99 {percentile(latencies, 0.99) * 1000:.1f} p99.9 {percentile(latencies, 0.999) * 1000:.1f} '
+            f'max {percentile(latencies, 1) * 1000:.1f}',
+            f"{self.totals['errors']} protocol errors, {self.totals['drops']} dropped connections, "
+            f"{self.totals['timeouts']} timeouts",
+        ]
+        lines.extend(f'  {count} x {problem}' for problem, count in self.problems.most_common(ERRORS_SHOWN))
+        return lines
+
+    def failed(self):
+        return bool(self.totals['errors'] or self.totals['drops'] or self.totals['timeouts'])
+
+class LoadClient():
+    '''One simulated player, playing one game per connection like battleship.py does.'''
+
+    def __init__(self, stats, rng, compat=False, salvo=False, think=THINK, reply_timeout=REPLY_TIMEOUT):
+        '''
+        :param compat: speak the old pickle protocol, always classic 10x10.
+        :param salvo: play salvo rules, every other client must too.
+        :param think: mean seconds to wait before each attack.
+        '''
+        self.stats = stats
+        self.rng = rng
+        self.compat = compat
+        self.rules = protocol.SALVO_RULES if salvo else protocol.CLASSIC_RULES
+        self.think = think
+        self.reply_timeout = reply_timeout
+        self.phase = CONNECT
+        self.reader = None
+        self.writer = None
+        self.my_board = None
+        self.enemy_board = None
+        self.shooter = None
+        self.game = None # session.GameSession for the game on the current connection.
+
+    async def send(self, data):
+        server.write_frame(self.writer, data)
+        await self.writer.drain()
+
+    async def receive(self):
+        '''Read the next frame that isn't a heartbeat.'''
+        while True:
+            data = await asyncio.wait_for(server.read_frame(self.reader), self.reply_timeout)
+            if not protocol.is_heartbeat(data):
+                return data
+
+    async def request(self, data):
+        '''Send data and wait for the reply, counting a turn with its latency.'''
+        started = time.perf_counter()
+        await self.send(data)
+        reply = await self.receive()
+        self.stats.add_turn(time.perf_counter() - started)
+        return reply
+
+    async def play(self, host, port):
+        '''Connect, play one game to the end and hang up.'''
+        self.phase = CONNECT
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.stats.add_connect()
+        self.stats.active += 1
+        try:
+            self.my_board = board.BitBoard()
+            self.enemy_board = board.BitBoard()
+            simulate.random_placement(self.my_board, self.rng)
+            self.shooter = simulate.RandomTargeting(self.rng)
+            self.game = session.GameSession([self.my_board, self.enemy_board],
+                                            salvo=self.rules == protocol.SALVO_RULES)
+            self.phase = HANDSHAKE
+            your_turn = await self.handshake()
+            self.game.ready(ME)
+            self.game.ready(PEER)
+            self.game.start(ME if your_turn else PEER)
+            self.phase = PLAYING
+            while not self.game.is_over():
+                if self.game.turn == ME:
+                    await self.attack()
+                else:
+                    await self.defend()
+            if not self.compat:
+                self.phase = SWAP
+                await self.finish()
+        finally:
+            self.stats.active -= 1
+            self.writer.close()
+
+    async def handshake(self):
+        ''':return: True if we attack first.'''
+        if self.compat:
+            await self.send(protocol.ALL_PLACED)
+            if await self.receive() != protocol.START_GAME:
+                raise protocol.ProtocolError('Expected START GAME.')
+            # Old clients always go first.
+            return True
+        await self.send(protocol.encode_ready(board.MAX_X, board.MAX_Y, self.rules))
+        version, you_first, width, height, rules, fleet_hash = protocol.expect(await self.receive(), protocol.START)
+        version = protocol.negotiate(version)
+        protocol.check_board_size((width, height), (board.MAX_X, board.MAX_Y))
+        protocol.check_rules(rules, self.rules)
+        protocol.check_fleet(fleet_hash, self.my_board.fleet)
+        if protocol.checks_placement(version):
+            await self.send(protocol.encode_place(self.my_board.fleet))
+            rejections = protocol.decode_place_result(await self.receive())
+            if rejections:
+                raise protocol.ProtocolError(f'The server refused our fleet: {rejections}')
+        return bool(you_first)
+
+    async def attack(self):
+        '''Think, fire our shot or salvo and record the results.'''
+        if self.think:
+            await asyncio.sleep(self.rng.uniform(0, 2 * self.think))
+        if self.game.salvo:
+            salvo = ai.choose_salvo(self.shooter, self.enemy_board, self.game.shots_allowed(ME))
+            results = protocol.decode_salvo_result(await self.request(protocol.encode_salvo(salvo)))
+            try:
+                self.game.apply_salvo_result(salvo, results)
+            except IndexError as error:
+                raise protocol.ProtocolError(f'Bad salvo results: {error}')
+        else:
+            coordinate = self.shooter.choose_attack(self.enemy_board)
+            data = await self.request(protocol.encode_attack(coordinate, self.compat))
+            hit, fleet_index = protocol.decode_result(data, self.compat)
+            self.game.apply_result(coordinate, hit, fleet_index)
+
+    async def defend(self):
+        '''Answer the other player's shot or salvo.'''
+        data = await self.receive()
+        if self.game.salvo:
+            events = self.game.attack_salvo(protocol.decode_salvo(data))
+            await self.send(protocol.encode_salvo_result(session.events_results(events)))
+        else:
+            events = self.game.attack(protocol.decode_attack(data, self.compat))
+            await self.send(protocol.encode_result(session.events_result(events), self.compat))
+
+    async def finish(self):
+        '''GAME_OVER from the loser, then swap fleets.'''
+        if self.game.winner == ME:
+            protocol.expect(await self.receive(), protocol.GAME_OVER)
+        else:
+            await self.send(protocol.encode_game_over(you_won=True))
+        await self.send(protocol.encode_fleet(self.my_board.fleet))
+        protocol.decode_fleet(await self.receive())
+
+async def run_client(client, host, port, stop_at, games):
+    '''Play games on new connections until stop_at (time.monotonic()) or games run out.
+    :param games: games to play, 0 for no limit.
+    '''
+    played = 0
+    while time.monotonic() < stop_at and (not games or played < games):
+        played += 1
+        try:
+            await client.play(host, port)
+            client.stats.add_game()
+        except asyncio.TimeoutError as error:
+            client.stats.add_problem('timeouts', client.phase, error)
+        except asyncio.IncompleteReadError:
+            client.stats.add_problem('drops', client.phase, 'the server closed the connection')
+        except (protocol.ProtocolError, session.SessionError) as error:
+            client.stats.add_problem('errors', client.phase, error)
+        except OSError as error:
+            # Refused, reset, or out of file descriptors or ports.
+            client.stats.add_problem('drops', client.phase, error)
+        if client.phase == CONNECT:
+            # Couldn't even connect, don't hammer the server.
+            await asyncio.sleep(RETRY_DELAY)
+
+async def report(stats, interval):
+    while True:
+        await asyncio.sleep(interval)
+        print(stats.interval_line(), flush=True)
+
+async def run(args, stats):
+    '''Start args.clients clients at args.ramp per second and wait for them all to finish.'''
+    rng = random.Random(args.seed)
+    stop_at = time.monotonic() + args.duration
+    reporter = asyncio.create_task(report(stats, args.interval))
+    clients = []
+    try:
+        for index in range(args.clients):
+            client = LoadClient(stats, random.Random(rng.random()), rng.random() < args.compat, args.salvo,
+                                args.think, args.reply_timeout)
+            clients.append(asyncio.create_task(run_client(client, args.host, args.port, stop_at, args.games)))
+            if args.ramp:
+                await asyncio.sleep(1 / args.ramp)
+        await asyncio.gather(*clients)
+    finally:
+        reporter.cancel()
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate load against a local server.py.')
+    parser.add_argument('--host', default=HOST, help='must be a loopback address')
+    parser.add_argument('--port', type=int, default=server.PORT)
+    parser.add_argument('-c', '--clients', type=int, default=CLIENTS, help='simulated players at once')
+    parser.add_argument('--ramp', type=float, default=RAMP, help='new clients per second, 0 for all at once')
+    parser.add_argument('--think', type=float, default=THINK, help='mean seconds of thought before each attack')
+    parser.add_argument('--duration', type=float, default=DURATION, help='seconds to keep starting new games')
+    parser.add_argument('--games', type=int, default=0, help='games per client, 0 for no limit')
+    parser.add_argument('--compat', type=float, default=0.0,
+                        help='share of clients using the old ALL_PLACED/START_GAME protocol')
+    parser.add_argument('--salvo', action='store_true', help='play salvo rules')
+    parser.add_argument('--reply-timeout', type=float, default=REPLY_TIMEOUT)
+    parser.add_argument('--interval', type=float, default=REPORT_INTERVAL, help='seconds between report lines')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.salvo and args.compat:
+        parser.error('Old protocol clients only play classic rules.')
+    try:
+        check_local(args.host)
+    except (ValueError, OSError) as error:
+        parser.error(str(error))
+    # Our sockets, plus a few for stdio and the loop.
+    raise_file_limit(args.clients + 64)
+
+    stats = LoadStats()
+    try:
+        asyncio.run(run(args, stats))
+    except KeyboardInterrupt:
+        pass
+    print('\n'.join(stats.summary()))
+    if stats.failed():
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
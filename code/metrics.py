@@ -0,0 +1,251 @@
+'''Opt-in traffic metrics for helpers.clean_send() and helpers.clean_receive().
+
+Off by default, clean_send/clean_receive only check that collector is
+None. Once enable() is called every frame is counted per connection:
+payload bytes and frames each way (every frame adds
+helpers.LENGTH_BYTES on the wire), messages by kind, how long sends and
+receives took, and the round trip from sending an attack to getting
+its result, or a salvo to its results. Metrics can be written to a file every few seconds, as JSON
+or, for a path ending in .prom, the Prometheus text format.
+
+To use:
+    metrics.enable('metrics.prom')
+'''
+
+import atexit
+import bisect
+import collections
+import json
+import os
+import threading
+import time
+import weakref
+import protocol
+
+# ===== Constants =====
+DUMP_INTERVAL = 10 # Seconds between metric file writes.
+# Histogram bucket upper bounds in seconds, 1 microsecond doubling up to about a minute.
+BUCKET_BOUNDS = [2 ** power / 1e6 for power in range(27)]
+PROMETHEUS_EXTENSION = '.prom'
+KIND_NAMES = {
+    protocol.READY: 'ready',
+    protocol.START: 'start',
+    protocol.ATTACK: 'attack',
+    protocol.RESULT: 'result',
+    protocol.GAME_OVER: 'game_over',
+    protocol.FLEET: 'fleet',
+    protocol.WATCH: 'watch',
+    protocol.SHOT: 'shot',
+    protocol.SALVO: 'salvo',
+    protocol.SALVO_RESULT: 'salvo_result',
+    protocol.HEARTBEAT: 'heartbeat',
+    protocol.PLACE: 'place',
+    protocol.PLACE_RESULT: 'place_result',
+    protocol.SESSION: 'session',
+    protocol.RESUME: 'resume',
+    protocol.REPLAY: 'replay',
+}
+# A round trip is from one of these going out to its reply coming in.
+ROUND_TRIPS = {'attack': 'result', 'salvo': 'salvo_result', 'place': 'place_result'}
+PICKLE_START = 0x80 # First byte of a pickle, how old peers send attacks.
+
+def message_kind(data):
+    ''':return: A short name for the kind of message in data.'''
+    if protocol.is_binary(data):
+        return KIND_NAMES.get(data[1], 'unknown')
+    if data == protocol.ALL_PLACED:
+        return 'ready'
+    if data == protocol.START_GAME:
+        return 'start'
+    if data[:1] == bytes([PICKLE_START]):
+        return 'attack'
+    if data[:1] in (protocol.HIT, protocol.MISS):
+        return 'result'
+    return 'unknown'
+
+class Histogram():
+    '''Counts of durations in BUCKET_BOUNDS buckets.'''
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1) # Last bucket is everything slower.
+        self.total = 0.0
+        self.count = 0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def cumulative(self):
+        ''':return: list of (upper bound, count at or below it), ending with infinity.'''
+        running = 0
+        buckets = []
+        for bound, count in zip(BUCKET_BOUNDS + [float('inf')], self.counts):
+            running += count
+            buckets.append((bound, running))
+        return buckets
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': self.total,
+                'buckets': {str(bound): count for bound, count in self.cumulative() if count}}
+
+class ConnectionMetrics():
+    '''Everything we count for one socket.'''
+
+    def __init__(self, name):
+        self.name = name
+        self.bytes = {'in': 0, 'out': 0}
+        self.frames = {'in': 0, 'out': 0}
+        self.kinds = {'in': collections.Counter(), 'out': collections.Counter()}
+        self.times = {'in': Histogram(), 'out': Histogram()}
+        self.round_trip = Histogram()
+        self.attack_sent = None # perf_counter() of our last attack, until its result arrives.
+        self.reply_kind = None # Kind of message that answers that attack.
+
+    def to_dict(self):
+        return {
+            'bytes': dict(self.bytes),
+            'frames': dict(self.frames),
+            'messages': {direction: dict(kinds) for direction, kinds in self.kinds.items()},
+            'send_seconds': self.times['out'].to_dict(),
+            'receive_seconds': self.times['in'].to_dict(),
+            'round_trip_seconds': self.round_trip.to_dict(),
+        }
+
+def connection_name(connection):
+    ''':return: Peer address of a socket or transport, 'local' for in-process transports.'''
+    if not hasattr(connection, 'getpeername'):
+        return 'local'
+    try:
+        address = connection.getpeername()
+    except OSError:
+        return 'unknown'
+    if type(address) == tuple:
+        return f'{address[0]}:{address[1]}'
+    return str(address) or 'local'
+
+class Metrics():
+    '''Metrics for every connection seen since enable().'''
+
+    def __init__(self):
+        self.lock = threading.Lock() # The dump thread reads while the game writes.
+        self.by_socket = weakref.WeakKeyDictionary()
+        self.connections = [] # Kept after their sockets close, for the totals.
+        self.started = time.time()
+
+    def get_connection(self, socket):
+        connection = self.by_socket.get(socket)
+        if connection is None:
+            connection = ConnectionMetrics(connection_name(socket))
+            self.by_socket[socket] = connection
+            self.connections.append(connection)
+        return connection
+
+    def record(self, socket, direction, data, seconds):
+        '''Count one frame.
+        :param direction: 'in' or 'out'.
+        :param data: frame contents, without the length prefix.
+        :param seconds: how long the send or receive took.
+        '''
+        kind = message_kind(data)
+        now = time.perf_counter()
+        with self.lock:
+            connection = self.get_connection(socket)
+            connection.bytes[direction] += len(data)
+            connection.frames[direction] += 1
+            connection.kinds[direction][kind] += 1
+            connection.times[direction].add(seconds)
+            if kind in ROUND_TRIPS and direction == 'out':
+                connection.attack_sent = now - seconds
+                connection.reply_kind = ROUND_TRIPS[kind]
+            elif kind == connection.reply_kind and direction == 'in' and connection.attack_sent is not None:
+                connection.round_trip.add(now - connection.attack_sent)
+                connection.attack_sent = None
+
+    def sent(self, socket, data, seconds):
+        self.record(socket, 'out', data, seconds)
+
+    def received(self, socket, data, seconds):
+        self.record(socket, 'in', data, seconds)
+
+    # ===== Export =====
+    def to_dict(self):
+        with self.lock:
+            return {'started': self.started, 'time': time.time(),
+                    'connections': {f'{index}:{connection.name}': connection.to_dict()
+                                    for index, connection in enumerate(self.connections)}}
+
+    def prometheus(self):
+        ''':return: Metrics in the Prometheus text exposition format.'''
+        lines = []
+        with self.lock:
+            connections = [(f'{index}:{connection.name}', connection)
+                           for index, connection in enumerate(self.connections)]
+            for name, help_text in (('bytes', 'Frame payload bytes sent and received.'),
+                                    ('frames', 'Frames sent and received.')):
+                lines.append(f'# HELP battleship_{name}_total {help_text}')
+                lines.append(f'# TYPE battleship_{name}_total counter')
+                for label, connection in connections:
+                    for direction, value in getattr(connection, name).items():
+                        lines.append(f'battleship_{name}_total{{connection="{label}",direction="{direction}"}} {value}')
+            lines.append('# HELP battleship_messages_total Messages by kind.')
+            lines.append('# TYPE battleship_messages_total counter')
+            for label, connection in connections:
+                for direction, kinds in connection.kinds.items():
+                    for kind, value in sorted(kinds.items()):
+                        lines.append(f'battleship_messages_total{{connection="{label}",direction="{direction}",'
+                                     f'kind="{kind}"}} {value}')
+            histograms = (
+                ('send_seconds', 'Time spent in clean_send().', lambda connection: connection.times['out']),
+                ('receive_seconds', 'Time spent in clean_receive(), waiting included.',
+                 lambda connection: connection.times['in']),
+                ('round_trip_seconds', 'From sending an attack to receiving its result.',
+                 lambda connection: connection.round_trip),
+            )
+            for name, help_text, get_histogram in histograms:
+                lines.append(f'# HELP battleship_{name} {help_text}')
+                lines.append(f'# TYPE battleship_{name} histogram')
+                for label, connection in connections:
+                    histogram = get_histogram(connection)
+                    for bound, count in histogram.cumulative():
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f'battleship_{name}_bucket{{connection="{label}",le="{le}"}} {count}')
+                    lines.append(f'battleship_{name}_sum{{connection="{label}"}} {histogram.total}')
+                    lines.append(f'battleship_{name}_count{{connection="{label}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        '''Write the metrics to path, JSON unless it ends in .prom.'''
+        if path.endswith(PROMETHEUS_EXTENSION):
+            text = self.prometheus()
+        else:
+            text = json.dumps(self.to_dict(), indent=2)
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as output:
+            output.write(text)
+        os.replace(temporary, path)
+
+# Set by enable(), None means metrics are off.
+collector = None
+
+def enable(path=None, interval=DUMP_INTERVAL):
+    '''Start collecting metrics.
+    :param path: file to write every interval seconds and at exit, None to not write one.
+    :return: The Metrics collector.
+    '''
+    global collector
+    if collector is None:
+        collector = Metrics()
+    metrics = collector
+    if path:
+        def dump_forever():
+            while True:
+                time.sleep(interval)
+                metrics.dump(path)
+        threading.Thread(target=dump_forever, daemon=True).start()
+        atexit.register(metrics.dump, path)
+    return metrics
+
+def disable():
+    global collector
+    collector = None
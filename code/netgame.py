@@ -0,0 +1,219 @@
+'''Bot games over the real network protocol.
+
+Both sides send exactly what battleship.py sends: READY and START with
+the board size, the joining side's PLACE checked by the host, the host's
+SESSION token, an ATTACK/RESULT pair every turn, GAME_OVER from the loser and finally each
+fleet. Frames go through helpers.clean_send()
+and helpers.clean_receive(), so the same game can run over TCP, a Unix
+domain socket, a socketpair or, fastest, an in-process queue.
+
+Bots pipeline their turns: the result of the peer's attack is held back
+and goes out in the same write as our next attack, so each turn costs one
+write instead of two. With --salvo every turn is a single SALVO frame
+answered by a single SALVO_RESULT frame.
+
+Players are simulate.py "placement:targeting" specs.
+
+To run:
+    python3 netgame.py -n 1000 --backend queue --a random:density --b random:hunt
+    python3 netgame.py -n 1000 --backend tcp --salvo
+'''
+
+import argparse
+import random
+import threading
+import time
+import ai
+import board
+import helpers
+import placement
+import protocol
+import session
+import simulate
+import transport
+
+# ===== Constants =====
+GAMES = 100
+ME, PEER = 0, 1
+
+class NetworkPlayer():
+    '''One bot at one end of a connection, playing like battleship.py does.'''
+
+    def __init__(self, connection, player, rng, host, width=board.MAX_X, height=board.MAX_Y, salvo=False):
+        '''Set up the bot.
+        :param connection: socket or transport.Transport to the other bot.
+        :param player: (placement, targeting) names from simulate.parse_player().
+        :param host: the host answers READY with START and goes second.
+        :param salvo: play salvo rules, the other bot must too.
+        '''
+        self.connection = connection
+        self.rng = rng
+        self.host = host
+        self.width = width
+        self.height = height
+        self.rules = protocol.SALVO_RULES if salvo else protocol.CLASSIC_RULES
+        self.pending = [] # Frames held back to go out with our next one.
+        self.writes = 0
+        self.my_board = board.BitBoard(width, height)
+        self.enemy_board = board.BitBoard(width, height)
+        placement_name, targeting_name = player
+        self.place = simulate.PLACEMENTS[placement_name]
+        self.shooter = simulate.TARGETING[targeting_name](rng)
+        self.game = session.GameSession([self.my_board, self.enemy_board], salvo=salvo)
+        self.peer_fleet = None # Board with the fleet our peer placed, once we (the host) accepted it.
+
+    def send(self, data, hold=False):
+        '''Send data along with anything held back.
+        :param hold: keep data back too, until the next send.
+        '''
+        self.pending.append(data)
+        if hold:
+            return
+        if len(self.pending) == 1:
+            helpers.clean_send(self.connection, data)
+        else:
+            helpers.clean_send_many(self.connection, self.pending)
+        self.pending = []
+        self.writes += 1
+
+    def receive(self):
+        return helpers.clean_receive(self.connection, 0)
+
+    def handshake(self):
+        ''':return: True if we attack first.'''
+        if not self.host:
+            self.send(protocol.encode_ready(self.width, self.height, self.rules, self.my_board.fleet))
+            version, you_first, width, height, rules, fleet_hash = protocol.expect(self.receive(), protocol.START)
+            version = protocol.negotiate(version)
+            protocol.check_board_size((width, height), (self.width, self.height))
+            protocol.check_rules(rules, self.rules)
+            protocol.check_fleet(fleet_hash, self.my_board.fleet)
+            if protocol.checks_placement(version):
+                self.send(protocol.encode_place(self.my_board.fleet))
+                if protocol.decode_place_result(self.receive()):
+                    raise protocol.ProtocolError('The host refused our fleet.')
+            if protocol.resumes(version):
+                protocol.expect(self.receive(), protocol.SESSION)
+            return bool(you_first)
+        version, width, height, rules, fleet_hash = protocol.expect(self.receive(), protocol.READY)
+        version = protocol.negotiate(version)
+        protocol.check_board_size((width, height), (self.width, self.height))
+        protocol.check_rules(rules, self.rules)
+        protocol.check_fleet(fleet_hash, self.my_board.fleet)
+        # Client goes first.
+        self.send(protocol.encode_start(True, self.width, self.height, self.rules, version, self.my_board.fleet))
+        if protocol.checks_placement(version):
+            self.check_peer_fleet()
+        if protocol.resumes(version):
+            # Bots never resume, any token will do.
+            self.send(protocol.encode_session(bytes(protocol.TOKEN_BYTES)))
+        return False
+
+    def check_peer_fleet(self):
+        '''Check the PLACE our peer sent, like helpers.check_peer_fleet() but a bad fleet ends the game.'''
+        sizes = [ship.size for ship in self.enemy_board.fleet]
+        layout = protocol.decode_place(self.receive(), len(sizes))
+        rejections = placement.check_layout(self.height, self.width, sizes, layout)
+        self.send(protocol.encode_place_result(rejections))
+        if rejections:
+            raise protocol.ProtocolError(f'Peer placed its fleet badly: {rejections}')
+        self.peer_fleet = board.Board(self.width, self.height)
+        placement.apply_layout(self.peer_fleet, placement.sized_layout(sizes, layout))
+
+    def attack(self):
+        '''Fire our shot or salvo and record the results.'''
+        if self.game.salvo:
+            salvo = ai.choose_salvo(self.shooter, self.enemy_board, self.game.shots_allowed(ME))
+            self.send(protocol.encode_salvo(salvo))
+            results = protocol.decode_salvo_result(self.receive())
+            if self.peer_fleet is not None:
+                session.check_results(self.peer_fleet, salvo, results)
+            self.game.apply_salvo_result(salvo, results)
+        else:
+            coordinate = self.shooter.choose_attack(self.enemy_board)
+            self.send(protocol.encode_attack(coordinate))
+            hit, fleet_index = protocol.decode_result(self.receive())
+            if self.peer_fleet is not None:
+                session.check_results(self.peer_fleet, [coordinate], [(hit, fleet_index)])
+            self.game.apply_result(coordinate, hit, fleet_index)
+
+    def defend(self):
+        '''Resolve the peer's shot or salvo, the reply waits for our next attack.'''
+        data = self.receive()
+        if self.game.salvo:
+            events = self.game.attack_salvo(protocol.decode_salvo(data))
+            reply = protocol.encode_salvo_result(session.events_results(events))
+        else:
+            events = self.game.attack(protocol.decode_attack(data))
+            reply = protocol.encode_result(session.events_result(events))
+        self.send(reply, hold=not self.game.is_over())
+
+    def play(self):
+        '''Play one game to the end and swap fleets.
+        :return: True if we won.
+        '''
+        self.place(self.my_board, self.rng)
+        self.game.ready(ME)
+        your_turn = self.handshake()
+        self.game.ready(PEER)
+        self.game.start(ME if your_turn else PEER)
+        while not self.game.is_over():
+            if self.game.turn == ME:
+                self.attack()
+                if self.game.is_over():
+                    protocol.expect(self.receive(), protocol.GAME_OVER)
+            else:
+                self.defend()
+                if self.game.is_over():
+                    self.send(protocol.encode_game_over(you_won=True))
+        self.send(protocol.encode_fleet(self.my_board.fleet))
+        player, layout = protocol.decode_fleet(self.receive())
+        placement.apply_layout(self.enemy_board, layout)
+        return self.game.winner == ME
+
+def play_local_match(players, rng, backend='queue', width=board.MAX_X, height=board.MAX_Y, salvo=False):
+    '''Play one networked game between two bots in this process, the host on a thread.
+    :param players: two (placement, targeting) name pairs, the first joins and attacks first.
+    :param backend: transport.BACKENDS name.
+    :return: tuple of (winner index, shots the winner took, writes by both bots).
+    '''
+    client_end, host_end = transport.pair(backend)
+    client = NetworkPlayer(client_end, players[0], random.Random(rng.random()), False, width, height, salvo)
+    host = NetworkPlayer(host_end, players[1], random.Random(rng.random()), True, width, height, salvo)
+    host_thread = threading.Thread(target=host.play)
+    host_thread.start()
+    try:
+        won = client.play()
+        host_thread.join()
+    finally:
+        client_end.close()
+        host_end.close()
+    winner = 0 if won else 1
+    return winner, client.game.shots[ME] if won else host.game.shots[ME], client.writes + host.writes
+
+def main():
+    parser = argparse.ArgumentParser(description='Play bot games over the network protocol.')
+    parser.add_argument('-n', '--games', type=int, default=GAMES)
+    parser.add_argument('--a', default='random:density', help='client, attacks first')
+    parser.add_argument('--b', default='random:hunt', help='host')
+    parser.add_argument('--backend', default='queue', choices=sorted(transport.BACKENDS))
+    parser.add_argument('--salvo', action='store_true', help='one shot per ship afloat every turn')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    players = (simulate.parse_player(args.a), simulate.parse_player(args.b))
+    rng = random.Random(args.seed)
+    stats = simulate.Stats()
+    writes = 0
+    started = time.perf_counter()
+    for game in range(args.games):
+        winner, shots, game_writes = play_local_match(players, rng, args.backend, salvo=args.salvo)
+        stats.add_game(winner, shots, 0)
+        writes += game_writes
+    elapsed = time.perf_counter() - started
+    print(f'{args.backend}: {args.games} games in {elapsed:.2f}s, {args.games / elapsed:.0f} games/sec, '
+          f'{writes / args.games:.1f} writes per game')
+    print(stats.summary(elapsed))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+'''Precomputed legal placements and fast fleet generation.
+
+A PlacementIndex lists every in-bounds placement of every ship size and
+direction as an integer cell mask, using the same bit layout as
+board.cell_bit(). It is built once per board size and reused, so placing
+a ship is a mask AND instead of Ship.set_positions + Board.check_oob +
+Board.check_collision.
+
+check_layout() is the host's side of a PLACE message: it checks a whole
+fleet in one pass with the same masks, so placement costs one round trip.
+'''
+
+import functools
+import board
+import ships
+
+# ===== Constants =====
+# DOWN and RIGHT placements cover every cell set exactly once, UP/LEFT repeat them.
+UNIQUE_DIRECTIONS = [ships.DOWN, ships.RIGHT]
+MAX_RANDOM_TRIES = 64 # Random picks before we fall back to filtering every placement.
+MAX_INDEX_CELLS = 100 * 100 # Bigger boards place ships by trial instead of building an index.
+DIRECTIONS = (ships.UP, ships.DOWN, ships.LEFT, ships.RIGHT)
+
+# Why check_layout() turned a ship down, sent back in PLACE_RESULT.
+OFF_BOARD, OVERLAPS, BAD_DIRECTION = 1, 2, 3
+REJECTION_NAMES = {OFF_BOARD: 'is off the board', OVERLAPS: 'overlaps another ship',
+                   BAD_DIRECTION: 'has no direction'}
+
+class Placement():
+    '''One legal spot for a ship.'''
+    __slots__ = ('mask', 'coordinate', 'direction', 'size')
+
+    def __init__(self, mask, coordinate, direction, size):
+        self.mask = mask
+        self.coordinate = coordinate # [y, x] of the first cell, as passed to Ship.set_positions.
+        self.direction = direction
+        self.size = size
+
+    def place(self, ship):
+        '''Set ship's positions to this placement.'''
+        ship.set_positions(list(self.coordinate), self.direction)
+
+class PlacementIndex():
+    '''Every in-bounds placement for one board size.'''
+
+    def __init__(self, height, width):
+        self.height = height
+        self.width = width
+        self.by_direction = {} # (size, direction) -> tuple of Placements
+        self.unique = {} # size -> tuple of Placements, one per distinct cell set
+
+    def placements(self, size, direction=None):
+        '''Return the placements for size, either in one direction
+        or one per distinct cell set when direction is None.'''
+        if direction is None:
+            if size not in self.unique:
+                unique = []
+                for unique_direction in UNIQUE_DIRECTIONS:
+                    unique.extend(self.placements(size, unique_direction))
+                if size == 1:
+                    unique = unique[:len(unique) // 2]
+                self.unique[size] = tuple(unique)
+            return self.unique[size]
+        key = (size, direction)
+        if key not in self.by_direction:
+            self.by_direction[key] = tuple(self.build(size, direction))
+        return self.by_direction[key]
+
+    def build(self, size, direction):
+        y_math, x_math = ships.get_coord_maths(direction)
+        for y in range(board.MIN_Y, self.height + 1):
+            for x in range(board.MIN_X, self.width + 1):
+                mask = 0
+                cell_y, cell_x = y, x
+                for step in range(size):
+                    if not (board.MIN_Y <= cell_y <= self.height and board.MIN_X <= cell_x <= self.width):
+                        break
+                    mask |= board.cell_bit((cell_y, cell_x), self.width)
+                    cell_y, cell_x = y_math(cell_y), x_math(cell_x)
+                else:
+                    yield Placement(mask, (y, x), direction, size)
+
+    def random_placement(self, size, rng, blocked=0):
+        '''Pick a uniformly random placement of size that doesn't touch blocked.
+        :return: A Placement, or None if nothing fits.
+        '''
+        options = self.placements(size)
+        for attempt in range(MAX_RANDOM_TRIES):
+            choice = options[rng.randrange(len(options))]
+            if not choice.mask & blocked:
+                return choice
+        options = [option for option in options if not option.mask & blocked]
+        if not options:
+            return None
+        return options[rng.randrange(len(options))]
+
+    def random_fleet(self, sizes, rng, blocked=0):
+        '''Sample a non-overlapping placement for each size.
+        :return: list of Placements in the same order as sizes.
+        '''
+        while True:
+            occupied = blocked
+            fleet = []
+            for size in sizes:
+                choice = self.random_placement(size, rng, occupied)
+                if choice is None:
+                    break # Painted ourselves into a corner, start over.
+                fleet.append(choice)
+                occupied |= choice.mask
+            else:
+                return fleet
+
+    def enumerate_fleets(self, sizes, blocked=0, required=0):
+        '''Yield every fleet consistent with the constraints.
+        :param sizes: ship sizes, in fleet order.
+        :param blocked: mask of cells no ship may cover (misses).
+        :param required: mask of cells some ship must cover (hits).
+        :return: generator of tuples of Placements, in the same order as sizes.
+        '''
+        remaining_cells = [sum(sizes[index:]) for index in range(len(sizes) + 1)]
+
+        def extend(index, occupied, fleet):
+            uncovered = required & ~occupied
+            if index == len(sizes):
+                if not uncovered:
+                    yield tuple(fleet)
+                return
+            # Prune when the ships left can't cover the required cells.
+            if bin(uncovered).count('1') > remaining_cells[index]:
+                return
+            for option in self.placements(sizes[index]):
+                if option.mask & occupied:
+                    continue
+                fleet.append(option)
+                yield from extend(index + 1, occupied | option.mask, fleet)
+                fleet.pop()
+
+        yield from extend(0, blocked, [])
+
+@functools.lru_cache(maxsize=None)
+def get_placement_index(height=board.MAX_Y, width=board.MAX_X):
+    ''':return: The shared PlacementIndex for this board size.'''
+    return PlacementIndex(height, width)
+
+def random_fleet(my_board, rng):
+    '''Place every ship in my_board.fleet at a random legal spot, without overlaps.'''
+    if my_board.height * my_board.width > MAX_INDEX_CELLS:
+        random_sparse_fleet(my_board, rng)
+        return
+    index = get_placement_index(my_board.height, my_board.width)
+    fleet = index.random_fleet([ship.size for ship in my_board.fleet], rng)
+    for ship, choice in zip(my_board.fleet, fleet):
+        choice.place(ship)
+    my_board.placement_changed()
+
+def random_sparse_fleet(my_board, rng):
+    '''random_fleet() for large boards, where an index would cost memory per cell.
+    Picks random spots that fit and retries on overlap, so cost grows with the fleet only.
+    '''
+    occupied = set()
+    for ship in my_board.fleet:
+        for attempt in range(MAX_RANDOM_TRIES):
+            direction = UNIQUE_DIRECTIONS[rng.randrange(len(UNIQUE_DIRECTIONS))]
+            if direction == ships.DOWN:
+                coordinate = [rng.randint(board.MIN_Y, my_board.height - ship.size + 1),
+                              rng.randint(board.MIN_X, my_board.width)]
+            else:
+                coordinate = [rng.randint(board.MIN_Y, my_board.height),
+                              rng.randint(board.MIN_X, my_board.width - ship.size + 1)]
+            ship.set_positions(coordinate, direction)
+            if occupied.isdisjoint(ship.coords):
+                occupied.update(ship.coords)
+                break
+        else:
+            raise ValueError('Could not fit the fleet on the board.')
+    my_board.placement_changed()
+
+def apply_layout(my_board, layout):
+    '''Place my_board's fleet from a layout, as from protocol.decode_fleet().
+    Nothing moves unless the whole layout is legal.
+    :param layout: list of (size, [y, x], direction) tuples, in fleet order.
+    :return: True if the layout matched the fleet and was placed, False otherwise.
+    '''
+    if len(layout) != len(my_board.fleet):
+        return False
+    old_positions = [ship.coords for ship in my_board.fleet]
+    occupied = set()
+    for ship, (size, coordinate, direction) in zip(my_board.fleet, layout):
+        if size != ship.size or direction not in (ships.UP, ships.DOWN, ships.LEFT, ships.RIGHT):
+            break
+        ship.set_positions(coordinate, direction)
+        if not my_board.check_oob(ship) or not occupied.isdisjoint(ship.coords):
+            break
+        occupied.update(ship.coords)
+    else:
+        my_board.placement_changed()
+        return True
+    for ship, coords in zip(my_board.fleet, old_positions):
+        ship.position_list = coords
+    my_board.placement_changed()
+    return False
+
+@functools.lru_cache(maxsize=None)
+def column_mask(size, width):
+    ''':return: Mask of size cells straight down from the first cell of a width wide board.'''
+    mask = 0
+    for row in range(size):
+        mask |= 1 << (row * width)
+    return mask
+
+def layout_mask(height, width, size, coordinate, direction):
+    '''The cells a ship covers once Ship.set_positions(coordinate, direction) places it.
+    :return: The cell mask, None if any of it is off the board.
+    '''
+    y, x = coordinate
+    # Count UP and LEFT ships from their other end.
+    if direction == ships.UP:
+        y -= size - 1
+    elif direction == ships.LEFT:
+        x -= size - 1
+    across = direction in (ships.LEFT, ships.RIGHT)
+    last_y = y if across else y + size - 1
+    last_x = x + size - 1 if across else x
+    if y < board.MIN_Y or x < board.MIN_X or last_y > height or last_x > width:
+        return None
+    bit = (y - board.MIN_Y) * width + (x - board.MIN_X)
+    if across:
+        return ((1 << size) - 1) << bit
+    return column_mask(size, width) << bit
+
+def check_layout(height, width, sizes, layout):
+    '''Check a whole fleet at once, bounds first then overlaps against the ships before it.
+    :param sizes: ship sizes in fleet order.
+    :param layout: list of ([y, x], direction) tuples in fleet order, as from protocol.decode_place().
+    :return: list of (fleet index, reason) for every ship that can't go there, empty if the fleet is legal.
+    '''
+    rejections = []
+    occupied = 0
+    for fleet_index, (size, (coordinate, direction)) in enumerate(zip(sizes, layout)):
+        if direction not in DIRECTIONS:
+            rejections.append((fleet_index, BAD_DIRECTION))
+            continue
+        mask = layout_mask(height, width, size, coordinate, direction)
+        if mask is None:
+            rejections.append((fleet_index, OFF_BOARD))
+        elif mask & occupied:
+            rejections.append((fleet_index, OVERLAPS))
+        else:
+            occupied |= mask
+    return rejections
+
+def sized_layout(sizes, layout):
+    ''':return: layout with each ship's size added, the form apply_layout() takes.'''
+    return [(size, coordinate, direction) for size, (coordinate, direction) in zip(sizes, layout)]
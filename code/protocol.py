@@ -0,0 +1,369 @@
+'''Binary wire protocol for messages carried by helpers.clean_send/clean_receive.
+
+Every message starts with MAGIC and a message kind byte, followed by a
+fixed-size payload. The first byte can never be the start of an old
+style message (b'ALL PLACED', b'START GAME' or a pickle), which is how we
+detect an old peer during the ready/start handshake and fall back to
+pickle-compat mode.
+'''
+
+import io
+import pickle
+import struct
+import zlib
+import ships
+
+# ===== Constants ===== #
+VERSION = 8
+MIN_VERSION = 4 # Oldest binary version we can still talk to.
+MAGIC = 0xB5
+HEARTBEAT_VERSION = 5 # First version that sends and understands HEARTBEAT.
+PLACEMENT_VERSION = 6 # First version where the joining side sends PLACE for the host to check.
+RESUME_VERSION = 7 # First version with SESSION tokens, so a dropped match can be resumed.
+FLEET_VERSION = 8 # First version with a hash of the fleet in READY and START.
+
+# Message kinds.
+READY, START, ATTACK, RESULT, GAME_OVER = 1, 2, 3, 4, 5
+# Fleet layouts, swapped after the game and sent to spectators.
+FLEET = 6
+# Spectator only messages.
+WATCH, SHOT = 7, 8
+# Salvo rules, every shot of a turn in one message and every result in the reply.
+SALVO, SALVO_RESULT = 9, 10
+# Sent every few seconds by a side that is still there, readers skip it.
+HEARTBEAT = 11
+# The joining side's whole fleet after START, and the host's accept or per ship rejections.
+PLACE, PLACE_RESULT = 12, 13
+# The host's session token after START, RESUME from both sides on reconnecting, then the moves each side missed.
+SESSION, RESUME, REPLAY = 14, 15, 16
+
+# Rules agreed on in READY and START.
+CLASSIC_RULES, SALVO_RULES = 0, 1
+RULE_NAMES = {CLASSIC_RULES: 'classic', SALVO_RULES: 'salvo'}
+
+# RESULT sunk index when nothing sank.
+NO_SUNK = 0xFF
+TOKEN_BYTES = 16 # Length of a SESSION token.
+
+# Old (pickle-compat) protocol messages.
+ALL_PLACED = b'ALL PLACED'
+START_GAME = b'START GAME'
+HIT = GOOD = b'1'
+MISS = BAD = b'0'
+
+HEADER = struct.Struct('!BB') # magic, kind
+MESSAGES = {
+    READY: struct.Struct('!BBBHHBI'), # version, board width, board height, rules, fleet hash
+    START: struct.Struct('!BBBBHHBI'), # version, you_first, board width, board height, rules, fleet hash
+    ATTACK: struct.Struct('!BBHH'), # y, x
+    RESULT: struct.Struct('!BBBB'), # hit, sunk fleet index or NO_SUNK
+    GAME_OVER: struct.Struct('!BBB'), # you_won, or the winning player for spectators
+    WATCH: struct.Struct('!BBBHH'), # version, board width, board height
+    SHOT: struct.Struct('!BBBHHBB'), # player, y, x, hit, sunk fleet index or NO_SUNK
+    HEARTBEAT: struct.Struct('!BB'), # no payload
+    SESSION: struct.Struct(f'!BB{TOKEN_BYTES}s'), # token
+    RESUME: struct.Struct(f'!BB{TOKEN_BYTES}sI'), # token, moves we have the result of
+}
+# READY and START from before FLEET_VERSION, without the fleet hash, those peers always play the standard fleet.
+OLD_MESSAGES = {
+    READY: struct.Struct('!BBBHHB'),
+    START: struct.Struct('!BBBBHHB'),
+}
+# FLEET is the only variable length message, FLEET_HEADER then one FLEET_SHIP per ship.
+FLEET_HEADER = struct.Struct('!BBBH') # player, ship count
+FLEET_SHIP = struct.Struct('!BHHB') # size, y, x, direction
+# SALVO, SALVO_RESULT, PLACE, PLACE_RESULT and REPLAY are a count followed by one entry each.
+SALVO_HEADER = struct.Struct('!BBH') # shot count
+SALVO_SHOT = struct.Struct('!HH') # y, x
+SALVO_RESULT_SHOT = struct.Struct('!BB') # hit, sunk fleet index or NO_SUNK
+PLACE_SHIP = struct.Struct('!HHB') # y, x, direction, one per ship in fleet order
+PLACE_REJECT = struct.Struct('!BB') # fleet index, reason, none at all means accepted
+REPLAY_SHOT = struct.Struct('!IHHBB') # move number, y, x, hit, sunk fleet index or NO_SUNK
+
+class ProtocolError(Exception):
+    '''Raised when a peer sends something we can't understand.'''
+
+
+def fleet_hash(fleet):
+    ''':return: 32 bit hash of a fleet's ship sizes in fleet order, sent in READY and START.'''
+    sizes = [ship.size for ship in fleet]
+    return zlib.crc32(struct.pack(f'!{len(sizes)}H', *sizes))
+
+STANDARD_FLEET_HASH = fleet_hash(ships.build_fleet())
+
+def encode(kind, *fields):
+    ''':return: bytes for a message of kind with the given payload fields.'''
+    return MESSAGES[kind].pack(MAGIC, kind, *fields)
+
+def is_binary(data):
+    ''':return: True if data looks like a binary protocol message.'''
+    return len(data) >= HEADER.size and data[0] == MAGIC
+
+def kind_of(data):
+    ''':return: The message kind of a binary message.'''
+    if not is_binary(data):
+        raise ProtocolError('Not a binary protocol message.')
+    return data[1]
+
+def decode(data):
+    '''Parse a message.
+    :param data: bytes-like frame contents.
+    :return: tuple of (kind, fields tuple).
+    '''
+    kind = kind_of(data)
+    message = MESSAGES.get(kind)
+    extra = ()
+    if kind in OLD_MESSAGES and len(data) == OLD_MESSAGES[kind].size:
+        # A peer from before FLEET_VERSION, it plays the standard fleet.
+        message, extra = OLD_MESSAGES[kind], (STANDARD_FLEET_HASH,)
+    if message is None or len(data) != message.size:
+        raise ProtocolError(f'Bad message kind {kind} or length {len(data)}.')
+    return kind, message.unpack(data)[2:] + extra
+
+def expect(data, kind):
+    '''Decode data and make sure it is the kind of message we want.
+    :return: The payload fields.
+    '''
+    got, fields = decode(data)
+    if got != kind:
+        raise ProtocolError(f'Expected message kind {kind}, got {got}.')
+    return fields
+
+def negotiate(peer_version, my_version=VERSION):
+    ''':return: The version both sides speak. Raise ProtocolError if there is none.'''
+    if peer_version < MIN_VERSION:
+        raise ProtocolError(f'Peer protocol version {peer_version} is too old.')
+    return min(my_version, peer_version)
+
+def check_board_size(peer_size, my_size):
+    '''Raise ProtocolError unless both sides play on the same width, height board.'''
+    if tuple(peer_size) != tuple(my_size):
+        raise ProtocolError(f'Peer board is {peer_size[0]}x{peer_size[1]}, ours is {my_size[0]}x{my_size[1]}.')
+
+def check_rules(peer_rules, my_rules):
+    '''Raise ProtocolError unless both sides play by the same rules.'''
+    if peer_rules != my_rules:
+        raise ProtocolError(f'Peer plays {RULE_NAMES.get(peer_rules, peer_rules)} rules, '
+                            f'we play {RULE_NAMES.get(my_rules, my_rules)}.')
+
+def check_fleet(peer_hash, my_fleet):
+    '''Raise ProtocolError unless both sides built the same fleet, the same ship sizes in the same order.'''
+    if peer_hash != fleet_hash(my_fleet):
+        sizes = ', '.join(str(ship.size) for ship in my_fleet)
+        raise ProtocolError(f'Peer fleet is not the same as ours, {len(my_fleet)} ships of sizes {sizes}.')
+
+# ===== Message helpers ===== #
+def encode_ready(width, height, rules=CLASSIC_RULES, fleet=None):
+    ''':param fleet: our list of ships, None for the standard fleet.'''
+    return encode(READY, VERSION, width, height, rules,
+                  STANDARD_FLEET_HASH if fleet is None else fleet_hash(fleet))
+
+def encode_start(you_first, width, height, rules=CLASSIC_RULES, version=VERSION, fleet=None):
+    '''Peers from before FLEET_VERSION get START without the fleet hash.
+    :param fleet: our list of ships, None for the standard fleet.
+    '''
+    if version < FLEET_VERSION:
+        return OLD_MESSAGES[START].pack(MAGIC, START, version, int(you_first), width, height, rules)
+    return encode(START, version, int(you_first), width, height, rules,
+                  STANDARD_FLEET_HASH if fleet is None else fleet_hash(fleet))
+
+def encode_heartbeat():
+    return encode(HEARTBEAT)
+
+def is_heartbeat(data):
+    return len(data) == HEADER.size and data[0] == MAGIC and data[1] == HEARTBEAT
+
+def sends_heartbeats(peer_version):
+    ''':return: True if a peer speaking peer_version sends and accepts heartbeats.'''
+    return peer_version >= HEARTBEAT_VERSION
+
+def checks_placement(version):
+    ''':return: True if the joining side sends PLACE after START at this negotiated version.'''
+    return version >= PLACEMENT_VERSION
+
+def resumes(version):
+    ''':return: True if the host sends SESSION (after PLACE, if any) at this negotiated version.'''
+    return version >= RESUME_VERSION
+
+def encode_session(token):
+    return encode(SESSION, token)
+
+def encode_resume(token, moves):
+    return encode(RESUME, token, moves)
+
+def encode_game_over(you_won):
+    return encode(GAME_OVER, int(you_won))
+
+def encode_attack(coordinate, compat=False):
+    '''Encode a y,x attack. Old peers get a pickled list.'''
+    if compat:
+        return pickle.dumps([coordinate[0], coordinate[1]])
+    return encode(ATTACK, coordinate[0], coordinate[1])
+
+def decode_attack(data, compat=False):
+    ''':return: The attacked [y, x] coordinate.'''
+    if compat:
+        return safe_loads_coordinate(data)
+    y, x = expect(data, ATTACK)
+    return [y, x]
+
+def encode_result(result, compat=False):
+    '''Encode the return value of Board.attack().
+    :param result: False, True, or a tuple of (True, sunk fleet index).
+    '''
+    if type(result) == tuple:
+        sunk_index = result[1]
+    else:
+        sunk_index = NO_SUNK
+    if compat:
+        if not result:
+            return MISS
+        if sunk_index == NO_SUNK:
+            return HIT
+        return HIT + sunk_index.to_bytes(1, byteorder='big')
+    return encode(RESULT, int(bool(result)), sunk_index)
+
+def decode_result(data, compat=False):
+    ''':return: tuple of (hit bool, sunk fleet index or None).'''
+    if compat:
+        # Slice instead of index. Return bytestring instead of int.
+        hit = data[0:1] == HIT
+        sunk_index = None
+        if hit and len(data) == 2:
+            sunk_index = data[1]
+        return hit, sunk_index
+    hit, sunk_index = expect(data, RESULT)
+    if sunk_index == NO_SUNK:
+        sunk_index = None
+    return bool(hit), sunk_index
+
+def encode_salvo(coordinates):
+    ''':param coordinates: every y,x coordinate fired this turn.'''
+    return SALVO_HEADER.pack(MAGIC, SALVO, len(coordinates)) + b''.join(
+        SALVO_SHOT.pack(coordinate[0], coordinate[1]) for coordinate in coordinates)
+
+def decode_salvo(data):
+    ''':return: list of attacked [y, x] coordinates.'''
+    decode_count(data, SALVO, SALVO_SHOT)
+    return [[y, x] for y, x in SALVO_SHOT.iter_unpack(data[SALVO_HEADER.size:])]
+
+def encode_salvo_result(results):
+    '''Encode the results of Board.attack_salvo(), one per shot fired.
+    :param results: list of False, True, or (True, sunk fleet index).
+    '''
+    parts = [SALVO_HEADER.pack(MAGIC, SALVO_RESULT, len(results))]
+    for result in results:
+        sunk_index = result[1] if type(result) == tuple else NO_SUNK
+        parts.append(SALVO_RESULT_SHOT.pack(int(bool(result)), sunk_index))
+    return b''.join(parts)
+
+def decode_salvo_result(data):
+    ''':return: list of (hit bool, sunk fleet index or None), one per shot fired.'''
+    decode_count(data, SALVO_RESULT, SALVO_RESULT_SHOT)
+    return [(bool(hit), None if sunk_index == NO_SUNK else sunk_index)
+            for hit, sunk_index in SALVO_RESULT_SHOT.iter_unpack(data[SALVO_HEADER.size:])]
+
+def decode_count(data, kind, entry):
+    '''Check a SALVO, SALVO_RESULT, PLACE or PLACE_RESULT message is complete.
+    :return: The number of entries in it.
+    '''
+    if kind_of(data) != kind or len(data) < SALVO_HEADER.size:
+        raise ProtocolError(f'Expected message kind {kind}.')
+    count = SALVO_HEADER.unpack_from(data)[2]
+    if len(data) != SALVO_HEADER.size + count * entry.size:
+        raise ProtocolError(f'Bad message length {len(data)} for {count} entries.')
+    return count
+
+def encode_place(fleet):
+    '''Encode the first cell and direction of every ship, in fleet order.
+    Ship sizes aren't sent, both sides build the same fleet.'''
+    parts = [SALVO_HEADER.pack(MAGIC, PLACE, len(fleet))]
+    for ship in fleet:
+        # Unplaced ships go out as 0, 0 with direction 0, the host rejects them.
+        y, x = ship.coords[0] if ship.coords else (0, 0)
+        parts.append(PLACE_SHIP.pack(y, x, ships.get_direction(ship) or 0))
+    return b''.join(parts)
+
+def decode_place(data, ship_count):
+    '''Parse a PLACE message.
+    :param ship_count: ships in our fleet, the message must place exactly that many.
+    :return: list of ([y, x], direction) tuples, in fleet order.
+    '''
+    if decode_count(data, PLACE, PLACE_SHIP) != ship_count:
+        raise ProtocolError(f'Expected {ship_count} ships to place.')
+    return [([y, x], direction) for y, x, direction in PLACE_SHIP.iter_unpack(data[SALVO_HEADER.size:])]
+
+def encode_place_result(rejections):
+    ''':param rejections: list of (fleet index, reason) from placement.check_layout(), empty to accept.'''
+    return SALVO_HEADER.pack(MAGIC, PLACE_RESULT, len(rejections)) + b''.join(
+        PLACE_REJECT.pack(fleet_index, reason) for fleet_index, reason in rejections)
+
+def decode_place_result(data):
+    ''':return: list of (fleet index, reason), empty if the fleet was accepted.'''
+    decode_count(data, PLACE_RESULT, PLACE_REJECT)
+    return list(PLACE_REJECT.iter_unpack(data[SALVO_HEADER.size:]))
+
+def encode_replay(shots):
+    '''Encode shots our peer fired that we resolved and it never got the results of.
+    :param shots: list of (move number, [y, x], hit, sunk fleet index or None), in move order.
+    '''
+    return SALVO_HEADER.pack(MAGIC, REPLAY, len(shots)) + b''.join(
+        REPLAY_SHOT.pack(move, coordinate[0], coordinate[1], int(hit), NO_SUNK if fleet_index is None else fleet_index)
+        for move, coordinate, hit, fleet_index in shots)
+
+def decode_replay(data):
+    ''':return: list of (move number, [y, x], hit, sunk fleet index or None).'''
+    decode_count(data, REPLAY, REPLAY_SHOT)
+    return [(move, [y, x], bool(hit), None if sunk_index == NO_SUNK else sunk_index)
+            for move, y, x, hit, sunk_index in REPLAY_SHOT.iter_unpack(data[SALVO_HEADER.size:])]
+
+def encode_fleet(fleet, player=0):
+    '''Encode where every ship of a placed fleet is.
+    :param player: whose fleet it is, for spectators.
+    '''
+    parts = [FLEET_HEADER.pack(MAGIC, FLEET, player, len(fleet))]
+    for ship in fleet:
+        # Unplaced ships go out as 0, 0 with direction 0.
+        y, x = ship.coords[0] if ship.coords else (0, 0)
+        parts.append(FLEET_SHIP.pack(ship.size, y, x, ships.get_direction(ship) or 0))
+    return b''.join(parts)
+
+def decode_fleet(data):
+    ''':return: tuple of (player, list of (size, [y, x], direction) tuples).'''
+    if kind_of(data) != FLEET or len(data) < FLEET_HEADER.size:
+        raise ProtocolError('Expected a fleet message.')
+    player, count = FLEET_HEADER.unpack_from(data)[2:]
+    if len(data) != FLEET_HEADER.size + count * FLEET_SHIP.size:
+        raise ProtocolError(f'Bad fleet message length {len(data)}.')
+    layout = [(size, [y, x], direction)
+              for size, y, x, direction in FLEET_SHIP.iter_unpack(data[FLEET_HEADER.size:])]
+    return player, layout
+
+def encode_watch(width, height):
+    return encode(WATCH, VERSION, width, height)
+
+def encode_shot(player, coordinate, result):
+    '''Encode a resolved attack for spectators.
+    :param result: False, True, or a tuple of (True, sunk fleet index), as from Board.attack().
+    '''
+    sunk_index = result[1] if type(result) == tuple else NO_SUNK
+    return encode(SHOT, player, coordinate[0], coordinate[1], int(bool(result)), sunk_index)
+
+# ===== Pickle compat ===== #
+class CoordinateUnpickler(pickle.Unpickler):
+    '''Unpickler that refuses to load any class or function.'''
+    def find_class(self, module, name):
+        raise ProtocolError(f'Refusing to unpickle {module}.{name}.')
+
+def safe_loads_coordinate(data):
+    '''Unpickle an old style attack, only accepting a list of two ints.'''
+    try:
+        coordinate = CoordinateUnpickler(io.BytesIO(data)).load()
+    except ProtocolError:
+        raise
+    except Exception as error:
+        raise ProtocolError(f'Bad pickled coordinate: {error}')
+    if (type(coordinate) not in (list, tuple) or len(coordinate) != 2
+            or not all(type(value) == int for value in coordinate)):
+        raise ProtocolError('Pickled coordinate must be a list of two ints.')
+    return list(coordinate)
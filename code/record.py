@@ -0,0 +1,287 @@
+'''Compact binary game records.
+
+A record file is FILE_HEADER followed by games, appended one after the
+other and never rewritten. Several processes may append to the same file,
+each game goes out in one write and is flushed straight away. Each game is a GAME_HEADER (board size,
+winner, fleet and shot counts), one SHIP entry per ship of each player,
+then one fixed-width SHOT entry per shot:
+
+    FILE_HEADER  magic, version
+    GAME_HEADER  width, height, ships of player 0, ships of player 1, winner, shots
+    SHIP * n     size, label, y, x, direction (NOT_PLACED if we never saw it)
+    SHOT * n     player, y, x, hit, sunk fleet index or NO_SUNK
+
+RecordReader mmaps a file and only unpacks what you ask for, so a corpus
+of millions of games can be counted, skipped through or sampled without
+building Python objects for every shot.
+
+To run:
+    python3 record.py stats games.rec
+    python3 record.py replay games.rec --game 3 --delay 0.5
+'''
+
+import argparse
+import mmap
+import struct
+import sys
+import time
+import board
+import helpers
+import session
+import ships
+
+# ===== Constants =====
+MAGIC = b'BSGR'
+VERSION = 1
+FILE_HEADER = struct.Struct('!4sB') # magic, version
+GAME_HEADER = struct.Struct('!HHHHBI') # width, height, player 0 ships, player 1 ships, winner, shots
+SHIP = struct.Struct('!BcHHB') # size, label, y, x, direction
+SHOT = struct.Struct('!BHHBB') # player, y, x, hit, sunk fleet index
+NOT_PLACED = 0 # SHIP direction when we don't know where the ship was.
+NO_SUNK = 0xFF
+NO_WINNER = 0xFF # Game was abandoned.
+WRITE_BUFFER_SIZE = 64 * 1024
+REPLAY_DELAY = 0.5 # Seconds between shots.
+
+class RecordError(Exception):
+    '''Raised for files that aren't game records or are cut short.'''
+
+
+def encode_fleet(fleet, known=True):
+    '''Pack a fleet into SHIP entries.
+    :param known: False for a fleet we only know the sizes of (our peer's).
+    '''
+    entries = []
+    for ship in fleet:
+        direction = ships.get_direction(ship) if known else None
+        if direction is None:
+            direction = NOT_PLACED
+        y, x = ship.coords[0] if direction != NOT_PLACED else (0, 0)
+        entries.append(SHIP.pack(ship.size, ship.label.encode()[:1], y, x, direction))
+    return b''.join(entries)
+
+# ===== Writing =====
+class RecordWriter():
+    '''Appends whole games to a record file.'''
+
+    def __init__(self, path):
+        # Only whoever creates the file writes the header, two players
+        # starting on a new file at once must not both write one.
+        try:
+            with open(path, 'xb') as new_file:
+                new_file.write(FILE_HEADER.pack(MAGIC, VERSION))
+        except FileExistsError:
+            pass
+        self.file = open(path, 'ab', buffering=WRITE_BUFFER_SIZE)
+
+    def write_game(self, width, height, fleets, winner, shots):
+        '''Append one game.
+        :param fleets: two (fleet, known) pairs, see encode_fleet().
+        :param winner: winning player index, None if the game was abandoned.
+        :param shots: bytes of packed SHOT entries.
+        '''
+        header = GAME_HEADER.pack(width, height, len(fleets[0][0]), len(fleets[1][0]),
+                                  NO_WINNER if winner is None else winner, len(shots) // SHOT.size)
+        # One write per game, so games appended by another process can't land in the middle of it.
+        self.file.write(header + b''.join(encode_fleet(fleet, known) for fleet, known in fleets) + shots)
+        self.file.flush()
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class GameRecorder():
+    '''Records one GameSession as it is played.
+    Shots are kept in memory and the game is appended in one write when it ends.
+    '''
+
+    def __init__(self, writer, game, known=(True, True)):
+        '''
+        :param writer: RecordWriter to append to.
+        :param game: session.GameSession, we listen to its events.
+        :param known: for each player, whether we know their ship positions.
+        '''
+        self.writer = writer
+        self.game = game
+        self.known = known
+        self.shots = bytearray()
+        self.written = False
+        game.listeners.append(self.on_events)
+
+    def on_events(self, game, events):
+        shot = None
+        for event in events:
+            if event.kind in (session.HIT, session.MISS):
+                shot = [event.player, event.coordinate[0], event.coordinate[1], event.kind == session.HIT, NO_SUNK]
+            elif event.kind == session.SUNK:
+                shot[4] = event.fleet_index
+        if shot is not None:
+            self.shots += SHOT.pack(*shot)
+        if game.is_over():
+            self.finish()
+
+    def finish(self):
+        '''Write the game, called for us when it is won. Safe to call again.'''
+        if self.written:
+            return
+        self.written = True
+        boards = self.game.boards
+        self.writer.write_game(boards[0].width, boards[0].height,
+                               [(boards[0].fleet, self.known[0]), (boards[1].fleet, self.known[1])],
+                               self.game.winner, bytes(self.shots))
+
+# ===== Reading =====
+class GameRecord():
+    '''One game in a mapped record file. Shots are unpacked as you iterate.'''
+
+    def __init__(self, view, offset):
+        self.view = view
+        self.offset = offset
+        (self.width, self.height, ship_counts_0, ship_counts_1,
+         winner, self.shot_count) = GAME_HEADER.unpack_from(view, offset)
+        self.winner = None if winner == NO_WINNER else winner
+        self.ship_counts = (ship_counts_0, ship_counts_1)
+        self.ships_offset = offset + GAME_HEADER.size
+        self.shots_offset = self.ships_offset + SHIP.size * (ship_counts_0 + ship_counts_1)
+        self.end = self.shots_offset + SHOT.size * self.shot_count
+        if self.end > len(view):
+            raise RecordError(f'Game at byte {offset} is cut short.')
+
+    def __len__(self):
+        return self.shot_count
+
+    def fleets(self):
+        ''':return: Two lists of (size, label, [y, x] or None, direction) tuples.'''
+        entries = [(size, label.decode(), [y, x] if direction != NOT_PLACED else None, direction)
+                   for size, label, y, x, direction
+                   in SHIP.iter_unpack(self.view[self.ships_offset:self.shots_offset])]
+        return entries[:self.ship_counts[0]], entries[self.ship_counts[0]:]
+
+    def shots(self):
+        '''Yield (player, [y, x], hit, fleet index or None) for each shot.'''
+        for player, y, x, hit, sunk in SHOT.iter_unpack(self.view[self.shots_offset:self.end]):
+            yield player, [y, x], bool(hit), None if sunk == NO_SUNK else sunk
+
+    def boards(self):
+        ''':return: Two Boards with the recorded fleets placed where we know them.'''
+        boards = []
+        for fleet_entries in self.fleets():
+            fleet = []
+            for size, label, coordinate, direction in fleet_entries:
+                ship_class = ships.SHIP_CLASSES.get(label.lower())
+                ship = ship_class() if ship_class else None
+                if ship is None or ship.size != size:
+                    ship = ships.Ship(size, label, f'{size} cell ship')
+                if coordinate is not None:
+                    ship.set_positions(coordinate, direction)
+                fleet.append(ship)
+            boards.append(board.Board(self.width, self.height, fleet))
+        return boards
+
+class RecordReader():
+    '''Memory maps a record file. Games are found by hopping from header
+    to header, nothing else is unpacked until asked for.'''
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise RecordError(f'{path} is empty.')
+        self.view = memoryview(self.map)
+        if len(self.view) < FILE_HEADER.size:
+            self.close()
+            raise RecordError(f'{path} is not a game record.')
+        magic, version = FILE_HEADER.unpack_from(self.view)
+        if magic != MAGIC or version > VERSION:
+            self.close()
+            raise RecordError(f'{path} is not a game record we can read.')
+        self.offsets = None # Start of every game, found on first use.
+
+    def __iter__(self):
+        offset = FILE_HEADER.size
+        while offset < len(self.view):
+            game = GameRecord(self.view, offset)
+            yield game
+            offset = game.end
+
+    def game_offsets(self):
+        if self.offsets is None:
+            self.offsets = [game.offset for game in self]
+        return self.offsets
+
+    def __len__(self):
+        return len(self.game_offsets())
+
+    def __getitem__(self, index):
+        return GameRecord(self.view, self.game_offsets()[index])
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# ===== Commands =====
+def replay(game_record, delay=REPLAY_DELAY, player=0):
+    '''Step through a game with helpers.render_map, from player's side of the table.'''
+    boards = game_record.boards()
+    game = session.GameSession(boards)
+    shots = list(game_record.shots())
+    game.start(shots[0][0] if shots else 0)
+    my_board, enemy_board = boards[player], boards[1 - player]
+    helpers.render_map(enemy_board, my_board, 'Replay, start of game.', clear=True)
+    for number, (shooter, coordinate, hit, fleet_index) in enumerate(shots, 1):
+        time.sleep(delay)
+        # Salvo games fire several shots a turn, follow whoever the record says shot.
+        game.turn = shooter
+        game.apply_result(coordinate, hit, fleet_index, shooter)
+        who = 'You' if shooter == player else 'Peer'
+        result = 'sank a ship' if fleet_index is not None else 'hit' if hit else 'missed'
+        message = f'Shot {number}: {who} {result} at {helpers.coordinate_label(coordinate)}.'
+        helpers.render_map(enemy_board, my_board, message, clear=True)
+    if game_record.winner is None:
+        print('The game was abandoned.')
+    else:
+        print(f'Player {game_record.winner} won.')
+
+def stats(reader):
+    ''':return: One line summary of every game in a record file.'''
+    games = shots = 0
+    wins = [0, 0]
+    for game_record in reader:
+        games += 1
+        shots += game_record.shot_count
+        if game_record.winner is not None:
+            wins[game_record.winner] += 1
+    mean = shots / games if games else 0
+    return f'{games} games, {shots} shots, {mean:.1f} shots per game, wins {wins[0]}-{wins[1]}'
+
+def main():
+    parser = argparse.ArgumentParser(description='Read battleship game records.')
+    parser.add_argument('command', choices=['stats', 'replay'])
+    parser.add_argument('path')
+    parser.add_argument('--game', type=int, default=0, help='index of the game to replay, negative counts from the end')
+    parser.add_argument('--delay', type=float, default=REPLAY_DELAY)
+    parser.add_argument('--player', type=int, choices=[0, 1], default=0, help='whose side to replay from')
+    args = parser.parse_args()
+    try:
+        with RecordReader(args.path) as reader:
+            if args.command == 'stats':
+                print(stats(reader))
+            else:
+                replay(reader[args.game], args.delay, args.player)
+    except (OSError, RecordError, IndexError) as error:
+        print(error)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+'''Frame based terminal rendering.
+
+The whole screen (both boards, status panels, legend and message) is
+built as a list of lines and written with a single sys.stdout.write().
+The screen is cleared with ANSI escapes instead of spawning a shell.
+With repaint_changes on, only the lines that changed since the last
+frame are redrawn.
+'''
+
+import sys
+
+# ===== Constants =====
+CLEAR_SCREEN = '\x1b[H\x1b[2J'
+CLEAR_LINE_END = '\x1b[K'
+CLEAR_SCREEN_END = '\x1b[J'
+VIEW_SIZE = 10 # Rows and columns shown per board, bigger boards scroll.
+
+ENEMY_HEADER = '=================  Enemy Board =================='
+MY_HEADER = '=================  Your Board ==================='
+PANEL_HEADER = '          '
+PANEL_TEXT = '           '
+
+# Frame line numbers: 3 header lines per board, then a cell row and a separator per board row.
+BOARD_LINES = 3 + 2 * VIEW_SIZE
+
+def enable_ansi():
+    '''Turn on ANSI escape handling in the Windows console. No-op elsewhere.'''
+    if sys.platform != 'win32':
+        return
+    try:
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.GetStdHandle(-11) # STD_OUTPUT_HANDLE
+        mode = ctypes.c_uint32()
+        if kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+            kernel32.SetConsoleMode(handle, mode.value | 0x0004) # ENABLE_VIRTUAL_TERMINAL_PROCESSING
+    except Exception:
+        pass
+
+def sunk_char(board, fleet_index):
+    '''Return a single character, indicating that ship's sunk state.'''
+    if board.fleet[fleet_index].is_sunk:
+        return '*'
+    return ' '
+
+def column_label(x):
+    '''Return the letters for column x, 1 is 'A', 27 is 'AA'.'''
+    label = ''
+    while x > 0:
+        x, remainder = divmod(x - 1, 26)
+        label = chr(ord('A') + remainder) + label
+    return label
+
+def view_range(size, center):
+    '''Pick which rows (or columns) to show.
+    :param size: rows (or columns) on the board.
+    :param center: row (or column) to keep in view, None for the top (or left).
+    :return: range of the shown rows (or columns).
+    '''
+    shown = min(size, VIEW_SIZE)
+    first = 1
+    if center is not None:
+        first = min(max(1, center - shown // 2), size - shown + 1)
+    return range(first, first + shown)
+
+class Viewport():
+    '''The part of a board that fits on screen, with its labels and separators.'''
+
+    def __init__(self, board):
+        center = board.view_center or board.last_shot or (None, None)
+        self.rows = view_range(board.height, center[0])
+        self.columns = view_range(board.width, center[1])
+        # Accomodate the extra digits in "10" and up.
+        self.label_width = max(3, len(str(board.height)))
+        indent = ' ' * (self.label_width + 1)
+        self.separator = indent + '+ - ' * len(self.columns) + '+'
+        self.column_header = (indent + ' ' + ''.join(f'{column_label(x):^3} ' for x in self.columns)).rstrip()
+        self.scrolled = len(self.rows) < board.height or len(self.columns) < board.width
+
+    def header(self, title):
+        ''':return: title, with the shown range when the board doesn't fit.'''
+        if not self.scrolled:
+            return title
+        return (f'{title} rows {self.rows[0]}-{self.rows[-1]} '
+                f'columns {column_label(self.columns[0])}-{column_label(self.columns[-1])}')
+
+    def row_label(self, y):
+        return f' {y:<{self.label_width}}|'
+
+    def line_count(self):
+        return 3 + 2 * len(self.rows)
+
+def status_lines(board, room):
+    '''One line per ship with its sunk flag, or a summary if they don't fit in room lines.'''
+    if len(board.fleet) <= room:
+        return [f'{PANEL_TEXT}{sunk_char(board, fleet_index)} {ship.name}'
+                for fleet_index, ship in enumerate(board.fleet)]
+    return [f'{PANEL_TEXT}{board.ships_afloat} of {len(board.fleet)} ships afloat']
+
+def legend_lines(board):
+    ''':return: The symbol legend, one line per type of ship.'''
+    lines = [f'{PANEL_HEADER}====== Legend ========',
+             f'{PANEL_TEXT}O - Miss',
+             f'{PANEL_TEXT}X - Hit',
+             f'{PANEL_TEXT}* - Sunk ship',
+             '']
+    seen = set()
+    for ship in board.fleet:
+        if ship.label not in seen:
+            seen.add(ship.label)
+            lines.append(f'{PANEL_TEXT}{ship.label} - {ship.name} - {ship.size}')
+    return lines
+
+def board_lines(title, viewport, cell_symbol, panel):
+    '''Lay out one board with a side panel.
+    :param cell_symbol: function(y, x) returning the character to draw in that cell.
+    :param panel: list of side panel strings, the first lines up with the row separator under the column header.
+    :return: List of viewport.line_count() strings.
+    '''
+    lines = [viewport.header(title), viewport.column_header]
+    panel = panel + [''] * (2 * len(viewport.rows) + 1 - len(panel))
+    lines.append(viewport.separator + panel[0])
+    for row, y in enumerate(viewport.rows):
+        cells = [viewport.row_label(y)]
+        for x in viewport.columns:
+            cells.append(f' {cell_symbol(y, x)} |')
+        cells.append(panel[2 * row + 1])
+        lines.append(''.join(cells))
+        lines.append(viewport.separator + panel[2 * row + 2])
+    return lines
+
+def enemy_lines(enemy_board, message):
+    '''Build the top half of the screen. The enemy board and game message.
+    :return: List of lines, BOARD_LINES for boards of at least VIEW_SIZE.
+    '''
+    viewport = Viewport(enemy_board)
+    room = 2 * len(viewport.rows) + 1
+    panel = [''] * room
+    panel[0] = f'{PANEL_HEADER}===== Message =========='
+    panel[1] = f'{PANEL_TEXT}{message}'
+    # Enemy status sits at the bottom of the panel.
+    status = status_lines(enemy_board, room - 3)
+    panel[room - len(status) - 1] = f'{PANEL_HEADER}===== Enemy Status ====='
+    panel[room - len(status):] = status
+
+    def cell_symbol(y, x):
+        if enemy_board.is_hit([y,x]):
+            return 'X'
+        if enemy_board.is_miss([y,x]):
+            return 'O'
+        return ' '
+    return board_lines(ENEMY_HEADER, viewport, cell_symbol, panel)
+
+def ship_symbols(board):
+    ''':return: dict of (y, x) to ship symbol for every placed ship cell.'''
+    symbols = {}
+    for ship in board.fleet:
+        for pos in ship.get_positions():
+            # First ship wins a shared cell, unless a later one sank.
+            if (pos[0], pos[1]) not in symbols or ship.symbol == '*':
+                symbols[(pos[0], pos[1])] = ship.symbol
+    return symbols
+
+def my_board_lines(my_board):
+    '''Build my board's ship placement, status, and symbol legend.
+    :return: List of lines, BOARD_LINES for boards of at least VIEW_SIZE.
+    '''
+    viewport = Viewport(my_board)
+    room = 2 * len(viewport.rows) + 1
+    legend = legend_lines(my_board)
+    if len(legend) > room - 2:
+        legend = [] # No space for the legend on tiny boards.
+    panel = [f'{PANEL_HEADER}===== Your Status =====']
+    panel.extend(status_lines(my_board, room - 1 - len(legend)))
+    # Legend sits at the bottom of the panel.
+    panel.extend([''] * (room - len(panel) - len(legend)))
+    panel.extend(legend)
+
+    symbols = ship_symbols(my_board)
+    def cell_symbol(y, x):
+        # Attacked coordinates supercede fleet symbols, unless the ship sank.
+        symbol = ' '
+        if my_board.is_hit([y,x]):
+            symbol = 'X'
+        elif my_board.is_miss([y,x]):
+            symbol = 'O'
+        ship_symbol = symbols.get((y, x))
+        if ship_symbol is not None and (symbol == ' ' or ship_symbol == '*'):
+            symbol = ship_symbol
+        return symbol
+    return board_lines(MY_HEADER, viewport, cell_symbol, panel)
+
+def frame_lines(enemy_board, my_board, message):
+    ''':return: Every line of the full screen, both boards, panels and legend.'''
+    lines = enemy_lines(enemy_board, message)
+    lines.extend(my_board_lines(my_board))
+    lines.append('') # Decided I wanted an extra line before inputs.
+    return lines
+
+class FrameRenderer():
+    '''Writes frames to a stream in one write call.'''
+
+    def __init__(self, stream=None, repaint_changes=False):
+        '''
+        :param stream: file-like object to write to, defaults to sys.stdout.
+        :param repaint_changes: only redraw lines that changed since the last frame.
+        '''
+        self.stream = stream
+        self.repaint_changes = repaint_changes
+        self.last_lines = None # Lines currently on screen, None if unknown.
+
+    def draw(self, lines, clear=True):
+        '''Write a frame.
+        :param lines: list of strings, one per screen line.
+        :param clear: clear the screen first, otherwise append below current output.
+        '''
+        stream = self.stream or sys.stdout
+        if not clear:
+            # We don't know where the frame lands, the next one must be drawn in full.
+            self.last_lines = None
+            stream.write('\n'.join(lines) + '\n')
+        elif (self.repaint_changes and self.last_lines is not None
+                and len(self.last_lines) == len(lines)):
+            parts = []
+            for index, line in enumerate(lines):
+                if line != self.last_lines[index]:
+                    parts.append(f'\x1b[{index + 1};1H{line}{CLEAR_LINE_END}')
+            # Park the cursor below the frame and wipe old prompts.
+            parts.append(f'\x1b[{len(lines) + 1};1H{CLEAR_SCREEN_END}')
+            stream.write(''.join(parts))
+            self.last_lines = lines
+        else:
+            stream.write(CLEAR_SCREEN + '\n'.join(lines) + '\n')
+            self.last_lines = lines
+        stream.flush()
+
+    def clear(self):
+        '''Clear the screen without drawing a frame.'''
+        stream = self.stream or sys.stdout
+        stream.write(CLEAR_SCREEN)
+        stream.flush()
+        self.last_lines = None
+
+# Shared renderer used by helpers.render_map().
+renderer = FrameRenderer()
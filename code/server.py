@@ -0,0 +1,391 @@
+'''Multi-match host server.
+
+Keeps the listener open, pairs incoming players into independent matches
+and referees each of them on one asyncio loop. Players connect with the
+normal "join" option of battleship.py.
+
+Players that speak heartbeats get one from us every HEARTBEAT_INTERVAL
+seconds, and once one has sent us a heartbeat it is dropped after
+PEER_TIMEOUT seconds of silence. Every player also has TURN_TIMEOUT
+seconds for each frame we wait on, and TCP keepalive on its socket.
+
+Players new enough send their whole fleet (PLACE) after START. We check
+it once, and from then on check every result they report against it.
+
+To run:
+    python3 server.py --max-matches 500
+'''
+
+import argparse
+import asyncio
+import itertools
+import time
+import board
+import helpers
+import placement
+import protocol
+import record
+import session
+import transport
+
+# ===== Constants =====
+LOCAL_ADDRESS = '0.0.0.0' # Bind to all
+PORT = 5598 # Same as battleship.PORT
+MAX_MATCHES = 200
+MAX_WAITING = 64 # Players allowed to wait for a match slot before we refuse connections.
+STATUS_INTERVAL = 10 # Seconds between status reports.
+TURN_TIMEOUT = 600 # Seconds a player gets for each frame we wait on.
+HEARTBEAT_INTERVAL = 5 # Seconds between our heartbeats to each player.
+PEER_TIMEOUT = 20 # Seconds of silence before a player that sends heartbeats counts as gone.
+# Newest protocol we referee. Resuming (protocol.RESUME_VERSION) is only between two battleship.py players.
+PROTOCOL_VERSION = protocol.PLACEMENT_VERSION
+
+# Match states.
+HANDSHAKE, PLAYING, FINISHED, ABORTED = 'handshake', 'playing', 'finished', 'aborted'
+
+async def read_frame(reader):
+    '''Read one length prefixed frame, the asyncio version of helpers.clean_receive().'''
+    len_bytes = await reader.readexactly(helpers.LENGTH_BYTES)
+    length = int.from_bytes(len_bytes, byteorder='big')
+    if length > transport.MAX_FRAME_SIZE:
+        raise protocol.ProtocolError(f'Frame of {length} bytes is over the {transport.MAX_FRAME_SIZE} byte limit.')
+    return await reader.readexactly(length)
+
+def write_frame(writer, data):
+    '''Queue one length prefixed frame, the asyncio version of helpers.clean_send().'''
+    writer.write(len(data).to_bytes(helpers.LENGTH_BYTES, byteorder='big') + data)
+
+class Player():
+    '''One connected peer and what the server knows about its board.'''
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.address = writer.get_extra_info('peername')
+        self.board = None # Shadow board, filled in from results once we know its size.
+        self.compat = False # Old pickle protocol client.
+        self.heartbeats = False # Negotiated a version that sends and accepts heartbeats.
+        self.heard_heartbeat = False # Silence only counts once it has shown it sends them.
+        self.version = None # Negotiated binary protocol version.
+        self.fleet_board = None # Board with the fleet we accepted from it, None if it sent none.
+
+    async def receive(self, turn_timeout=TURN_TIMEOUT, peer_timeout=PEER_TIMEOUT):
+        '''Read the next frame that isn't a heartbeat.
+        Raise transport.TransportTimeout if the player is silent for peer_timeout
+        seconds after a heartbeat, or takes longer than turn_timeout.
+        '''
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + turn_timeout
+        while True:
+            wait = deadline - loop.time()
+            silence = self.heard_heartbeat and peer_timeout < wait
+            if silence:
+                wait = peer_timeout
+            try:
+                data = await asyncio.wait_for(read_frame(self.reader), wait)
+            except asyncio.TimeoutError:
+                if silence:
+                    raise transport.TransportTimeout(f'nothing from {self.address} for {peer_timeout} seconds')
+                raise transport.TransportTimeout(f'{self.address} took longer than {turn_timeout} seconds')
+            if not protocol.is_heartbeat(data):
+                return data
+            self.heard_heartbeat = True
+
+    async def send(self, data):
+        write_frame(self.writer, data)
+        await self.writer.drain()
+
+    def close(self):
+        self.writer.close()
+
+class Match():
+    '''A single game between two players, with its own boards and turn state.'''
+
+    def __init__(self, match_id, first_player, second_player, record_writer=None):
+        self.match_id = match_id
+        self.record_writer = record_writer # record.RecordWriter, or None to not record.
+        self.recorder = None
+        self.players = [first_player, second_player]
+        self.session = None # Created once we know who goes first.
+        self.shots = 0
+        self.state = HANDSHAKE
+        self.error = ''
+        self.started = time.monotonic()
+
+    async def handshake(self):
+        '''Collect READY from both players and tell them who goes first.
+        Both players must use the same board size and rules, and the standard
+        fleet, old clients only know 10x10 classic games.'''
+        sizes = []
+        rule_sets = []
+        fleet_hashes = []
+        for player in self.players:
+            data = await player.receive()
+            if data == protocol.ALL_PLACED:
+                player.compat = True
+                sizes.append((board.MAX_X, board.MAX_Y))
+                rule_sets.append(protocol.CLASSIC_RULES)
+                fleet_hashes.append(protocol.STANDARD_FLEET_HASH)
+            else:
+                version, width, height, rules, fleet_hash = protocol.expect(data, protocol.READY)
+                player.version = protocol.negotiate(version, PROTOCOL_VERSION)
+                player.heartbeats = protocol.sends_heartbeats(player.version)
+                sizes.append((width, height))
+                rule_sets.append(rules)
+                fleet_hashes.append(fleet_hash)
+        protocol.check_board_size(sizes[1], sizes[0])
+        protocol.check_rules(rule_sets[1], rule_sets[0])
+        width, height = sizes[0]
+        rules = rule_sets[0]
+        try:
+            for player in self.players:
+                # Sparse boards, the server may hold hundreds of them.
+                player.board = board.Board(width, height)
+        except ValueError as error:
+            raise protocol.ProtocolError(str(error))
+        for player, fleet_hash in zip(self.players, fleet_hashes):
+            # We check placements and results against our own boards, so only the standard fleet.
+            protocol.check_fleet(fleet_hash, player.board.fleet)
+        # Old clients always go first, two of them can't share a match.
+        if all(player.compat for player in self.players):
+            raise protocol.ProtocolError('Both players use the old protocol.')
+        if self.players[1].compat:
+            self.players.reverse()
+        self.session = session.GameSession([player.board for player in self.players],
+                                           salvo=rules == protocol.SALVO_RULES)
+        self.session.start(first_player=0)
+        if self.record_writer is not None:
+            # The server only sees results, never ship positions.
+            self.recorder = record.GameRecorder(self.record_writer, self.session, known=(False, False))
+        for index, player in enumerate(self.players):
+            if player.compat:
+                await player.send(protocol.START_GAME)
+            else:
+                await player.send(protocol.encode_start(index == self.session.turn, width, height, rules,
+                                                        PROTOCOL_VERSION))
+        for player in self.players:
+            if not player.compat and protocol.checks_placement(player.version):
+                await self.check_fleet(player, width, height)
+
+    async def check_fleet(self, player, width, height):
+        '''Answer a player's PLACE frames until its whole fleet is legal, then keep it.'''
+        sizes = [ship.size for ship in player.board.fleet]
+        while True:
+            layout = protocol.decode_place(await player.receive(), len(sizes))
+            rejections = placement.check_layout(height, width, sizes, layout)
+            await player.send(protocol.encode_place_result(rejections))
+            if not rejections:
+                player.fleet_board = board.Board(width, height)
+                placement.apply_layout(player.fleet_board, placement.sized_layout(sizes, layout))
+                return
+
+    def check_results(self, defender, coordinates, results):
+        '''Make sure a defender only reports ships it has, and truthfully when we know its fleet.
+        Old clients never send a fleet, their sunk indexes still have to be checked before we apply them.'''
+        fleet = self.session.boards[1 - self.session.turn].fleet
+        for hit, fleet_index in results:
+            if fleet_index is not None and fleet_index >= len(fleet):
+                raise protocol.ProtocolError(f'{defender.address}: Sunk index {fleet_index} is not in the fleet.')
+        if defender.fleet_board is None:
+            return
+        try:
+            session.check_results(defender.fleet_board, coordinates, results)
+        except session.SessionError as error:
+            raise protocol.ProtocolError(f'{defender.address}: {error}')
+
+    async def play_turn(self):
+        '''Relay one attack (or salvo) and its result, mirroring it on the defender's board.'''
+        turn = self.session.turn
+        attacker = self.players[turn]
+        defender = self.players[1 - turn]
+        if self.session.salvo:
+            await self.relay_salvo(attacker, defender)
+        else:
+            coord = protocol.decode_attack(await attacker.receive(), attacker.compat)
+            try:
+                self.session.check_move(turn, coord)
+            except session.SessionError as error:
+                raise protocol.ProtocolError(str(error))
+            await defender.send(protocol.encode_attack(coord, defender.compat))
+            hit, fleet_index = protocol.decode_result(await defender.receive(), defender.compat)
+            self.check_results(defender, [coord], [(hit, fleet_index)])
+            events = self.session.apply_result(coord, hit, fleet_index)
+            await attacker.send(protocol.encode_result(session.events_result(events), attacker.compat))
+            self.shots += 1
+        if self.session.is_over():
+            if not defender.compat:
+                protocol.expect(await defender.receive(), protocol.GAME_OVER)
+            if not attacker.compat:
+                await attacker.send(protocol.encode_game_over(you_won=True))
+            await self.swap_fleets()
+
+    async def relay_salvo(self, attacker, defender):
+        '''Relay a salvo and its results, both players speak the binary protocol.'''
+        salvo = protocol.decode_salvo(await attacker.receive())
+        try:
+            self.session.check_salvo(self.session.turn, salvo)
+        except session.SessionError as error:
+            raise protocol.ProtocolError(str(error))
+        await defender.send(protocol.encode_salvo(salvo))
+        results = protocol.decode_salvo_result(await defender.receive())
+        self.check_results(defender, salvo, results)
+        try:
+            events = self.session.apply_salvo_result(salvo, results)
+        except session.SessionError as error:
+            raise protocol.ProtocolError(f'Bad salvo results: {error}')
+        await attacker.send(protocol.encode_salvo_result(session.events_results(events)))
+        self.shots += len(results)
+
+    async def swap_fleets(self):
+        '''Pass each player's fleet layout to the other once the game is over.
+        Old clients don't send one, their peer gets an empty fleet.'''
+        layouts = []
+        for player in self.players:
+            if player.compat:
+                layouts.append(protocol.encode_fleet([]))
+            else:
+                data = await player.receive()
+                protocol.decode_fleet(data)
+                layouts.append(data)
+        for player, layout in zip(self.players, reversed(layouts)):
+            if not player.compat:
+                await player.send(layout)
+
+    async def send_heartbeats(self):
+        '''Heartbeat every player that speaks them until the match ends.'''
+        heartbeat = protocol.encode_heartbeat()
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            for player in self.players:
+                if player.heartbeats:
+                    write_frame(player.writer, heartbeat)
+
+    async def run(self):
+        heartbeats = None
+        try:
+            await self.handshake()
+            heartbeats = asyncio.create_task(self.send_heartbeats())
+            self.state = PLAYING
+            while not self.session.is_over():
+                await self.play_turn()
+            self.state = FINISHED
+        except (asyncio.IncompleteReadError, ConnectionError, protocol.ProtocolError) as error:
+            self.state = ABORTED
+            self.error = str(error) or type(error).__name__
+        finally:
+            if heartbeats is not None:
+                heartbeats.cancel()
+            if self.recorder is not None:
+                self.recorder.finish()
+            for player in self.players:
+                player.close()
+
+    def status(self):
+        ''':return: A one line summary of this match.'''
+        addresses = ' vs '.join(str(player.address) for player in self.players)
+        line = f'match {self.match_id}: {self.state}, {self.shots} shots, {addresses}'
+        if self.session is not None and self.session.winner is not None:
+            line += f', winner {self.players[self.session.winner].address}'
+        if self.error:
+            line += f', error: {self.error}'
+        return line
+
+class MatchServer():
+    '''Accepts connections, pairs them and runs matches concurrently.'''
+
+    def __init__(self, address=LOCAL_ADDRESS, port=PORT, max_matches=MAX_MATCHES,
+                 max_waiting=MAX_WAITING, status_interval=STATUS_INTERVAL, record_path=None):
+        self.address = address
+        self.port = port
+        self.max_matches = max_matches
+        self.status_interval = status_interval
+        self.lobby = asyncio.Queue(maxsize=max_waiting)
+        self.slots = asyncio.Semaphore(max_matches)
+        self.matches = {}
+        self.match_ids = itertools.count(1)
+        self.finished = 0
+        self.aborted = 0
+        self.refused = 0
+        self.record_path = record_path
+        self.record_writer = None
+
+    async def handle_connection(self, reader, writer):
+        '''Put a new player in the lobby, or refuse them if the lobby is full.'''
+        connection = writer.get_extra_info('socket')
+        if connection is not None:
+            try:
+                transport.enable_keepalive(connection)
+            except OSError:
+                pass
+        try:
+            self.lobby.put_nowait(Player(reader, writer))
+        except asyncio.QueueFull:
+            self.refused += 1
+            writer.close()
+
+    async def pair_players(self):
+        '''Start a match for every two waiting players, while there is a free slot.
+        Once max_matches are running players wait in the lobby (backpressure),
+        and once the lobby is full new connections are refused.
+        '''
+        while True:
+            await self.slots.acquire()
+            first_player = await self.lobby.get()
+            second_player = await self.lobby.get()
+            match = Match(next(self.match_ids), first_player, second_player, self.record_writer)
+            self.matches[match.match_id] = match
+            task = asyncio.create_task(match.run())
+            task.add_done_callback(lambda task, match=match: self.end_match(match))
+
+    def end_match(self, match):
+        self.slots.release()
+        del self.matches[match.match_id]
+        if match.state == FINISHED:
+            self.finished += 1
+        else:
+            self.aborted += 1
+        print(match.status())
+
+    def status(self):
+        ''':return: Lines describing the server and every running match.'''
+        lines = [f'{len(self.matches)}/{self.max_matches} matches running, '
+                 f'{self.lobby.qsize()} waiting, {self.finished} finished, '
+                 f'{self.aborted} aborted, {self.refused} refused']
+        lines.extend(match.status() for match in self.matches.values())
+        return lines
+
+    async def report_status(self):
+        while True:
+            await asyncio.sleep(self.status_interval)
+            print('\n'.join(self.status()))
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle_connection, self.address, self.port)
+        print(f'Hosting matches on port {self.port}...')
+        if self.record_path:
+            self.record_writer = record.RecordWriter(self.record_path)
+        try:
+            async with server:
+                await asyncio.gather(server.serve_forever(), self.pair_players(), self.report_status())
+        finally:
+            if self.record_writer is not None:
+                self.record_writer.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Host many battleship matches at once.')
+    parser.add_argument('--address', default=LOCAL_ADDRESS)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--max-matches', type=int, default=MAX_MATCHES)
+    parser.add_argument('--max-waiting', type=int, default=MAX_WAITING)
+    parser.add_argument('--status-interval', type=float, default=STATUS_INTERVAL)
+    parser.add_argument('--record', help='append every match to this game record file')
+    args = parser.parse_args()
+    match_server = MatchServer(args.address, args.port, args.max_matches,
+                               args.max_waiting, args.status_interval, args.record)
+    try:
+        asyncio.run(match_server.serve())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+'''Headless game engine.
+
+GameSession holds both boards and whose turn it is, takes moves and
+returns events. It does no input, output or networking, so the terminal
+game, bots, simulators and servers all play by the same rules.
+
+Player 0 and player 1 index into boards. When we can't see a board (the
+enemy board in a networked game), use apply_result() with the result our
+peer sent instead of attack().
+
+Under salvo rules a player fires one shot per ship they still have
+afloat every turn, with attack_salvo() or apply_salvo_result(). The turn
+only passes once the whole salvo is resolved.
+'''
+
+import collections
+
+# ===== Constants =====
+# Session states.
+PLACING, READY, PLAYING, OVER = 'placing', 'ready', 'playing', 'over'
+
+# Event kinds.
+HIT, MISS, SUNK, WIN = 'hit', 'miss', 'sunk', 'win'
+
+# player: who the event is about (the attacker for hit/miss/sunk, the winner for win).
+# fleet_index: index of the sunk ship, otherwise None.
+Event = collections.namedtuple('Event', ['kind', 'player', 'coordinate', 'fleet_index'])
+
+def events_result(events):
+    '''Convert events back to the Board.attack() style result.
+    :return: False for a miss, True for a hit, (True, fleet index) for a sink.
+    '''
+    result = False
+    for event in events:
+        if event.kind == HIT:
+            result = True
+        elif event.kind == SUNK:
+            result = (True, event.fleet_index)
+    return result
+
+def events_results(events):
+    '''Split the events of a salvo back into Board.attack_salvo() style results.
+    :return: list of results, one per shot.
+    '''
+    results = []
+    for event in events:
+        if event.kind == HIT:
+            results.append(True)
+        elif event.kind == MISS:
+            results.append(False)
+        elif event.kind == SUNK:
+            results[-1] = (True, event.fleet_index)
+    return results
+
+def check_results(fleet_board, coordinates, results):
+    '''Resolve shots on a board whose fleet we trust (an accepted PLACE), and
+    make sure the results our peer reported for them match.
+    :param results: list of (hit, sunk fleet index or None), one per shot fired.
+    Raise SessionError if they don't.
+    '''
+    expected = [(bool(result), result[1] if type(result) == tuple else None)
+                for result in fleet_board.attack_salvo(coordinates)]
+    if expected != [(bool(hit), fleet_index) for hit, fleet_index in results]:
+        raise SessionError('Reported results do not match the placed fleet.')
+
+class SessionError(Exception):
+    '''Raised when a move breaks the rules or comes at the wrong time.'''
+
+
+class GameSession():
+    '''State machine for one game between two boards.'''
+
+    def __init__(self, boards, first_player=0, salvo=False):
+        '''Set up the session.
+        :param boards: list of two Board objects, one per player.
+        :param first_player: index of the player that attacks first.
+        :param salvo: play salvo rules, several shots per turn.
+        '''
+        self.boards = boards
+        self.salvo = salvo
+        self.first_player = first_player
+        self.turn = first_player
+        self.state = PLACING
+        self.ready_flags = [False, False]
+        self.winner = None
+        self.shots = [0, 0]
+        self.listeners = [] # Callables taking (session, events), called after every move.
+
+    # ===== Setup =====
+    def ready(self, player):
+        '''Mark player as done placing ships.
+        :return: True once both players are ready.
+        '''
+        if self.state != PLACING:
+            raise SessionError('Ships are already locked in.')
+        self.ready_flags[player] = True
+        if all(self.ready_flags):
+            self.state = READY
+        return self.state == READY
+
+    def start(self, first_player=None):
+        '''Start the game. Optionally override who goes first.'''
+        if self.state not in (PLACING, READY):
+            raise SessionError('Game already started.')
+        if first_player is not None:
+            self.first_player = self.turn = first_player
+        self.state = PLAYING
+
+    # ===== Turns =====
+    def check_move(self, player, coordinate):
+        '''Make sure player can attack coordinate right now.'''
+        if self.state != PLAYING:
+            raise SessionError('Game is not in progress.')
+        if player != self.turn:
+            raise SessionError('Not your turn.')
+        if not self.boards[1 - player].in_bounds(coordinate):
+            raise SessionError('Coordinate is off the board.')
+        if self.boards[1 - player].is_attacked(coordinate):
+            raise SessionError('Coordinate already attacked.')
+
+    def shots_allowed(self, player=None):
+        ''':return: How many shots player fires this turn, one unless we play salvo rules.'''
+        if player is None:
+            player = self.turn
+        if not self.salvo:
+            return 1
+        # Never more shots than cells left to shoot at.
+        return max(1, min(self.boards[player].ships_afloat, self.boards[1 - player].untried_cells()))
+
+    def check_salvo(self, player, coordinates):
+        '''Make sure player can fire this salvo right now.'''
+        if not self.salvo:
+            raise SessionError('Not playing salvo rules.')
+        if len(coordinates) != self.shots_allowed(player):
+            raise SessionError(f'Salvo must be {self.shots_allowed(player)} shots, got {len(coordinates)}.')
+        if len({(coordinate[0], coordinate[1]) for coordinate in coordinates}) != len(coordinates):
+            raise SessionError('Salvo fires at the same coordinate twice.')
+        for coordinate in coordinates:
+            self.check_move(player, coordinate)
+
+    def attack(self, coordinate, player=None):
+        '''Resolve an attack from player against the other player's board.
+        :param coordinate: y,x coordinate pair.
+        :param player: attacking player, defaults to whoever's turn it is.
+        :return: List of events.
+        '''
+        if player is None:
+            player = self.turn
+        self.check_move(player, coordinate)
+        result = self.boards[1 - player].attack(coordinate)
+        return self.finish_move(player, coordinate, result)
+
+    def apply_result(self, coordinate, hit, fleet_index=None, player=None):
+        '''Record the result of an attack resolved somewhere else (by our peer).
+        :param coordinate: y,x coordinate pair.
+        :param hit: True if it hit.
+        :param fleet_index: index of the ship it sank, if any.
+        :return: List of events.
+        '''
+        if player is None:
+            player = self.turn
+        self.check_move(player, coordinate)
+        result = self.record_result(player, coordinate, hit, fleet_index)
+        return self.finish_move(player, coordinate, result)
+
+    def attack_salvo(self, coordinates, player=None):
+        '''Resolve a whole salvo from player against the other player's board.
+        :param coordinates: list of y,x coordinate pairs, shots_allowed() of them.
+        :return: List of events for every shot fired.
+        '''
+        if player is None:
+            player = self.turn
+        self.check_salvo(player, coordinates)
+        results = self.boards[1 - player].attack_salvo(coordinates)
+        events = []
+        for coordinate, result in zip(coordinates, results):
+            events += self.finish_move(player, coordinate, result, pass_turn=False)
+        self.end_turn(player)
+        return events
+
+    def apply_salvo_result(self, coordinates, results, player=None):
+        '''Record the results of a salvo resolved by our peer.
+        :param coordinates: the salvo we fired.
+        :param results: list of (hit, sunk fleet index or None), one per shot fired.
+        :return: List of events.
+        '''
+        if player is None:
+            player = self.turn
+        self.check_salvo(player, coordinates)
+        if len(results) > len(coordinates):
+            raise SessionError('More results than shots.')
+        events = []
+        for coordinate, (hit, fleet_index) in zip(coordinates, results):
+            if self.state == OVER:
+                raise SessionError('Results for shots after the game was won.')
+            result = self.record_result(player, coordinate, hit, fleet_index)
+            events += self.finish_move(player, coordinate, result, pass_turn=False)
+        if len(results) < len(coordinates) and self.state != OVER:
+            raise SessionError('Missing results for part of the salvo.')
+        self.end_turn(player)
+        return events
+
+    def record_result(self, player, coordinate, hit, fleet_index):
+        '''Mark a result our peer reported on the enemy board.
+        :return: The Board.attack() style result.
+        '''
+        enemy_board = self.boards[1 - player]
+        if hit:
+            enemy_board.record_hit(coordinate)
+            if fleet_index is not None:
+                enemy_board.mark_sunk(fleet_index)
+                return (True, fleet_index)
+            return True
+        enemy_board.record_miss(coordinate)
+        return False
+
+    def end_turn(self, player):
+        '''Pass the turn on, unless the game is over.'''
+        if self.state != OVER:
+            self.turn = 1 - player
+
+    def finish_move(self, player, coordinate, result, pass_turn=True):
+        '''Turn a Board.attack() style result into events and pass the turn.
+        :param pass_turn: False while a salvo still has shots to resolve.
+        '''
+        self.shots[player] += 1
+        events = []
+        if not result:
+            events.append(Event(MISS, player, coordinate, None))
+        else:
+            events.append(Event(HIT, player, coordinate, None))
+            if type(result) == tuple:
+                events.append(Event(SUNK, player, coordinate, result[1]))
+        if self.boards[1 - player].all_sunk():
+            self.state = OVER
+            self.winner = player
+            events.append(Event(WIN, player, coordinate, None))
+        elif pass_turn:
+            self.turn = 1 - player
+        for listener in self.listeners:
+            listener(self, events)
+        return events
+
+    def is_over(self):
+        return self.state == OVER
@@ -35,21 +35,60 @@ def get_coord_maths(direction):
 
     return y_math, x_math
 
+def get_direction(ship):
+    ''':return: The direction a placed ship points in, DOWN for one cell ships. None if unplaced.'''
+    if not ship.coords:
+        return None
+    if len(ship.coords) == 1:
+        return DOWN
+    (y, x), (next_y, next_x) = ship.coords[0], ship.coords[1]
+    if next_y > y:
+        return DOWN
+    if next_y < y:
+        return UP
+    if next_x < x:
+        return LEFT
+    return RIGHT
+
 class Ship:
     '''Variables and functions associated with battleship Ship objects.'''
-    def __init__(self, size, symbol):
+    # Positions are a tuple of (y, x) tuples, damage is a bitmask with one bit per segment.
+    __slots__ = ('size', 'symbol', 'label', 'name', 'is_sunk', 'coords', 'damage', 'remaining')
+
+    def __init__(self, size, symbol, name=None):
         '''Create our ship object.
         :param size: Integer indicating how long a ship is.
         :param symbol: A single character to represent the ship.
+        :param name: Name shown in the status panels, defaults to the symbol.
         '''
         self.size = size
         self.symbol = symbol
+        self.label = symbol # Symbol turns into '*' when we sink, label keeps the original.
+        self.name = name or symbol
 
         self.is_sunk = False
-        self.position_list = [] # List of lists of y_coord, x_coord, damaged_flag.
+        self.coords = () # Tuple of (y_coord, x_coord) tuples, empty until placed.
+        self.damage = UNDAMAGED # Bit n set means segment n is damaged.
+        self.remaining = size # Segments left to hit before we sink.
+
+    @property
+    def position_list(self):
+        ''':return: List of lists of y_coord, x_coord, damaged_flag.'''
+        return [[pos[Y_INDEX], pos[X_INDEX], (self.damage >> segment) & DAMAGED]
+                for segment, pos in enumerate(self.coords)]
+
+    @position_list.setter
+    def position_list(self, position_list):
+        '''Replace our positions, position_list = [] removes the ship from the board.'''
+        self.coords = tuple((pos[Y_INDEX], pos[X_INDEX]) for pos in position_list)
+        self.damage = UNDAMAGED
+        for segment, pos in enumerate(position_list):
+            if len(pos) > DAMAGE_INDEX and pos[DAMAGE_INDEX] == DAMAGED:
+                self.damage |= 1 << segment
+        self.remaining = self.size - bin(self.damage).count('1')
 
     def set_positions(self, coordinate, direction):
-        '''Fill position_list with initial coordinate and
+        '''Fill our positions with initial coordinate and
             subsequent coordinates in direction until size.
         :param coordinate: List with initial y,x
             coordinate, other coordinates will be calculated
@@ -60,58 +99,102 @@ class Ship:
         # Prepare coordinate math functions based on direction.
         y_math, x_math = get_coord_maths(direction)
 
-        # Set the initial position [y_coord, x_coord, damaged_flag]
-        self.position_list =[[coordinate[Y_INDEX], coordinate[X_INDEX], UNDAMAGED]]
-        previous_pos = coordinate
-
-        # Iterate through positions, adding to the list.
+        # Set the initial position, then iterate through the rest.
+        y_coord, x_coord = coordinate[Y_INDEX], coordinate[X_INDEX]
+        coords = [(y_coord, x_coord)]
         # We already loaded one so start at 1 instead of 0.
         for pos in range(1, self.size):
-            y_coord = y_math(previous_pos[Y_INDEX])
-            x_coord = x_math(previous_pos[X_INDEX])
-            self.position_list.append([y_coord, x_coord, UNDAMAGED])
-            previous_pos = (y_coord, x_coord)
+            y_coord = y_math(y_coord)
+            x_coord = x_math(x_coord)
+            coords.append((y_coord, x_coord))
+        self.coords = tuple(coords)
+        self.damage = UNDAMAGED
+        self.remaining = self.size
 
     def get_positions(self):
         ''':return: List of coordinate lists.'''
-        return [[pos[Y_INDEX],pos[X_INDEX]] for pos in self.position_list]
+        return [[pos[Y_INDEX], pos[X_INDEX]] for pos in self.coords]
 
     def get_damage(self):
-        ''':return: List of damage values. Helper for damage_ship().'''
-        return [pos[DAMAGE_INDEX] for pos in self.position_list]
+        ''':return: List of damage values.'''
+        return [(self.damage >> segment) & DAMAGED for segment in range(len(self.coords))]
+
+    def segment_of(self, coordinate):
+        ''':return: Index of coordinate within the ship, or None if it isn't ours.'''
+        position = (coordinate[Y_INDEX], coordinate[X_INDEX])
+        for segment, pos in enumerate(self.coords):
+            if pos == position:
+                return segment
+        return None
+
+    def damage_segment(self, segment):
+        '''Damage one segment, sinking the ship once every segment is damaged.
+        Board uses this directly once it knows which segment was hit.
+        :return: True if the segment wasn't already damaged.
+        '''
+        bit = 1 << segment
+        if self.damage & bit:
+            return False
+        self.damage |= bit
+        self.remaining -= 1
+        # Check if we were sunk.
+        if self.remaining == 0:
+            self.is_sunk = True
+            self.symbol = '*'
+        return True
 
     def damage_ship(self, coordinate):
-        '''Check if coordinate matches one in position_list,
-            set damage_flag if so. If all damage_flags are set
+        '''Check if coordinate matches one of our positions,
+            damage that segment if so. If all segments are damaged
             then set is_sunk to True.
         :param coordinate: List of y_coord, x_coord.
         :return: False if coordinate not in ship, otherwise True.
         '''
-        positions = self.get_positions()
+        segment = self.segment_of(coordinate)
         # No damage, most common case.
-        if coordinate not in positions:
+        if segment is None:
             return False
-        # Otherwise, damage the ship (update position_list's damage_index).
-        pos_index = positions.index(coordinate)
-        self.position_list[pos_index][DAMAGE_INDEX] = DAMAGED
-        # Check if we were sunk.
-        if UNDAMAGED not in self.get_damage():
-            self.is_sunk = True
-            self.symbol = '*'
+        self.damage_segment(segment)
         return True
 
 class Destroyer(Ship):
+    __slots__ = ()
     def __init__(self):
-        Ship.__init__(self, 2, 'D')
+        Ship.__init__(self, 2, 'D', 'Destroyer')
 class Submarine(Ship):
+    __slots__ = ()
     def __init__(self):
-        Ship.__init__(self, 3, 'S')
+        Ship.__init__(self, 3, 'S', 'Submarine')
 class Cruiser(Ship):
+    __slots__ = ()
     def __init__(self):
-        Ship.__init__(self, 3, 'C')
+        Ship.__init__(self, 3, 'C', 'Cruiser')
 class BattleShip(Ship):
+    __slots__ = ()
     def __init__(self):
-        Ship.__init__(self, 4, 'B')
+        Ship.__init__(self, 4, 'B', 'Battleship')
 class AircraftCarrier(Ship):
+    __slots__ = ()
     def __init__(self):
-        Ship.__init__(self, 5, 'A')
+        Ship.__init__(self, 5, 'A', 'Aircraft Carrier')
+
+# The classic five ship fleet, in fleet index order.
+STANDARD_FLEET = [Destroyer, Submarine, Cruiser, BattleShip, AircraftCarrier]
+SHIP_CLASSES = {ship_class().symbol.lower(): ship_class for ship_class in STANDARD_FLEET}
+
+def build_fleet(composition=None):
+    '''Create a fleet.
+    :param composition: None for the standard fleet, otherwise a list of
+        ship symbols ('d', 's', 'c', 'b', 'a') and/or integer sizes.
+        For example ['a', 'b', 'b', 2, 2] or [5] * 40.
+    :return: List of new Ship objects.
+    '''
+    if composition is None:
+        return [ship_class() for ship_class in STANDARD_FLEET]
+    fleet = []
+    for entry in composition:
+        if type(entry) == int:
+            fleet.append(Ship(entry, str(entry % 10), f'{entry} cell ship'))
+        else:
+            fleet.append(SHIP_CLASSES[entry.lower()]())
+    return fleet
@@ -0,0 +1,284 @@
+'''Monte Carlo game simulator.
+
+Plays N games between two strategies using the real board.Board and
+ships.Ship rules, spread over a process pool. Each batch of games gets
+its own seeded random.Random, so a run is reproducible no matter how
+many workers there are. Results are merged into running totals as
+batches finish instead of keeping every game in memory.
+
+A player is a placement strategy and a targeting strategy, written as
+"placement:targeting", for example "random:density".
+
+To run:
+    python3 simulate.py -n 100000 --a random:density --b random:hunt
+'''
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import random
+import time
+import ai
+import board
+import placement
+import session
+
+# ===== Constants =====
+BATCH_SIZE = 200
+REPORT_INTERVAL = 2 # Seconds between progress lines.
+
+# ===== Strategies =====
+def random_placement(my_board, rng):
+    '''Place every ship at a random legal spot.'''
+    placement.random_fleet(my_board, rng)
+
+class RandomTargeting():
+    '''Shoot untried cells in a random order.'''
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.cells = None
+
+    def load_cells(self, enemy_board):
+        height, width = ai.board_size(enemy_board)
+        self.cells = [board.bit_cell(cell, width) for cell in range(height * width)]
+        self.rng.shuffle(self.cells)
+
+    def choose_attack(self, enemy_board):
+        if self.cells is None:
+            self.load_cells(enemy_board)
+        while True:
+            coordinate = self.cells.pop()
+            if not enemy_board.is_attacked(coordinate):
+                return coordinate
+
+class HuntTargeting(RandomTargeting):
+    '''Shoot randomly on a checkerboard until we hit, then try the neighbours.'''
+
+    def __init__(self, rng):
+        RandomTargeting.__init__(self, rng)
+        self.targets = []
+        self.hits_seen = 0
+
+    def choose_attack(self, enemy_board):
+        height, width = ai.board_size(enemy_board)
+        hits = enemy_board.get_attacks()
+        # Queue up the neighbours of any new hits.
+        for y, x in hits[self.hits_seen:]:
+            for neighbour in ([y - 1, x], [y + 1, x], [y, x - 1], [y, x + 1]):
+                if (board.MIN_Y <= neighbour[0] <= height
+                        and board.MIN_X <= neighbour[1] <= width):
+                    self.targets.append(neighbour)
+        self.hits_seen = len(hits)
+        while self.targets:
+            coordinate = self.targets.pop()
+            if not enemy_board.is_attacked(coordinate):
+                return coordinate
+        if self.cells is None:
+            # Even cells get popped first, every ship is at least 2 long.
+            self.load_cells(enemy_board)
+            self.cells.sort(key=lambda cell: (cell[0] + cell[1]) % 2 == 0)
+        return RandomTargeting.choose_attack(self, enemy_board)
+
+PLACEMENTS = {
+    'random': random_placement,
+}
+TARGETING = {
+    'random': RandomTargeting,
+    'hunt': HuntTargeting,
+    'density': ai.AIPlayer,
+    'exact': ai.PosteriorPlayer,
+}
+
+def register_placement(name, strategy):
+    ''':param strategy: function taking (board, rng) that places the board's fleet.'''
+    PLACEMENTS[name] = strategy
+
+def register_targeting(name, factory):
+    ''':param factory: callable taking rng, returning an object with choose_attack(enemy_board).'''
+    TARGETING[name] = factory
+
+def parse_player(spec):
+    ''':return: (placement, targeting) names from a "placement:targeting" string.'''
+    placement, _, targeting = spec.partition(':')
+    if not targeting:
+        placement, targeting = 'random', placement
+    if placement not in PLACEMENTS or targeting not in TARGETING:
+        raise ValueError(f'Unknown player "{spec}". Placements: {sorted(PLACEMENTS)}, '
+                         f'targeting: {sorted(TARGETING)}')
+    return placement, targeting
+
+# ===== Games =====
+def play_game(players, rng, first_player=0):
+    '''Play one game.
+    :param players: two (placement, targeting) name pairs.
+    :param rng: random.Random used for both players.
+    :param first_player: index of the player that attacks first.
+    :return: tuple of (winner index, shots the winner took).
+    '''
+    boards = [board.BitBoard(), board.BitBoard()]
+    shooters = []
+    for player, my_board in zip(players, boards):
+        placement, targeting = player
+        PLACEMENTS[placement](my_board, rng)
+        shooters.append(TARGETING[targeting](rng))
+    game = session.GameSession(boards, first_player)
+    game.start()
+    while not game.is_over():
+        # Targeting only looks at hits, misses and sunk flags of the enemy board.
+        game.attack(shooters[game.turn].choose_attack(boards[1 - game.turn]))
+    return game.winner, game.shots[game.winner]
+
+class Stats():
+    '''Running totals for a set of games, small enough to send between processes.'''
+
+    def __init__(self):
+        self.games = 0
+        self.wins = [0, 0]
+        self.first_mover_wins = 0
+        self.shots = collections.Counter() # Shots to win -> number of games.
+
+    def add_game(self, winner, shots, first_player):
+        self.games += 1
+        self.wins[winner] += 1
+        if winner == first_player:
+            self.first_mover_wins += 1
+        self.shots[shots] += 1
+
+    def merge(self, other):
+        self.games += other.games
+        self.wins[0] += other.wins[0]
+        self.wins[1] += other.wins[1]
+        self.first_mover_wins += other.first_mover_wins
+        self.shots.update(other.shots)
+
+    def state(self):
+        ''':return: Everything needed to rebuild these totals with stats_from_state(), as JSON-able data.'''
+        return {'games': self.games, 'wins': self.wins, 'first_mover_wins': self.first_mover_wins,
+                'shots': {str(shots): count for shots, count in self.shots.items()}}
+
+    def percentile(self, fraction):
+        ''':return: Shots to win at the given fraction (0 to 1) of games.'''
+        target = fraction * self.games
+        seen = 0
+        for shots in sorted(self.shots):
+            seen += self.shots[shots]
+            if seen >= target:
+                return shots
+        return 0
+
+    def to_dict(self, elapsed=None):
+        result = {
+            'games': self.games,
+            'wins': self.wins,
+            'first_mover_win_rate': self.first_mover_wins / self.games if self.games else 0,
+            'mean_shots_to_win': (sum(shots * count for shots, count in self.shots.items()) / self.games
+                                  if self.games else 0),
+            'shots_to_win_p50': self.percentile(0.5),
+            'shots_to_win_p90': self.percentile(0.9),
+            'shots_to_win': {str(shots): count for shots, count in sorted(self.shots.items())},
+        }
+        if elapsed:
+            result['elapsed'] = elapsed
+            result['games_per_second'] = self.games / elapsed
+        return result
+
+    def summary(self, elapsed):
+        data = self.to_dict(elapsed)
+        return (f"{self.games} games, {data.get('games_per_second', 0):.0f}/s, "
+                f"wins {self.wins[0]}-{self.wins[1]}, "
+                f"first mover {data['first_mover_win_rate']:.1%}, "
+                f"shots to win mean {data['mean_shots_to_win']:.1f} "
+                f"p50 {data['shots_to_win_p50']} p90 {data['shots_to_win_p90']}")
+
+def stats_from_state(state):
+    ''':return: Stats rebuilt from Stats.state().'''
+    stats = Stats()
+    stats.games = state['games']
+    stats.wins = list(state['wins'])
+    stats.first_mover_wins = state['first_mover_wins']
+    stats.shots = collections.Counter({int(shots): count for shots, count in state['shots'].items()})
+    return stats
+
+def batch_rng(seed, batch_index):
+    '''Each batch gets its own generator so results don't depend on scheduling.'''
+    return random.Random(f'{seed}:{batch_index}')
+
+def run_batch(players, seed, batch_index, first_game, count):
+    '''Play count games, alternating who goes first. Runs in a worker process.'''
+    rng = batch_rng(seed, batch_index)
+    stats = Stats()
+    for game_number in range(first_game, first_game + count):
+        first_player = game_number % 2
+        winner, shots = play_game(players, rng, first_player)
+        stats.add_game(winner, shots, first_player)
+    return stats
+
+def simulate(n_games, player_a, player_b, workers=None, seed=0, batch_size=BATCH_SIZE, progress=None):
+    '''Play n_games between two players over a process pool.
+    :param player_a: "placement:targeting" spec of player 0.
+    :param player_b: "placement:targeting" spec of player 1.
+    :param workers: process count, defaults to the CPU count. 0 runs in this process.
+    :param progress: optional callable(stats, elapsed) called as batches finish.
+    :return: tuple of (Stats, elapsed seconds).
+    '''
+    players = (parse_player(player_a), parse_player(player_b))
+    batches = [(players, seed, index, start, min(batch_size, n_games - start))
+               for index, start in enumerate(range(0, n_games, batch_size))]
+    totals = Stats()
+    started = time.perf_counter()
+    if workers == 0:
+        for batch in batches:
+            totals.merge(run_batch(*batch))
+            if progress:
+                progress(totals, time.perf_counter() - started)
+        return totals, time.perf_counter() - started
+
+    workers = workers or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        # Keep a few batches in flight per worker instead of queueing them all.
+        pending = set()
+        batch_iter = iter(batches)
+        for batch in batch_iter:
+            pending.add(executor.submit(run_batch, *batch))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                totals.merge(future.result())
+                batch = next(batch_iter, None)
+                if batch is not None:
+                    pending.add(executor.submit(run_batch, *batch))
+            if progress:
+                progress(totals, time.perf_counter() - started)
+    return totals, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate battleship games between strategies.')
+    parser.add_argument('-n', '--games', type=int, default=10000)
+    parser.add_argument('--a', default='random:density', help='player 0, "placement:targeting"')
+    parser.add_argument('--b', default='random:hunt', help='player 1, "placement:targeting"')
+    parser.add_argument('--workers', type=int, default=None, help='default: CPU count, 0: no pool')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--json', help='write the final results to this file')
+    args = parser.parse_args()
+
+    last_report = [0]
+    def progress(stats, elapsed):
+        if elapsed - last_report[0] >= REPORT_INTERVAL:
+            last_report[0] = elapsed
+            print(stats.summary(elapsed), flush=True)
+
+    stats, elapsed = simulate(args.games, args.a, args.b, args.workers, args.seed,
+                              args.batch_size, progress)
+    print(stats.summary(elapsed))
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(dict(stats.to_dict(elapsed), a=args.a, b=args.b, seed=args.seed), output, indent=2)
+
+if __name__ == '__main__':
+    main()
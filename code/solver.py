@@ -0,0 +1,287 @@
+'''Exact posterior shot probabilities.
+
+Counts every arrangement of the enemy fleet that fits what we know (the
+hit_list, the miss_list and which ships are sunk) and, for every cell,
+how many of those arrangements put a ship there. Nothing is sampled, so
+count / total is the exact chance a shot at that cell hits.
+
+Arrangements are counted by placing ships one at a time with pruning:
+sunk ships first (they can only sit on hits), then a ship over the
+lowest hit nothing explains yet, then the largest ship left. The free
+cells are split into connected regions as ships go down, each region is
+solved on its own and the results multiplied.
+
+Partial counts are memoized in a bounded LRU cache keyed on (ships left,
+free cells, unexplained hits among them). Nothing else goes into a count,
+so entries stay valid for the whole game: keep one solver per game and a
+new shot only re-solves the regions it touched.
+
+A wide open board has billions of arrangements (about 3e10 on an empty
+10x10), too many for any per-move budget. Each solve() may try
+STEP_BUDGET placements and returns None once they run out, callers fall
+back to ai.density_map(). A quick upper bound (every ship's placements
+multiplied, overlaps ignored) skips solves that could never finish.
+Regions finished before that stay cached for the next turn.
+'''
+
+import collections
+import board
+import placement
+
+# ===== Constants =====
+CACHE_SIZE = 20000 # Memoized subproblems kept per solver.
+STEP_BUDGET = 1000 # Placements tried per solve() call before giving up.
+MAX_BOUND = 10 ** 8 # Don't even start when the ships could sit more ways than this, ignoring overlaps.
+NO_COVERAGE = {}
+
+class BudgetExceeded(Exception):
+    '''Raised inside a solve once it has used up its step budget.'''
+
+
+class Posterior():
+    '''The result of a solve.'''
+
+    def __init__(self, total, coverage, width):
+        self.total = total # Arrangements consistent with the board.
+        self.coverage = coverage # Cell index -> arrangements with a ship on that cell.
+        self.width = width
+
+    def probability(self, coordinate):
+        ''':return: The chance coordinate holds a ship, 0 if nothing fits.'''
+        if not self.total:
+            return 0
+        return self.coverage.get(cell_index(coordinate, self.width), 0) / self.total
+
+def cell_index(coordinate, width):
+    return (coordinate[0] - board.MIN_Y) * width + (coordinate[1] - board.MIN_X)
+
+class PosteriorSolver():
+    '''Exact cell probabilities for one enemy board, reused turn after turn.'''
+
+    def __init__(self, height=board.MAX_Y, width=board.MAX_X, cache_size=CACHE_SIZE, step_budget=STEP_BUDGET,
+                 max_bound=MAX_BOUND):
+        self.height = height
+        self.width = width
+        self.cells = height * width
+        self.full = (1 << self.cells) - 1
+        self.cache = collections.OrderedDict()
+        self.cache_size = cache_size
+        self.step_budget = step_budget
+        self.max_bound = max_bound
+        self.steps = 0
+        # Cells with a neighbour to the left/right, so shifts don't wrap rows.
+        first_column = placement.column_mask(height, width)
+        self.not_first_column = self.full & ~first_column
+        self.not_last_column = self.full & ~(first_column << (width - 1))
+        self.start_masks = {} # size -> cells a horizontal ship of that size may start on.
+        self.mask_cells = {} # placement mask -> tuple of its cell indexes.
+
+    # ===== Public =====
+    def solve(self, enemy_board):
+        '''Count every arrangement that fits enemy_board.
+        Only hit_list, miss_list and the sunk flags are used, never ship positions.
+        :return: A Posterior, or None if the step budget ran out first.
+        '''
+        hits = 0
+        for coordinate in enemy_board.get_attacks():
+            hits |= 1 << cell_index(coordinate, self.width)
+        misses = 0
+        for coordinate in enemy_board.get_misses():
+            misses |= 1 << cell_index(coordinate, self.width)
+        ships = tuple(sorted(((ship.size, ship.is_sunk) for ship in enemy_board.fleet), reverse=True))
+        free = self.full & ~misses
+        if self.bound(ships, free, hits) > self.max_bound:
+            return None
+        self.steps = 0
+        try:
+            total, coverage = self.count(ships, free, hits)
+        except BudgetExceeded:
+            return None
+        return Posterior(total, coverage, self.width)
+
+    def bound(self, ships, free, hits):
+        '''An upper bound on the arrangements, each ship's placements multiplied.
+        When there are hits one of the ships must cover the lowest, so sum
+        the bound over which ship that is.
+        :return: The bound.
+        '''
+        counts = []
+        covering = []
+        target = hits & -hits
+        for size, is_sunk in ships:
+            options = self.placements(size, hits if is_sunk else free)
+            counts.append(len(options))
+            covering.append(sum(1 for mask in options if mask & target))
+        bound = 1
+        for count in counts:
+            bound *= count
+        if not target or not bound:
+            return bound
+        return sum(bound // count * cover for count, cover in zip(counts, covering))
+
+    # ===== Counting =====
+    def count(self, ships, free, hits):
+        '''Count arrangements of ships within free that cover every cell of hits.
+        :param ships: tuple of (size, sunk) pairs, largest first.
+        :param free: mask of cells ships may use.
+        :param hits: mask of hit cells in free that some ship must cover.
+        :return: tuple of (arrangements, dict of cell index to arrangements covering it).
+        '''
+        if not ships:
+            # Too cheap to be worth a cache slot.
+            return (0, NO_COVERAGE) if hits else (1, NO_COVERAGE)
+        free = self.usable(free, ships[-1][0]) | hits
+        key = (ships, free, hits)
+        result = self.cache.get(key)
+        if result is not None:
+            self.cache.move_to_end(key)
+            return result
+        # One ship can't be split between regions, no need to look for them.
+        regions = self.regions(free) if len(ships) > 1 else [free]
+        if len(regions) > 1:
+            result = self.count_regions(ships, regions, hits)
+        else:
+            result = self.count_branches(ships, free, hits)
+        self.cache[key] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+    def count_branches(self, ships, free, hits):
+        '''count() within one connected region, branching on one ship's placements.'''
+        sunk = [index for index, (size, is_sunk) in enumerate(ships) if is_sunk]
+        if sunk:
+            # A sunk ship sits on hits only, few places to try.
+            branches = [(sunk[0], self.placements(ships[sunk[0]][0], hits), 1)]
+        elif hits:
+            # Whichever ship covers the lowest unexplained hit, each kind once.
+            target = hits & -hits
+            branches = []
+            for index, ship in enumerate(ships):
+                if ship in ships[:index]:
+                    continue
+                options = [mask for mask in self.placements(ship[0], free) if mask & target]
+                branches.append((index, options, ships.count(ship)))
+        else:
+            branches = [(0, self.placements(ships[0][0], free), 1)]
+        total = 0
+        coverage = collections.Counter()
+        for index, options, multiplier in branches:
+            self.spend(len(options))
+            is_sunk = ships[index][1]
+            rest = ships[:index] + ships[index + 1:]
+            for mask in options:
+                # Sunk ships are all hits, afloat ones can't be.
+                if is_sunk != (mask & ~hits == 0):
+                    continue
+                sub_total, sub_coverage = self.count(rest, free & ~mask, hits & ~mask)
+                if not sub_total:
+                    continue
+                weight = sub_total * multiplier
+                total += weight
+                for cell, arrangements in sub_coverage.items():
+                    coverage[cell] += arrangements * multiplier
+                for cell in self.cells_of(mask):
+                    coverage[cell] += weight
+        return total, dict(coverage)
+
+    def count_regions(self, ships, regions, hits):
+        '''count() over several separate regions, every way of sharing the ships out.'''
+        total = 0
+        coverage = collections.Counter()
+        # Only try each ship in the regions it fits in.
+        fits = []
+        for size, is_sunk in ships:
+            fits.append([groups_index for groups_index, region in enumerate(regions)
+                         if self.placements(size, region & hits if is_sunk else region)])
+
+        def assign(index, groups):
+            nonlocal total
+            if index < len(ships):
+                for groups_index in fits[index]:
+                    groups[groups_index].append(ships[index])
+                    assign(index + 1, groups)
+                    groups[groups_index].pop()
+                return
+            self.spend(1)
+            results = []
+            for region, group in zip(regions, groups):
+                region_hits = hits & region
+                if sum(size for size, is_sunk in group) < bin(region_hits).count('1'):
+                    return # Not enough ship to cover the hits here.
+                results.append(self.count(tuple(group), region, region_hits))
+                if not results[-1][0]:
+                    return
+            product = 1
+            for region_total, region_coverage in results:
+                product *= region_total
+            total += product
+            for region_total, region_coverage in results:
+                others = product // region_total
+                for cell, arrangements in region_coverage.items():
+                    coverage[cell] += arrangements * others
+
+        assign(0, [[] for region in regions])
+        return total, dict(coverage)
+
+    def spend(self, steps):
+        self.steps += steps
+        if self.steps > self.step_budget:
+            raise BudgetExceeded()
+
+    # ===== Masks =====
+    def placements(self, size, free):
+        ''':return: list of masks, one per placement of size that fits inside free.'''
+        width = self.width
+        run = (1 << size) - 1
+        options = [run << bit for bit in board.iter_bits(self.starts(size, free, 1) & self.start_mask(size))]
+        if size > 1:
+            column = placement.column_mask(size, width)
+            options.extend(column << bit for bit in board.iter_bits(self.starts(size, free, width)))
+        return options
+
+    def cells_of(self, mask):
+        cells = self.mask_cells.get(mask)
+        if cells is None:
+            cells = self.mask_cells[mask] = tuple(board.iter_bits(mask))
+        return cells
+
+    def starts(self, size, free, step):
+        ''':return: mask of cells where size cells in a row, step bits apart, are all free.'''
+        starts = free
+        for offset in range(1, size):
+            starts &= free >> (offset * step)
+        return starts
+
+    def start_mask(self, size):
+        if size not in self.start_masks:
+            mask = 0
+            for x in range(self.width - size + 1):
+                mask |= placement.column_mask(self.height, self.width) << x
+            self.start_masks[size] = mask
+        return self.start_masks[size]
+
+    def usable(self, free, size):
+        ''':return: The cells of free that some ship of at least size could cover.'''
+        usable = 0
+        for step, starts in ((1, self.starts(size, free, 1) & self.start_mask(size)),
+                             (self.width, self.starts(size, free, self.width))):
+            for offset in range(size):
+                usable |= starts << (offset * step)
+        return usable
+
+    def regions(self, free):
+        ''':return: list of masks, one per 4-connected region of free.'''
+        regions = []
+        width = self.width
+        while free:
+            region = free & -free
+            while True:
+                grown = (region | (region << 1 & self.not_first_column) | (region >> 1 & self.not_last_column)
+                         | region << width | region >> width) & free
+                if grown == region:
+                    break
+                region = grown
+            regions.append(region)
+            free &= ~region
+        return regions
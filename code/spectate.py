@@ -0,0 +1,288 @@
+'''Live spectators for a hosted game.
+
+The host runs a SpectatorHub next to its game. Any number of watchers
+can connect to SPECTATOR_PORT. Each one gets the board size, every shot
+so far and then each shot as it happens, and once the game is over both
+fleet layouts, in the usual length prefixed frames.
+
+The game thread only ever appends frames to per-spectator queues. A
+background thread does the sending on non-blocking sockets, so a slow
+watcher can't hold up the players. A watcher whose queue fills up is
+dropped.
+
+To watch:
+    python3 spectate.py HOST_ADDRESS
+'''
+
+import argparse
+import collections
+import selectors
+import socket
+import sys
+import threading
+import time
+import board
+import helpers
+import placement
+import protocol
+import render
+import session
+
+# ===== Constants =====
+SPECTATOR_PORT = 5599 # battleship.PORT + 1
+MAX_SPECTATORS = 256
+MAX_QUEUED_FRAMES = 256 # Frames a spectator may fall behind before we drop them.
+CLOSE_TIMEOUT = 2 # Seconds we keep sending queued frames after the game ends.
+HOST, PEER = 0, 1 # Player numbers as spectators see them.
+
+def frame(data):
+    ''':return: data with its length prefix, as helpers.clean_send() sends it.'''
+    return len(data).to_bytes(helpers.LENGTH_BYTES, byteorder='big') + data
+
+class Spectator():
+    '''One watcher, their queued frames and whatever is left of the frame being sent.'''
+
+    def __init__(self, connection, address):
+        self.connection = connection
+        self.address = address
+        self.queue = collections.deque()
+        self.pending = None # memoryview of the unsent part of the current frame.
+        self.lagging = False # Fell too far behind, the hub thread drops them.
+
+class SpectatorHub():
+    '''Accepts spectators and broadcasts frames to them from a background thread.'''
+
+    def __init__(self, address, port=SPECTATOR_PORT, max_spectators=MAX_SPECTATORS,
+                 max_queued=MAX_QUEUED_FRAMES):
+        self.max_spectators = max_spectators
+        self.max_queued = max_queued
+        self.listener = socket.create_server((address, port))
+        self.listener.setblocking(False)
+        # The game thread writes a byte here to wake the selector up.
+        self.wake_receiver, self.wake_sender = socket.socketpair()
+        self.wake_receiver.setblocking(False)
+        self.wake_sender.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        self.selector.register(self.wake_receiver, selectors.EVENT_READ)
+        self.spectators = {} # socket -> Spectator
+        self.history = [] # Every frame so far, replayed to late joiners.
+        self.lock = threading.Lock()
+        self.deadline = None # Set by close(), when to give up on unsent frames.
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    # ===== Game thread =====
+    def broadcast(self, data):
+        '''Queue a message for every spectator. Never blocks.'''
+        message = frame(data)
+        with self.lock:
+            self.history.append(message)
+            for spectator in self.spectators.values():
+                if len(spectator.queue) >= self.max_queued:
+                    spectator.lagging = True
+                else:
+                    spectator.queue.append(message)
+        self.wake()
+
+    def on_events(self, game, events):
+        '''session.GameSession listener, broadcasts each shot and the winner.'''
+        coordinate = events[0].coordinate
+        player = events[0].player
+        self.broadcast(protocol.encode_shot(player, coordinate, session.events_result(events)))
+        if game.is_over():
+            self.broadcast(protocol.encode(protocol.GAME_OVER, game.winner))
+
+    def wake(self):
+        try:
+            self.wake_sender.send(b'\0')
+        except BlockingIOError:
+            pass # Already a wake up waiting.
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        '''Finish sending what is queued, for up to timeout seconds, then stop.'''
+        self.deadline = time.monotonic() + timeout
+        self.wake()
+        self.thread.join()
+
+    # ===== Hub thread =====
+    def run(self):
+        try:
+            while not self.finished():
+                # Once closing, poll so the deadline is noticed.
+                for key, events in self.selector.select(None if self.deadline is None else 0.1):
+                    if key.fileobj is self.listener:
+                        self.accept()
+                    elif key.fileobj is self.wake_receiver:
+                        self.drain_wake()
+                    else:
+                        spectator = self.spectators.get(key.fileobj)
+                        if spectator is not None:
+                            self.service(spectator, events)
+                self.update_interest()
+        finally:
+            for spectator in list(self.spectators.values()):
+                self.drop(spectator)
+            self.selector.close()
+            self.listener.close()
+            self.wake_receiver.close()
+            self.wake_sender.close()
+
+    def finished(self):
+        if self.deadline is None:
+            return False
+        with self.lock:
+            idle = all(not spectator.queue and spectator.pending is None
+                       for spectator in self.spectators.values())
+        return idle or time.monotonic() > self.deadline
+
+    def accept(self):
+        try:
+            connection, address = self.listener.accept()
+        except BlockingIOError:
+            return
+        if len(self.spectators) >= self.max_spectators or self.deadline is not None:
+            connection.close()
+            return
+        connection.setblocking(False)
+        spectator = Spectator(connection, address)
+        with self.lock:
+            # Everything so far goes out as one chunk so a late joiner can't overflow their queue.
+            if self.history:
+                spectator.queue.append(b''.join(self.history))
+            self.spectators[connection] = spectator
+        self.selector.register(connection, selectors.EVENT_READ)
+
+    def drain_wake(self):
+        try:
+            while self.wake_receiver.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def service(self, spectator, events):
+        if events & selectors.EVENT_READ:
+            # Spectators never send anything, readable means they left.
+            try:
+                if not spectator.connection.recv(4096):
+                    self.drop(spectator)
+                    return
+            except BlockingIOError:
+                pass
+            except OSError:
+                self.drop(spectator)
+                return
+        if events & selectors.EVENT_WRITE:
+            self.flush(spectator)
+
+    def flush(self, spectator):
+        '''Send as much as the socket takes without blocking.'''
+        while True:
+            if spectator.pending is None:
+                with self.lock:
+                    if not spectator.queue:
+                        return
+                    spectator.pending = memoryview(spectator.queue.popleft())
+            try:
+                sent = spectator.connection.send(spectator.pending)
+            except BlockingIOError:
+                return
+            except OSError:
+                self.drop(spectator)
+                return
+            spectator.pending = spectator.pending[sent:] if sent < len(spectator.pending) else None
+
+    def update_interest(self):
+        '''Watch for writability only while a spectator has something to send.
+        Anyone too far behind is dropped here.'''
+        with self.lock:
+            spectators = list(self.spectators.values())
+        for spectator in spectators:
+            if spectator.lagging:
+                self.dropped += 1
+                self.drop(spectator)
+                continue
+            events = selectors.EVENT_READ
+            if spectator.queue or spectator.pending is not None:
+                events |= selectors.EVENT_WRITE
+            if self.selector.get_key(spectator.connection).events != events:
+                self.selector.modify(spectator.connection, events)
+
+    def drop(self, spectator):
+        with self.lock:
+            self.spectators.pop(spectator.connection, None)
+        try:
+            self.selector.unregister(spectator.connection)
+        except (KeyError, ValueError):
+            pass
+        spectator.connection.close()
+
+# ===== Watching =====
+def check_player(player):
+    if player not in (HOST, PEER):
+        raise protocol.ProtocolError(f'Unknown player {player}.')
+
+def watch(connection):
+    '''Render a hosted game as its frames arrive, until the host hangs up.'''
+    boards = None
+    game = None
+    message = 'Waiting for the game to start...'
+    print(message)
+    while True:
+        data = helpers.clean_receive(connection, 0)
+        try:
+            kind = protocol.kind_of(data)
+            if kind == protocol.WATCH:
+                version, width, height = protocol.expect(data, protocol.WATCH)
+                boards = [board.Board(width, height), board.Board(width, height)]
+                game = session.GameSession(boards)
+                game.start()
+                message = 'Game on. Top: peer board, bottom: host board.'
+            elif kind in (protocol.SHOT, protocol.FLEET) and game is None:
+                raise protocol.ProtocolError(f'Got message kind {kind} before the game started.')
+            elif kind == protocol.SHOT:
+                player, y, x, hit, sunk_index = protocol.expect(data, protocol.SHOT)
+                check_player(player)
+                sunk_index = None if sunk_index == protocol.NO_SUNK else sunk_index
+                if sunk_index is not None and sunk_index >= len(boards[1 - player].fleet):
+                    raise protocol.ProtocolError(f'Sunk index {sunk_index} is not in the fleet.')
+                # Salvo games fire several shots a turn and WATCH doesn't say which rules
+                # are played, follow whoever the host says shot, like record.replay().
+                game.turn = player
+                game.apply_result([y, x], bool(hit), sunk_index, player)
+                who = 'Host' if player == HOST else 'Peer'
+                result = 'sank a ship' if sunk_index is not None else 'hit' if hit else 'missed'
+                message = f'{who} {result} at {helpers.coordinate_label([y, x])}.'
+            elif kind == protocol.GAME_OVER:
+                winner, = protocol.expect(data, protocol.GAME_OVER)
+                message = f"{'Host' if winner == HOST else 'Peer'} won!"
+            elif kind == protocol.FLEET:
+                player, layout = protocol.decode_fleet(data)
+                check_player(player)
+                placement.apply_layout(boards[player], layout)
+        except (protocol.ProtocolError, session.SessionError) as error:
+            print(f'Bad frame from the host, stopped watching: {error}')
+            return
+        if boards is not None:
+            # Ships only show on the lower board, put whoever's fleet we just got there.
+            lower = PEER if kind == protocol.FLEET and player == PEER else HOST
+            helpers.render_map(boards[1 - lower], boards[lower], message, clear=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Watch a hosted battleship game.')
+    parser.add_argument('address')
+    parser.add_argument('--port', type=int, default=SPECTATOR_PORT)
+    args = parser.parse_args()
+    render.enable_ansi()
+    try:
+        connection = socket.create_connection((args.address, args.port))
+    except OSError as error:
+        print(f'Could not connect: {error}')
+        sys.exit(1)
+    watch(connection)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+'''Round-robin tournaments between strategies.
+
+Every pair of players meets for K games, split into chunks that worker
+processes pull from a shared queue as they go idle, so quick pairings
+never leave a worker waiting on a slow one. First mover alternates
+every game, like host and client do in battleship.py. Standings are
+checkpointed to a JSON file as chunks finish, and rerunning with the
+same file resumes where it stopped.
+
+Players are simulate.py "placement:targeting" specs. Plugins are
+modules that call simulate.register_placement() or
+simulate.register_targeting() when imported.
+
+To run:
+    python3 tournament.py random:random random:hunt random:density -k 2000
+    python3 tournament.py --plugin my_bots random:density random:sneaky -k 500 --checkpoint cup.json
+'''
+
+import argparse
+import concurrent.futures
+import importlib
+import itertools
+import json
+import math
+import os
+import time
+import simulate
+
+# ===== Constants =====
+GAMES_PER_PAIRING = 1000
+CHUNK_SIZE = 100 # Games per unit of work.
+CHECKPOINT_INTERVAL = 5 # Seconds between checkpoint writes.
+Z_95 = 1.96 # Normal quantile for 95% confidence intervals.
+ELO_BASE = 1500
+ELO_SCALE = 400 / math.log(10) # Natural log-odds to Elo points.
+ELO_ITERATIONS = 200
+
+class CheckpointError(Exception):
+    '''Raised when a checkpoint belongs to a different tournament or can't be read.'''
+
+
+def load_plugins(names):
+    '''Import each plugin module so it can register its strategies.'''
+    for name in names:
+        importlib.import_module(name)
+
+def schedule(players, games, chunk_size=CHUNK_SIZE):
+    ''':return: list of (pairing key, player a, player b, chunk index, first game, count).'''
+    chunks = []
+    for player_a, player_b in itertools.combinations(players, 2):
+        key = f'{player_a} vs {player_b}'
+        for index, start in enumerate(range(0, games, chunk_size)):
+            chunks.append((key, player_a, player_b, index, start, min(chunk_size, games - start)))
+    return chunks
+
+def run_chunk(plugins, seed, key, player_a, player_b, chunk_index, first_game, count):
+    '''Play one chunk of a pairing. Runs in a worker process.'''
+    # Workers that weren't forked from us need the plugins too.
+    load_plugins(plugins)
+    players = (simulate.parse_player(player_a), simulate.parse_player(player_b))
+    # Seeded per pairing and chunk, results don't depend on which worker ran it.
+    return simulate.run_batch(players, f'{seed}:{key}', chunk_index, first_game, count)
+
+class Tournament():
+    '''Standings for every pairing and the chunks already played.'''
+
+    def __init__(self, players, games=GAMES_PER_PAIRING, seed=0, chunk_size=CHUNK_SIZE, plugins=()):
+        self.players = list(players)
+        self.plugins = list(plugins)
+        self.games = games
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.pairings = {} # pairing key -> simulate.Stats, wins[0] belong to player a.
+        self.done = set() # (pairing key, chunk index)
+
+    def config(self):
+        return {'players': self.players, 'games': self.games, 'seed': self.seed, 'chunk_size': self.chunk_size}
+
+    def add_chunk(self, key, chunk_index, stats):
+        self.pairings.setdefault(key, simulate.Stats()).merge(stats)
+        self.done.add((key, chunk_index))
+
+    def pending(self):
+        return [chunk for chunk in schedule(self.players, self.games, self.chunk_size)
+                if (chunk[0], chunk[3]) not in self.done]
+
+    # ===== Checkpoints =====
+    def save(self, path):
+        '''Write the standings so far, replacing the old file only once the new one is complete.'''
+        data = {
+            'config': self.config(),
+            'done': sorted([key, index] for key, index in self.done),
+            'pairings': {key: stats.state() for key, stats in self.pairings.items()},
+        }
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as output:
+            json.dump(data, output)
+        os.replace(temporary, path)
+
+    def load(self, path):
+        '''Pick up a checkpoint written by save(), if there is one.'''
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path) as checkpoint:
+                data = json.load(checkpoint)
+            config = data['config']
+        except (ValueError, KeyError, TypeError) as error:
+            raise CheckpointError(f'{path} is not a tournament checkpoint: {error}')
+        if config != self.config():
+            raise CheckpointError(f'{path} is from a different tournament: {data["config"]}')
+        self.done = {(key, index) for key, index in data['done']}
+        self.pairings = {key: simulate.stats_from_state(state) for key, state in data['pairings'].items()}
+
+    # ===== Results =====
+    def records(self):
+        ''':return: dict of player -> [wins, games].'''
+        records = {player: [0, 0] for player in self.players}
+        for (player_a, player_b) in itertools.combinations(self.players, 2):
+            stats = self.pairings.get(f'{player_a} vs {player_b}')
+            if stats is None:
+                continue
+            records[player_a][0] += stats.wins[0]
+            records[player_b][0] += stats.wins[1]
+            records[player_a][1] += stats.games
+            records[player_b][1] += stats.games
+        return records
+
+    def ratings(self):
+        '''Fit Elo ratings to every game played (Bradley-Terry maximum likelihood).
+        :return: dict of player -> (rating, 95% margin).
+        '''
+        results = [] # (index a, index b, wins a, games)
+        for index_a, index_b in itertools.combinations(range(len(self.players)), 2):
+            stats = self.pairings.get(f'{self.players[index_a]} vs {self.players[index_b]}')
+            if stats is not None and stats.games:
+                results.append((index_a, index_b, stats.wins[0], stats.games))
+        strengths = [1.0] * len(self.players)
+        for iteration in range(ELO_ITERATIONS):
+            for player in range(len(self.players)):
+                wins = 0.5 # Half a win and half a loss of prior keeps unbeaten players finite.
+                weight = 1 / (strengths[player] + 1)
+                for index_a, index_b, wins_a, games in results:
+                    if player == index_a:
+                        other, player_wins = index_b, wins_a
+                    elif player == index_b:
+                        other, player_wins = index_a, games - wins_a
+                    else:
+                        continue
+                    wins += player_wins
+                    weight += games / (strengths[player] + strengths[other])
+                strengths[player] = wins / weight
+        logs = [math.log(strength) for strength in strengths]
+        mean = sum(logs) / len(logs)
+        ratings = {}
+        for player, log_strength in enumerate(logs):
+            # Fisher information of the player's log strength, the others held fixed.
+            information = 0
+            for index_a, index_b, wins_a, games in results:
+                if player in (index_a, index_b):
+                    expected = strengths[index_a] / (strengths[index_a] + strengths[index_b])
+                    information += games * expected * (1 - expected)
+            margin = Z_95 / math.sqrt(information) * ELO_SCALE if information else float('inf')
+            ratings[self.players[player]] = (ELO_BASE + (log_strength - mean) * ELO_SCALE, margin)
+        return ratings
+
+    def table(self):
+        ''':return: The standings as text, best rating first.'''
+        records = self.records()
+        ratings = self.ratings()
+        width = max(len(player) for player in self.players)
+        lines = [f'{"player":{width}}  {"elo":>6} {"+/-":>5}  {"win rate":>8}  {"95% interval":>13}  {"games":>7}']
+        for player in sorted(self.players, key=lambda player: -ratings[player][0]):
+            wins, games = records[player]
+            low, high = wilson_interval(wins, games)
+            rating, margin = ratings[player]
+            lines.append(f'{player:{width}}  {rating:6.0f} {margin:5.0f}  {wins / games if games else 0:8.1%}  '
+                         f'{low:6.1%}-{high:6.1%}  {games:7}')
+        return '\n'.join(lines)
+
+    def to_dict(self):
+        records = self.records()
+        ratings = self.ratings()
+        return {
+            'config': self.config(),
+            'standings': {player: {'wins': records[player][0], 'games': records[player][1],
+                                   'win_rate_interval': wilson_interval(*records[player]),
+                                   'elo': ratings[player][0], 'elo_margin': ratings[player][1]}
+                          for player in self.players},
+            'pairings': {key: stats.to_dict() for key, stats in self.pairings.items()},
+        }
+
+def wilson_interval(wins, games, z=Z_95):
+    ''':return: (low, high) confidence interval for a win rate.'''
+    if not games:
+        return 0.0, 1.0
+    rate = wins / games
+    center = (rate + z * z / (2 * games)) / (1 + z * z / games)
+    spread = z * math.sqrt(rate * (1 - rate) / games + z * z / (4 * games * games)) / (1 + z * z / games)
+    return max(0.0, center - spread), min(1.0, center + spread)
+
+def run(tournament, workers=None, checkpoint=None, progress=None):
+    '''Play every chunk the tournament hasn't played yet.
+    :param workers: process count, defaults to the CPU count. 0 runs in this process.
+    :param checkpoint: path to save standings to as chunks finish.
+    :param progress: optional callable(tournament, chunks left).
+    '''
+    chunks = tournament.pending()
+    last_save = time.monotonic()
+
+    def finished(chunk, stats):
+        nonlocal last_save
+        tournament.add_chunk(chunk[0], chunk[3], stats)
+        if checkpoint and time.monotonic() - last_save >= CHECKPOINT_INTERVAL:
+            tournament.save(checkpoint)
+            last_save = time.monotonic()
+
+    try:
+        if workers == 0:
+            for left, chunk in enumerate(chunks):
+                finished(chunk, run_chunk(tournament.plugins, tournament.seed, *chunk))
+                if progress:
+                    progress(tournament, len(chunks) - left - 1)
+            return
+        workers = workers or os.cpu_count() or 1
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            # A couple of chunks queued per worker, an idle worker takes the next one.
+            chunk_iter = iter(chunks)
+            running = {}
+            for chunk in itertools.islice(chunk_iter, workers * 2):
+                running[executor.submit(run_chunk, tournament.plugins, tournament.seed, *chunk)] = chunk
+            left = len(chunks)
+            while running:
+                done, pending = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    finished(running.pop(future), future.result())
+                    left -= 1
+                    chunk = next(chunk_iter, None)
+                    if chunk is not None:
+                        running[executor.submit(run_chunk, tournament.plugins, tournament.seed, *chunk)] = chunk
+                if progress:
+                    progress(tournament, left)
+    finally:
+        # Even on Ctrl+C, keep what finished.
+        if checkpoint:
+            tournament.save(checkpoint)
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a round-robin tournament between strategies.')
+    parser.add_argument('players', nargs='+', help='"placement:targeting" specs, at least two')
+    parser.add_argument('-k', '--games', type=int, default=GAMES_PER_PAIRING, help='games per pairing')
+    parser.add_argument('--plugin', action='append', default=[], help='module that registers strategies')
+    parser.add_argument('--workers', type=int, default=None, help='default: CPU count, 0: no pool')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--checkpoint', help='save standings here and resume from it')
+    parser.add_argument('--restart', action='store_true', help='ignore what --checkpoint holds and start over')
+    parser.add_argument('--json', help='write the final standings to this file')
+    args = parser.parse_args()
+
+    load_plugins(args.plugin)
+    specs = {} # (placement, targeting) -> the spec it was entered as.
+    for spec in args.players:
+        try:
+            player = simulate.parse_player(spec)
+        except ValueError as error:
+            parser.error(str(error))
+        if player in specs:
+            parser.error(f'"{spec}" is the same player as "{specs[player]}", enter each player once')
+        specs[player] = spec
+    if len(specs) < 2:
+        parser.error('need at least two different players')
+    tournament = Tournament(args.players, args.games, args.seed, args.chunk_size, args.plugin)
+    if args.checkpoint and not args.restart:
+        try:
+            tournament.load(args.checkpoint)
+        except CheckpointError as error:
+            parser.exit(1, f'{error}\nUse a new --checkpoint path, or --restart to start this one over.\n')
+    started = time.monotonic()
+    last_report = [0]
+
+    def progress(tournament, left):
+        elapsed = time.monotonic() - started
+        if elapsed - last_report[0] >= simulate.REPORT_INTERVAL:
+            last_report[0] = elapsed
+            print(f'{left} chunks left, {elapsed:.0f}s', flush=True)
+
+    run(tournament, args.workers, args.checkpoint, progress)
+    print(tournament.table())
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(tournament.to_dict(), output, indent=2)
+
+if __name__ == '__main__':
+    main()
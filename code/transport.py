@@ -0,0 +1,294 @@
+'''Transports carry the frames sent by helpers.clean_send() and read by helpers.clean_receive().
+
+Every backend moves whole frames between two ends:
+
+    SocketTransport  any stream socket, TCP, socket.socketpair() or a Unix domain socket
+    QueueTransport   in-process, frames are handed over as objects and never copied
+
+Socket transports put the usual LENGTH_BYTES length prefix on the wire,
+a prefix over MAX_FRAME_SIZE is treated as a broken peer and closes the transport.
+TCP ones turn on keepalive, so a peer that vanished without closing (a
+dropped NAT mapping, a sleeping laptop) shows up as TransportClosed
+within about KEEPALIVE_IDLE + KEEPALIVE_INTERVAL * KEEPALIVE_COUNT
+seconds of silence, even if nobody sends anything.
+Queue transports skip the bytes entirely, so local bot games and
+protocol tests go through the same messages at memory speed.
+'''
+
+import os
+import queue
+import socket
+import tempfile
+
+# ===== Constants =====
+LENGTH_BYTES = 4
+READ_BUFFER_SIZE = 4096
+# Largest legal frame: a SALVO/REPLAY style message is a 4 byte header and up to
+# 0xFFFF entries (its count is 16 bits), the biggest entry is a 10 byte REPLAY shot.
+MAX_FRAME_SIZE = 4 + 0xFFFF * 10
+QUEUE_CLOSED = None # Put on a queue to tell the other end we closed.
+LOOPBACK = '127.0.0.1'
+KEEPALIVE_IDLE = 10 # Seconds of silence before TCP starts probing.
+KEEPALIVE_INTERVAL = 5 # Seconds between probes.
+KEEPALIVE_COUNT = 3 # Unanswered probes before the connection is dropped.
+
+class TransportClosed(ConnectionError):
+    '''Raised when the other end of a transport has gone away.'''
+
+
+class TransportTimeout(TransportClosed):
+    '''Raised when the other end went quiet for too long, we treat it as gone.'''
+
+
+def enable_keepalive(connection, idle=KEEPALIVE_IDLE, interval=KEEPALIVE_INTERVAL, count=KEEPALIVE_COUNT):
+    '''Turn on TCP keepalive with our timings, as far as this platform lets us.'''
+    connection.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+    elif hasattr(socket, 'TCP_KEEPALIVE'):
+        # macOS calls it TCP_KEEPALIVE.
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, idle)
+    elif hasattr(socket, 'SIO_KEEPALIVE_VALS'):
+        # Older Windows, milliseconds and no probe count.
+        connection.ioctl(socket.SIO_KEEPALIVE_VALS, (1, idle * 1000, interval * 1000))
+        return
+    if hasattr(socket, 'TCP_KEEPINTVL'):
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+    if hasattr(socket, 'TCP_KEEPCNT'):
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count)
+
+class Transport():
+    '''One end of a two way frame channel.'''
+
+    def send_frame(self, data):
+        raise NotImplementedError
+
+    def send_frames(self, frames):
+        '''Send several frames, in order.'''
+        for data in frames:
+            self.send_frame(data)
+
+    def receive_frame(self):
+        ''':return: The next frame as a bytes-like object. Raise TransportClosed if the peer left.'''
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class FrameReader():
+    """Buffered reader for length prefixed frames on one connection.
+    Data is read with recv_into() into a preallocated bytearray and
+    complete frames are handed back as memoryview slices of that buffer.
+    A returned view is only valid until the next call on the reader.
+    """
+
+    def __init__(self, socket, buffer_size=READ_BUFFER_SIZE):
+        self.socket = socket
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0 # First unconsumed byte.
+        self.end = 0 # One past the last received byte.
+
+    def next_frame(self):
+        """Return the next complete frame already in the buffer, or None.
+        Raise TransportClosed if the length prefix is over MAX_FRAME_SIZE.
+        """
+        available = self.end - self.start
+        if available < LENGTH_BYTES:
+            return None
+        length = int.from_bytes(self.view[self.start:self.start + LENGTH_BYTES], byteorder='big')
+        if length > MAX_FRAME_SIZE:
+            # Don't let a bad prefix make us allocate gigabytes.
+            raise TransportClosed(f'Frame of {length} bytes is over the {MAX_FRAME_SIZE} byte limit.')
+        if available < LENGTH_BYTES + length:
+            # Make sure there is room for the rest of this frame.
+            self.reserve(LENGTH_BYTES + length)
+            return None
+        frame_start = self.start + LENGTH_BYTES
+        self.start = frame_start + length
+        return self.view[frame_start:self.start]
+
+    def reserve(self, needed):
+        """Make room for needed bytes from start, compacting or growing the buffer."""
+        if self.start + needed <= len(self.buffer):
+            return
+        pending = self.end - self.start
+        if needed > len(self.buffer):
+            # Frame is larger than our buffer, grow it.
+            buffer = bytearray(max(needed, len(self.buffer) * 2))
+            buffer[:pending] = self.view[self.start:self.end]
+            self.buffer = buffer
+            self.view = memoryview(self.buffer)
+        else:
+            # Slide the partial frame to the front, no reallocation needed.
+            self.view[:pending] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = pending
+
+    def fill(self):
+        """Do one recv_into() on the socket.
+        Return the number of bytes read, 0 means the peer disconnected.
+        """
+        if self.start == self.end:
+            # Nothing pending, reuse the whole buffer.
+            self.start = self.end = 0
+        elif self.end == len(self.buffer):
+            self.reserve(self.end - self.start + 1)
+        try:
+            count = self.socket.recv_into(self.view[self.end:])
+        except ConnectionError:
+            return 0 # Reset by the peer, same as a close for us.
+        except TimeoutError:
+            return 0 # Keepalive gave up on the peer.
+        self.end += count
+        return count
+
+    def read_frame(self):
+        """Return the next frame as a memoryview, receiving as needed.
+        Raise TransportClosed if the peer disconnects.
+        """
+        while True:
+            frame = self.next_frame()
+            if frame is not None:
+                return frame
+            if not self.fill():
+                raise TransportClosed('The other end closed the connection.')
+
+class SocketTransport(Transport):
+    '''Length prefixed frames over a stream socket.'''
+
+    def __init__(self, connection):
+        self.socket = connection
+        self.reader = FrameReader(connection)
+        if connection.family in (socket.AF_INET, socket.AF_INET6):
+            # Every frame goes out in one sendall(), waiting to batch them only
+            # stalls a turn where we answer an attack and then send our own.
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            enable_keepalive(connection)
+
+    def send_frame(self, data):
+        self.send_bytes(len(data).to_bytes(LENGTH_BYTES, byteorder='big') + data)
+
+    def send_frames(self, frames):
+        '''All frames in one sendall(), the peer usually gets them in one read.'''
+        self.send_bytes(b''.join(len(data).to_bytes(LENGTH_BYTES, byteorder='big') + data
+                                 for data in frames))
+
+    def send_bytes(self, data):
+        try:
+            self.socket.sendall(data)
+        except (ConnectionError, TimeoutError) as error:
+            raise TransportClosed(f'The other end is gone: {error}')
+
+    def receive_frame(self):
+        ''':return: A memoryview, only valid until the next receive_frame().'''
+        return self.reader.read_frame()
+
+    def getpeername(self):
+        return self.socket.getpeername()
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def close(self):
+        self.socket.close()
+
+class QueueTransport(Transport):
+    '''In-process frames, the sent object itself is what the other end receives.
+    Don't change a bytearray after sending it.'''
+
+    def __init__(self, incoming, outgoing):
+        self.incoming = incoming
+        self.outgoing = outgoing
+        self.closed = False
+
+    def send_frame(self, data):
+        if self.closed:
+            raise TransportClosed('This end is closed.')
+        self.outgoing.put(data)
+
+    def receive_frame(self):
+        if self.closed:
+            raise TransportClosed('This end is closed.')
+        data = self.incoming.get()
+        if data is QUEUE_CLOSED:
+            self.closed = True
+            raise TransportClosed('The other end closed the connection.')
+        return data
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.outgoing.put(QUEUE_CLOSED)
+
+# ===== Backends =====
+def queue_pair():
+    ''':return: Two connected QueueTransports.'''
+    first, second = queue.SimpleQueue(), queue.SimpleQueue()
+    return QueueTransport(first, second), QueueTransport(second, first)
+
+def socket_pair():
+    ''':return: Two connected SocketTransports over socket.socketpair().'''
+    first, second = socket.socketpair()
+    return SocketTransport(first), SocketTransport(second)
+
+def tcp_listen(address, port):
+    '''Wait for one TCP connection. :return: SocketTransport.'''
+    with socket.create_server((address, port)) as server:
+        connection, peer_address = server.accept()
+    return SocketTransport(connection)
+
+def tcp_connect(address, port):
+    ''':return: SocketTransport connected to address, port.'''
+    return SocketTransport(socket.create_connection((address, port)))
+
+def unix_listen(path):
+    '''Wait for one connection on a Unix domain socket at path. :return: SocketTransport.'''
+    if os.path.exists(path):
+        os.remove(path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(path)
+        server.listen(1)
+        connection, peer_address = server.accept()
+    os.remove(path)
+    return SocketTransport(connection)
+
+def unix_connect(path):
+    ''':return: SocketTransport connected to the Unix domain socket at path.'''
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(path)
+    return SocketTransport(connection)
+
+def tcp_pair():
+    ''':return: Two SocketTransports connected over loopback TCP.'''
+    with socket.create_server((LOOPBACK, 0)) as server:
+        client = socket.create_connection(server.getsockname())
+        connection, peer_address = server.accept()
+    return SocketTransport(client), SocketTransport(connection)
+
+def unix_pair():
+    ''':return: Two SocketTransports connected over a Unix domain socket.'''
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'battleship.sock')
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(path)
+            server.listen(1)
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(path)
+            connection, peer_address = server.accept()
+    return SocketTransport(client), SocketTransport(connection)
+
+BACKENDS = {
+    'queue': queue_pair,
+    'socketpair': socket_pair,
+    'unix': unix_pair,
+    'tcp': tcp_pair,
+}
+
+def pair(backend='queue'):
+    ''':param backend: one of BACKENDS.
+    :return: Two connected transports, one for each end of a game.
+    '''
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown transport "{backend}", choose from {sorted(BACKENDS)}')
+    return BACKENDS[backend]()